@@ -1,18 +1,18 @@
 import numpy as np
 import matplotlib.pylab as plt
 import healpy as hp
-from lsst.sims.featureScheduler.modelObservatory import Model_observatory
 from lsst.sims.featureScheduler.schedulers import Core_scheduler, simple_filter_sched
 from lsst.sims.featureScheduler.utils import standard_goals, generate_goal_map, Footprint
 import lsst.sims.featureScheduler.basis_functions as bf
 from lsst.sims.featureScheduler.surveys import (Greedy_survey, generate_dd_surveys,
                                                 Blob_survey)
-from lsst.sims.featureScheduler import sim_runner
 import lsst.sims.featureScheduler.detailers as detailers
 import sys
 import subprocess
 import os
 import argparse
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from sim_tools import sim_runner, add_runner_args, runner_kwargs, preview_settings, get_observatory
 
 
 def gen_greedy_surveys(nside=32, nexp=2, exptime=30., filters=['r', 'i', 'z', 'y'],
@@ -270,18 +270,19 @@ def nes_light_footprints(nside=None):
 
 
 def run_sched(surveys, survey_length=365.25, nside=32, fileroot='baseline_', verbose=False,
-              extra_info=None, illum_limit=40.):
+              extra_info=None, illum_limit=40., observatory=None, **kwargs):
     years = np.round(survey_length/365.25)
     scheduler = Core_scheduler(surveys, nside=nside)
     n_visit_limit = None
     filter_sched = simple_filter_sched(illum_limit=illum_limit)
-    observatory = Model_observatory(nside=nside)
+    if observatory is None:
+        observatory = get_observatory(nside=nside)
     observatory, scheduler, observations = sim_runner(observatory, scheduler,
                                                       survey_length=survey_length,
                                                       filename=fileroot+'%iyrs.db' % years,
                                                       delete_past=True, n_visit_limit=n_visit_limit,
                                                       verbose=verbose, extra_info=extra_info,
-                                                      filter_scheduler=filter_sched)
+                                                      filter_scheduler=filter_sched, **kwargs)
 
 
 if __name__ == "__main__":
@@ -298,6 +299,8 @@ if __name__ == "__main__":
     parser.add_argument("--pair_time", type=float, default=22.)
     parser.set_defaults(scale_down=False)
 
+    add_runner_args(parser)
+
     args = parser.parse_args()
     survey_length = args.survey_length  # Days
     outDir = args.outDir
@@ -309,6 +312,7 @@ if __name__ == "__main__":
     pair_time = args.pair_time
 
     nside = 32
+    nside, survey_length = preview_settings(args, nside, survey_length)
     per_night = True  # Dither DDF per night
 
     camera_ddf_rot_limit = 75.
@@ -334,7 +338,7 @@ if __name__ == "__main__":
     else:
         footprints_hp = standard_goals(nside=nside)
 
-    observatory = Model_observatory(nside=nside)
+    observatory = get_observatory(nside=nside)
     conditions = observatory.return_conditions()
     footprints = Footprint(conditions.mjd_start, sun_RA_start=conditions.sun_RA_start, nside=nside)
     for i, key in enumerate(footprints_hp):
@@ -352,4 +356,5 @@ if __name__ == "__main__":
     surveys = [ddfs, blobs, greedy]
     run_sched(surveys, survey_length=survey_length, verbose=verbose,
               fileroot=os.path.join(outDir, fileroot+file_end), extra_info=extra_info,
-              nside=nside, illum_limit=illum_limit)
+              nside=nside, illum_limit=illum_limit, observatory=observatory,
+              **runner_kwargs(args))
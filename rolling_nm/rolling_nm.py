@@ -1,19 +1,21 @@
 import numpy as np
 import matplotlib.pylab as plt
 import healpy as hp
-from lsst.sims.featureScheduler.modelObservatory import Model_observatory
 from lsst.sims.featureScheduler.schedulers import Core_scheduler, simple_filter_sched
 from lsst.sims.featureScheduler.utils import (standard_goals, NES_healpixels, Footprint,
                                               Footprints, ra_dec_hp_map, Step_slopes, magellanic_clouds_healpixels)
 import lsst.sims.featureScheduler.basis_functions as bf
 from lsst.sims.featureScheduler.surveys import (Greedy_survey, generate_dd_surveys,
                                                 Blob_survey)
-from lsst.sims.featureScheduler import sim_runner
 import lsst.sims.featureScheduler.detailers as detailers
 import sys
 import subprocess
 import os
 import argparse
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from sim_tools import sim_runner, add_runner_args, runner_kwargs, preview_settings, get_observatory
+from sim_tools.fork import fork_sched
+from sim_tools.footprint_table import Footprint_table
 from astropy.coordinates import SkyCoord
 from astropy import units as u
 from lsst.utils import getPackageDir
@@ -69,11 +71,11 @@ def slice_wfd_area(nslice, target_map, scale_down_factor=0.2):
     return scaled_maps
 
 
-def wfd_half(target_map=None):
+def wfd_half(target_map=None, nside=32):
     """return Two maps that split the WFD in two dec bands
     """
     if target_map is None:
-        sg = standard_goals()
+        sg = standard_goals(nside=nside)
         target_map = sg['r'] + 0
     wfd_pix = np.where(target_map == 1)[0]
     wfd_map = target_map*0
@@ -134,7 +136,7 @@ def gen_greedy_surveys(nside=32, footprints=None,
 
     surveys = []
     detailer = detailers.Camera_rot_detailer(min_rot=np.min(camera_rot_limits), max_rot=np.max(camera_rot_limits))
-    wfd_halves = wfd_half()
+    wfd_halves = wfd_half(nside=nside)
     for filtername in filters:
         bfs = []
         bfs.append((bf.M5_diff_basis_function(filtername=filtername, nside=nside), m5_weight))
@@ -223,7 +225,7 @@ def generate_blobs(nside, nexp=2, footprints=None,
                           'twilight_scale': True}
 
     surveys = []
-    wfd_halves = wfd_half()
+    wfd_halves = wfd_half(nside=nside)
     times_needed = [pair_time, pair_time*2]
     for filtername, filtername2 in zip(filter1s, filter2s):
         detailer_list = []
@@ -306,18 +308,19 @@ def generate_blobs(nside, nexp=2, footprints=None,
 
 
 def run_sched(surveys, survey_length=365.25, nside=32, fileroot='baseline_', verbose=False,
-              extra_info=None, illum_limit=40.):
+              extra_info=None, illum_limit=40., observatory=None, **kwargs):
     years = np.round(survey_length/365.25)
     scheduler = Core_scheduler(surveys, nside=nside)
     n_visit_limit = None
     filter_sched = simple_filter_sched(illum_limit=illum_limit)
-    observatory = Model_observatory(nside=nside)
+    if observatory is None:
+        observatory = get_observatory(nside=nside)
     observatory, scheduler, observations = sim_runner(observatory, scheduler,
                                                       survey_length=survey_length,
                                                       filename=fileroot+'%iyrs.db' % years,
                                                       delete_past=True, n_visit_limit=n_visit_limit,
                                                       verbose=verbose, extra_info=extra_info,
-                                                      filter_scheduler=filter_sched)
+                                                      filter_scheduler=filter_sched, **kwargs)
 
 
 def make_rolling_footprints(mjd_start=59853.5, sun_RA_start=3.27717639, nslice=2, scale=0.8, nside=32):
@@ -335,12 +338,12 @@ def make_rolling_footprints(mjd_start=59853.5, sun_RA_start=3.27717639, nslice=2
         rolling = [up, down, down, down, down, down]
     all_slopes = [start + np.roll(rolling, i).tolist()+end for i in range(nslice)]
 
-    fp_non_wfd = Footprint(mjd_start, sun_RA_start=sun_RA_start)
+    fp_non_wfd = Footprint(mjd_start, sun_RA_start=sun_RA_start, nside=nside)
     rolling_footprints = []
     for i in range(nslice):
         step_func = Step_slopes(rise=all_slopes[i])
         rolling_footprints.append(Footprint(mjd_start, sun_RA_start=sun_RA_start,
-                                            step_func=step_func))
+                                            step_func=step_func, nside=nside))
 
     split_wfd_indices = slice_wfd_area_quad(hp_footprints, nslice=nslice)
     wfd = hp_footprints['r'] * 0
@@ -472,6 +475,17 @@ if __name__ == "__main__":
     parser.add_argument("--nslice", type=int, default=2)
     parser.add_argument("--scale", type=float, default=0.8)
     parser.add_argument("--nexp", type=int, default=2)
+    parser.add_argument("--fork_scales", type=float, nargs='+', default=None,
+                        help="Run all these scales from one shared start, rather than just --scale")
+    parser.add_argument("--fork_nslices", type=int, nargs='+', default=None,
+                        help="nslice values to use with --fork_scales (default just --nslice)")
+    parser.add_argument("--fork_processes", type=int, default=1,
+                        help="Number of forked variants to run at once")
+    parser.add_argument("--footprint_table", dest='footprint_table', action='store_true',
+                        help="Look the rolling footprints up from per-night tables compiled into outDir")
+    parser.set_defaults(footprint_table=False)
+
+    add_runner_args(parser)
 
     args = parser.parse_args()
     survey_length = args.survey_length  # Days
@@ -481,8 +495,14 @@ if __name__ == "__main__":
     scale = args.scale
     nslice = args.nslice
     nexp = args.nexp
+    fork_scales = args.fork_scales
+    fork_nslices = args.fork_nslices
+    if fork_nslices is None:
+        fork_nslices = [nslice]
+    footprint_table = args.footprint_table
 
     nside = 32
+    nside, survey_length = preview_settings(args, nside, survey_length)
     per_night = True  # Dither DDF per night
     mixed_pairs = True  # For the blob scheduler
     camera_ddf_rot_limit = 75.
@@ -505,7 +525,7 @@ if __name__ == "__main__":
     file_end = 'v1.7_'
 
     # Mark position of the sun at the start of the survey. Usefull for rolling cadence.
-    observatory = Model_observatory(nside=nside)
+    observatory = get_observatory(nside=nside)
     conditions = observatory.return_conditions()
     sun_ra_0 = conditions.sunRA  # radians
 
@@ -516,14 +536,46 @@ if __name__ == "__main__":
                         detailers.Euclid_dither_detailer()]
     ddfs = generate_dd_surveys(nside=nside, nexp=nexp, detailers=details, euclid_detailers=euclid_detailers)
 
-    # Set up rolling maps
-    footprints = make_rolling_footprints(mjd_start=conditions.mjd_start,
-                                         sun_RA_start=conditions.sun_RA_start, nslice=nslice, scale=scale,
-                                         nside=nside)
-
-    greedy = gen_greedy_surveys(nside, nexp=nexp, footprints=footprints)
-    blobs = generate_blobs(nside, nexp=nexp, footprints=footprints)
-    surveys = [ddfs, blobs, greedy]
-    run_sched(surveys, survey_length=survey_length, verbose=verbose,
-              fileroot=os.path.join(outDir, fileroot+file_end), extra_info=extra_info,
-              nside=nside)
+    if fork_scales is not None:
+        # All the variants are the same until the rolling starts, so simulate that part once
+        variants = [(fork_scale, fork_nslice) for fork_nslice in fork_nslices for fork_scale in fork_scales]
+        variant_footprints = []
+        fileroots = []
+        for fork_scale, fork_nslice in variants:
+            variant_footprints.append(make_rolling_footprints(mjd_start=conditions.mjd_start,
+                                                              sun_RA_start=conditions.sun_RA_start,
+                                                              nslice=fork_nslice, scale=fork_scale,
+                                                              nside=nside))
+            fileroot = 'rolling_nm_scale%.1f_nslice%i_' % (fork_scale, fork_nslice)
+            if nexp != 2:
+                fileroot += 'nexp%i_' % nexp
+            fileroots.append(os.path.join(outDir, fileroot+file_end))
+            if footprint_table:
+                variant_footprints[-1] = Footprint_table(variant_footprints[-1], conditions.mjd_start,
+                                                         int(np.ceil(survey_length)) + 1,
+                                                         fileroots[-1] + 'footprint_table.npy')
+        variant_info = ['scale %.1f nslice %i' % variant for variant in variants]
+
+        greedy = gen_greedy_surveys(nside, nexp=nexp, footprints=variant_footprints[0])
+        blobs = generate_blobs(nside, nexp=nexp, footprints=variant_footprints[0])
+        surveys = [ddfs, blobs, greedy]
+        fork_sched(surveys, variant_footprints, fileroots, survey_length=survey_length, verbose=verbose,
+                   extra_info=extra_info, nside=nside, variant_info=variant_info,
+                   processes=args.fork_processes, observatory=observatory,
+                   settings={'nexp': nexp, 'maxDither': max_dither, 'footprint_table': footprint_table},
+                   **runner_kwargs(args))
+    else:
+        # Set up rolling maps
+        footprints = make_rolling_footprints(mjd_start=conditions.mjd_start,
+                                             sun_RA_start=conditions.sun_RA_start, nslice=nslice, scale=scale,
+                                             nside=nside)
+        if footprint_table:
+            footprints = Footprint_table(footprints, conditions.mjd_start, int(np.ceil(survey_length)) + 1,
+                                         os.path.join(outDir, fileroot+file_end+'footprint_table.npy'))
+
+        greedy = gen_greedy_surveys(nside, nexp=nexp, footprints=footprints)
+        blobs = generate_blobs(nside, nexp=nexp, footprints=footprints)
+        surveys = [ddfs, blobs, greedy]
+        run_sched(surveys, survey_length=survey_length, verbose=verbose,
+                  fileroot=os.path.join(outDir, fileroot+file_end), extra_info=extra_info,
+                  nside=nside, observatory=observatory, **runner_kwargs(args))
@@ -0,0 +1,12 @@
+"""
+Tools shared by the driver scripts in this repo.
+
+The drivers in each run directory import from here (after adding the repo root
+to sys.path) so that run-level features like checkpointing only need to be
+written once, rather than pasted into every copy of run_sched.
+"""
+from .runner import sim_runner
+from .checkpoint import write_snapshot, save_checkpoint, load_checkpoint, latest_checkpoint
+from .driver import add_runner_args, runner_kwargs, preview_settings
+from .monitors import Run_monitor
+from .shared import register_observatory, get_observatory
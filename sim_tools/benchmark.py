@@ -0,0 +1,217 @@
+"""
+Benchmark the drivers over a fixed window and keep a history of the results.
+
+Example, from the repo root:
+
+    python -m sim_tools.benchmark run --label "new sky model"
+    python -m sim_tools.benchmark compare
+
+run simulates the same 30 nights with each of the benchmark drivers, one subprocess at a
+time, and appends the results to the history file (benchmark_history.json by default).
+For each driver it records visits per second and seconds per simulated night for the
+observe loop, the startup time (launching python, building the surveys and observatory,
+up to the first observation) and the peak RSS of the run.
+
+compare checks the latest entry against the one before it (or any two entries) and
+flags every driver that got slower, or used more memory, by more than the threshold.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import datetime
+import tempfile
+import subprocess
+
+
+__all__ = ['benchmark_drivers', 'benchmark_driver', 'run_benchmarks', 'read_history', 'compare_benchmarks']
+
+# One driver from each family, with the args for its standard configuration
+benchmark_drivers = {'baseline': ['baseline/baseline.py'],
+                     'rolling': ['rolling/rolling.py'],
+                     'rolling_nm': ['rolling_nm/rolling_nm.py'],
+                     'twi_neo': ['twi_neo/twilight_neo.py'],
+                     'twi_pairs': ['twi_pairs/twi_pairs.py'],
+                     'u_long': ['u_long/u_long_msnaps.py'],
+                     'wfd_cadence_drive': ['wfd_cadence_drive/cadence_drive.py'],
+                     'carina': ['technical/carina/carina.py'],
+                     'no_rot': ['technical/rot_time/no_rot.py']}
+
+# Which direction is worse for each metric
+_higher_is_worse = {'visits_per_sec': False, 'sec_per_night': True,
+                    'startup_sec': True, 'startup_rss_mb': True, 'peak_rss_mb': True}
+
+_repo_root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def _git_hash():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=_repo_root,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        return 'Not in git repo'
+
+
+def benchmark_driver(name, nights=30., work_dir=None, extra_args=None):
+    """
+    Run one benchmark driver and return its timings
+
+    Returns
+    -------
+    result : dict
+        visits_per_sec, sec_per_night, startup_sec, startup_rss_mb (peak before the first
+        visit), peak_rss_mb, n_visits, n_nights
+    """
+    if extra_args is None:
+        extra_args = []
+    out_dir = tempfile.mkdtemp(prefix='benchmark_%s_' % name, dir=work_dir)
+    timing_file = os.path.join(out_dir, 'timing.json')
+    driver = benchmark_drivers[name]
+    command = ([sys.executable, os.path.join(_repo_root, driver[0])] + driver[1:] +
+               ['--survey_length', str(nights), '--outDir', out_dir, '--timing_file', timing_file] +
+               extra_args)
+    print(' '.join(command))
+    launched = time.time()
+    try:
+        subprocess.check_call(command, cwd=os.path.dirname(os.path.join(_repo_root, driver[0])),
+                              stdout=subprocess.DEVNULL)
+        with open(timing_file) as f:
+            timing = json.load(f)
+    finally:
+        shutil.rmtree(out_dir)
+    loop_seconds = timing['loop_seconds']
+    result = {'visits_per_sec': timing['n_visits'] / loop_seconds,
+              'sec_per_night': loop_seconds / nights,
+              'startup_sec': timing['loop_start'] - launched,
+              'startup_rss_mb': timing['startup_rss_mb'],
+              'peak_rss_mb': timing['peak_rss_mb'],
+              'n_visits': timing['n_visits'],
+              'n_nights': timing['n_nights']}
+    return result
+
+
+def run_benchmarks(names=None, nights=30., history_file='benchmark_history.json', label='',
+                   work_dir=None, extra_args=None):
+    """
+    Benchmark drivers and append the results to the history file
+
+    Returns
+    -------
+    entry : dict
+        The history entry that was added
+    """
+    if names is None:
+        names = sorted(benchmark_drivers.keys())
+    entry = {'date': datetime.datetime.now().isoformat(), 'git hash': _git_hash(),
+             'host': socket.gethostname(), 'python': sys.version.split()[0], 'label': label,
+             'nights': nights, 'extra args': extra_args, 'results': {}}
+    for name in names:
+        entry['results'][name] = benchmark_driver(name, nights=nights, work_dir=work_dir,
+                                                  extra_args=extra_args)
+    history = read_history(history_file)
+    history.append(entry)
+    with open(history_file + '.tmp', 'w') as f:
+        json.dump(history, f, indent=1)
+    os.replace(history_file + '.tmp', history_file)
+    return entry
+
+
+def read_history(history_file):
+    if not os.path.isfile(history_file):
+        return []
+    with open(history_file) as f:
+        return json.load(f)
+
+
+def compare_benchmarks(old, new, threshold=0.1):
+    """
+    Compare two history entries
+
+    Parameters
+    ----------
+    old : dict
+        Reference entry
+    new : dict
+        Entry to check
+    threshold : float (0.1)
+        Fractional change counted as a regression
+
+    Returns
+    -------
+    rows : list of [driver, metric, old value, new value, fractional change, regression]
+        Fractional change is signed so positive is worse.
+    """
+    rows = []
+    for name in sorted(new['results'].keys()):
+        if name not in old['results']:
+            continue
+        for metric, higher_is_worse in sorted(_higher_is_worse.items()):
+            # Older entries may not have every metric
+            if metric not in old['results'][name] or metric not in new['results'][name]:
+                continue
+            old_val = old['results'][name][metric]
+            new_val = new['results'][name][metric]
+            change = (new_val - old_val) / old_val if old_val != 0 else 0.
+            if not higher_is_worse:
+                change = -change
+            rows.append([name, metric, old_val, new_val, change, change > threshold])
+    return rows
+
+
+def _describe(entry):
+    return '%s %s %s' % (entry['date'], entry['git hash'][:10], entry['label'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the drivers and compare against past runs")
+    parser.add_argument("--history", type=str, default='benchmark_history.json',
+                        help="json file holding the benchmark history")
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help="benchmark the drivers and add to the history")
+    run_parser.add_argument("--drivers", type=str, nargs='+', default=None,
+                            help="which drivers to run (default all: %s)" % ', '.join(sorted(benchmark_drivers)))
+    run_parser.add_argument("--nights", type=float, default=30.)
+    run_parser.add_argument("--label", type=str, default='', help="note to keep with the results")
+    run_parser.add_argument("--work_dir", type=str, default=None, help="where to put the scratch output")
+    run_parser.add_argument("--driver_args", type=str, nargs=argparse.REMAINDER, default=None,
+                            help="extra args passed to every driver, e.g. --driver_args --intern_bfs")
+
+    compare_parser = subparsers.add_parser('compare', help="flag regressions between two history entries")
+    compare_parser.add_argument("--old", type=int, default=-2, help="index of the reference entry")
+    compare_parser.add_argument("--new", type=int, default=-1, help="index of the entry to check")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="fractional change that counts as a regression")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        entry = run_benchmarks(names=args.drivers, nights=args.nights, history_file=args.history,
+                               label=args.label, work_dir=args.work_dir, extra_args=args.driver_args)
+        print('%-20s %12s %12s %12s %14s %12s' % ('driver', 'visits/sec', 'sec/night', 'startup (s)',
+                                                  'startup RSS', 'peak RSS'))
+        for name, result in sorted(entry['results'].items()):
+            print('%-20s %12.2f %12.2f %12.1f %14.0f %12.0f' % (name, result['visits_per_sec'], result['sec_per_night'],
+                                                                result['startup_sec'], result['startup_rss_mb'],
+                                                                result['peak_rss_mb']))
+    elif args.command == 'compare':
+        history = read_history(args.history)
+        if len(history) < 2:
+            raise SystemExit('Need at least two entries in %s to compare' % args.history)
+        old = history[args.old]
+        new = history[args.new]
+        print('old: %s' % _describe(old))
+        print('new: %s' % _describe(new))
+        rows = compare_benchmarks(old, new, threshold=args.threshold)
+        n_regressions = 0
+        for name, metric, old_val, new_val, change, regression in rows:
+            flag = 'REGRESSION' if regression else ''
+            n_regressions += regression
+            print('%-20s %-16s %12.3f %12.3f %+8.1f%% %s' % (name, metric, old_val, new_val, change*100, flag))
+        if n_regressions > 0:
+            print('%i regressions beyond %.0f%%' % (n_regressions, args.threshold*100))
+            raise SystemExit(1)
+    else:
+        parser.print_help()
@@ -0,0 +1,167 @@
+import os
+import time
+import json
+import tracemalloc
+import numpy as np
+from .monitors import Run_monitor
+
+
+__all__ = ['Bf_profiler']
+
+
+class Bf_profiler(Run_monitor):
+    """
+    Time the basis functions and reward calculations of every survey in a scheduler
+
+    The timing wrappers are put on the classes rather than the objects, so the basis
+    function objects themselves are untouched (they still pickle, compare and swap
+    as normal). The wrappers come off again in finish.
+
+    Results are kept per basis function class and per survey. Each entry has the number
+    of calls and total seconds for __call__, check_feasibility and add_observation, plus
+    the largest array returned. With trace_memory, the peak memory allocated inside a
+    call is recorded as well (needs python 3.9+ for tracemalloc.reset_peak, and slows
+    everything down, so the times are less useful).
+
+    Parameters
+    ----------
+    trace_memory : bool (False)
+        Track peak allocations inside each call with tracemalloc.
+    """
+    bf_methods = ['__call__', 'check_feasibility', 'add_observation']
+    survey_methods = ['calc_reward_function']
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory and hasattr(tracemalloc, 'reset_peak')
+        self.labels = {}
+        self.patched = []
+        self.active = set()
+        self.current_survey = None
+        self.bf_stats = {}
+        self.survey_stats = {}
+
+    def _patch(self, cls, name, make_wrapper):
+        if (cls, name) in [(val[0], val[1]) for val in self.patched]:
+            return
+        self.patched.append((cls, name, cls.__dict__.get(name)))
+        setattr(cls, name, make_wrapper(name, getattr(cls, name)))
+
+    def _unpatch(self):
+        for cls, name, original in self.patched[::-1]:
+            if original is None:
+                delattr(cls, name)
+            else:
+                setattr(cls, name, original)
+        self.patched = []
+
+    @staticmethod
+    def _add(stats, name, dt, nbytes, peak):
+        entry = stats.setdefault(name, {'calls': 0, 'seconds': 0., 'max_result_bytes': 0,
+                                        'peak_alloc_bytes': 0})
+        entry['calls'] += 1
+        entry['seconds'] += dt
+        entry['max_result_bytes'] = max(entry['max_result_bytes'], nbytes)
+        entry['peak_alloc_bytes'] = max(entry['peak_alloc_bytes'], peak)
+
+    def _bf_wrapper(self, name, func):
+        profiler = self
+
+        def wrapper(bf, *args, **kwargs):
+            key = (id(bf), name)
+            # A subclass method calling its (also wrapped) parent only gets counted once
+            if key in profiler.active:
+                return func(bf, *args, **kwargs)
+            profiler.active.add(key)
+            if profiler.trace_memory:
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            t0 = time.perf_counter()
+            try:
+                result = func(bf, *args, **kwargs)
+            finally:
+                profiler.active.discard(key)
+            dt = time.perf_counter() - t0
+            peak = 0
+            if profiler.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] - before
+            nbytes = result.nbytes if isinstance(result, np.ndarray) else 0
+            bf_name = type(bf).__name__
+            profiler._add(profiler.bf_stats.setdefault(bf_name, {}), name, dt, nbytes, peak)
+            if profiler.current_survey is not None:
+                survey_entry = profiler.survey_stats[profiler.current_survey]
+                profiler._add(survey_entry['basis_functions'].setdefault(bf_name, {}), name, dt, nbytes, peak)
+            return result
+        return wrapper
+
+    def _survey_wrapper(self, name, func):
+        profiler = self
+
+        def wrapper(survey, *args, **kwargs):
+            label = profiler.labels.get(id(survey))
+            if label is None or label == profiler.current_survey:
+                return func(survey, *args, **kwargs)
+            previous = profiler.current_survey
+            profiler.current_survey = label
+            t0 = time.perf_counter()
+            try:
+                result = func(survey, *args, **kwargs)
+            finally:
+                profiler.current_survey = previous
+            dt = time.perf_counter() - t0
+            profiler._add(profiler.survey_stats[label], name, dt, 0, 0)
+            return result
+        return wrapper
+
+    @staticmethod
+    def survey_label(tier, index, survey):
+        name = getattr(survey, 'survey_note', None)
+        if name is None:
+            name = getattr(survey, 'survey_name', type(survey).__name__)
+        filtername = getattr(survey, 'filtername', None)
+        if filtername is not None and filtername not in name:
+            name = '%s, %s' % (name, filtername)
+        return '%i.%i %s' % (tier, index, name)
+
+    def start(self, observatory, scheduler):
+        for tier, survey_list in enumerate(scheduler.survey_lists):
+            for index, survey in enumerate(survey_list):
+                label = self.survey_label(tier, index, survey)
+                self.labels[id(survey)] = label
+                self.survey_stats.setdefault(label, {'basis_functions': {}})
+                for name in self.survey_methods:
+                    self._patch(type(survey), name, self._survey_wrapper)
+                for basis_function in survey.basis_functions:
+                    for name in self.bf_methods:
+                        self._patch(type(basis_function), name, self._bf_wrapper)
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def report(self):
+        """
+        Returns
+        -------
+        report : dict
+            'basis_functions' has the totals for each basis function class, 'surveys'
+            the reward totals and basis function breakdown for each survey.
+        """
+        return {'basis_functions': self.bf_stats, 'surveys': self.survey_stats,
+                'trace_memory': self.trace_memory}
+
+    def summary(self):
+        """Total calls and seconds for each basis function class, slowest first"""
+        totals = []
+        for bf_name, methods in self.bf_stats.items():
+            calls = sum([entry['calls'] for entry in methods.values()])
+            seconds = sum([entry['seconds'] for entry in methods.values()])
+            totals.append((bf_name, calls, seconds))
+        totals.sort(key=lambda val: val[2], reverse=True)
+        return [[name, calls, round(seconds, 3)] for name, calls, seconds in totals]
+
+    def finish(self, observatory, scheduler, extra_info, filename):
+        self._unpatch()
+        if self.trace_memory:
+            tracemalloc.stop()
+        extra_info['basis function profile'] = json.dumps(self.summary())
+        if filename is not None:
+            with open(os.path.splitext(filename)[0] + '_bf_profile.json', 'w') as f:
+                json.dump(self.report(), f, indent=1)
@@ -0,0 +1,52 @@
+"""
+Check that a run-level option leaves the schedule unchanged.
+
+Example, from the repo root:
+
+    python -m sim_tools.check_option --option=--intern_bfs baseline/baseline.py --nexp 2
+
+Runs the driver twice into a scratch directory, once as given and once with the extra
+option(s), and compares the observations in the two output .db files row by row. Use it
+for options that are only meant to make runs faster or cheaper, not different.
+"""
+import os
+import glob
+import shutil
+import argparse
+import tempfile
+from .compare_db import compare_db
+from .check_resume import run_driver
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a driver option gives identical output")
+    parser.add_argument("driver", type=str, help="driver script to run")
+    parser.add_argument("--option", type=str, action='append', default=[],
+                        help="option to add to the second run, e.g. --option=--intern_bfs (can repeat)")
+    parser.add_argument("--survey_length", type=float, default=30.)
+    parser.add_argument("--work_dir", type=str, default=None)
+    args, driver_args = parser.parse_known_args()
+
+    work_dir = args.work_dir
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='check_option_')
+    plain_dir = os.path.join(work_dir, 'plain')
+    option_dir = os.path.join(work_dir, 'option')
+    for dirname in [plain_dir, option_dir]:
+        if os.path.isdir(dirname):
+            shutil.rmtree(dirname)
+        os.makedirs(dirname)
+
+    common = ['--survey_length', str(args.survey_length)]
+    run_driver(args.driver, driver_args, plain_dir, common)
+    run_driver(args.driver, driver_args, option_dir, common + args.option)
+
+    file1 = glob.glob(os.path.join(plain_dir, '*.db'))[0]
+    file2 = glob.glob(os.path.join(option_dir, '*.db'))[0]
+    differences = compare_db(file1, file2)
+    if len(differences) == 0:
+        print('Run with %s matches run without' % ' '.join(args.option))
+    else:
+        for diff in differences:
+            print(diff)
+        raise SystemExit(1)
@@ -0,0 +1,64 @@
+"""
+Check that a killed-and-resumed run gives the same observations as an uninterrupted one.
+
+Example, from the repo root:
+
+    python -m sim_tools.check_resume baseline/baseline.py --nexp 2
+
+Runs the driver three times into a scratch directory: once straight through with
+checkpoints on, once stopped after a checkpoint, and once resumed from that checkpoint.
+The two output .db files are then compared row by row.
+"""
+import os
+import sys
+import glob
+import shutil
+import argparse
+import subprocess
+import tempfile
+from .compare_db import compare_db
+
+
+def run_driver(driver, driver_args, out_dir, extra_args):
+    command = [sys.executable, driver] + driver_args + ['--outDir', out_dir] + extra_args
+    print(' '.join(command))
+    subprocess.check_call(command)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check checkpoint/resume gives identical output")
+    parser.add_argument("driver", type=str, help="driver script to run")
+    parser.add_argument("--survey_length", type=float, default=30.)
+    parser.add_argument("--checkpoint_nights", type=int, default=5)
+    parser.add_argument("--stop_night", type=int, default=10)
+    parser.add_argument("--work_dir", type=str, default=None)
+    args, driver_args = parser.parse_known_args()
+
+    work_dir = args.work_dir
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='check_resume_')
+    straight_dir = os.path.join(work_dir, 'straight')
+    resumed_dir = os.path.join(work_dir, 'resumed')
+    for dirname in [straight_dir, resumed_dir]:
+        if os.path.isdir(dirname):
+            shutil.rmtree(dirname)
+        os.makedirs(dirname)
+
+    common = ['--survey_length', str(args.survey_length),
+              '--checkpoint_nights', str(args.checkpoint_nights)]
+    run_driver(args.driver, driver_args, straight_dir, common)
+    run_driver(args.driver, driver_args, resumed_dir, common + ['--checkpoint_stop', str(args.stop_night)])
+    # A streaming run leaves a partial output file behind, so only check the others
+    if '--stream_db' not in driver_args and len(glob.glob(os.path.join(resumed_dir, '*.db'))) > 0:
+        raise RuntimeError('Interrupted run wrote an output file, stop_night is too late for survey_length')
+    run_driver(args.driver, driver_args, resumed_dir, common + ['--resume'])
+
+    file1 = glob.glob(os.path.join(straight_dir, '*.db'))[0]
+    file2 = glob.glob(os.path.join(resumed_dir, '*.db'))[0]
+    differences = compare_db(file1, file2)
+    if len(differences) == 0:
+        print('Resumed run matches uninterrupted run')
+    else:
+        for diff in differences:
+            print(diff)
+        raise SystemExit(1)
@@ -0,0 +1,90 @@
+import os
+import glob
+import pickle
+import random
+import numpy as np
+
+
+__all__ = ['write_snapshot', 'save_checkpoint', 'load_checkpoint', 'latest_checkpoint']
+
+
+def _checkpoint_files(checkpoint_dir):
+    return sorted(glob.glob(os.path.join(checkpoint_dir, 'checkpoint_night*.pkl')))
+
+
+def write_snapshot(filename, state):
+    """
+    Pickle the state of a simulation to filename
+
+    Everything that goes into one snapshot is pickled in a single call, so objects that are
+    shared between the scheduler and the observatory (conditions, footprints, etc) are still
+    shared after a restore. The global random number generator states are saved along with
+    the objects, since the surveys draw from np.random directly.
+    """
+    state = dict(state)
+    state['np_random_state'] = np.random.get_state()
+    state['py_random_state'] = random.getstate()
+    # Write to a temp file and move it into place, so a job killed mid-write
+    # never leaves a truncated file behind.
+    temp_name = filename + '.tmp'
+    with open(temp_name, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_name, filename)
+    return filename
+
+
+def save_checkpoint(checkpoint_dir, night, state, keep=2):
+    """
+    Snapshot the state of a simulation into a directory of numbered checkpoints
+
+    Parameters
+    ----------
+    checkpoint_dir : str
+        Directory to write the snapshot to. Created if needed.
+    night : int
+        The number of nights simulated so far. Used to name the file.
+    state : dict
+        The objects to save (observatory, scheduler, observations, loop counters, ...)
+    keep : int (2)
+        The number of snapshots to keep. Older ones are removed once the new one is written.
+
+    Returns
+    -------
+    filename : str
+        The snapshot file that was written
+    """
+    if not os.path.isdir(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+    filename = write_snapshot(os.path.join(checkpoint_dir, 'checkpoint_night%05i.pkl' % night), state)
+
+    if keep is not None:
+        for old in _checkpoint_files(checkpoint_dir)[:-keep]:
+            os.remove(old)
+    return filename
+
+
+def load_checkpoint(filename):
+    """
+    Load a snapshot written by write_snapshot or save_checkpoint
+
+    The random number generator states saved with the snapshot are restored as well.
+
+    Returns
+    -------
+    state : dict
+    """
+    with open(filename, 'rb') as f:
+        state = pickle.load(f)
+    np.random.set_state(state.pop('np_random_state'))
+    random.setstate(state.pop('py_random_state'))
+    return state
+
+
+def latest_checkpoint(checkpoint_dir):
+    """
+    Return the most recent snapshot in checkpoint_dir, or None if there isn't one.
+    """
+    files = _checkpoint_files(checkpoint_dir)
+    if len(files) == 0:
+        return None
+    return files[-1]
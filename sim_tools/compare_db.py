@@ -0,0 +1,82 @@
+import sqlite3
+import argparse
+
+
+__all__ = ['compare_db']
+
+
+def _tables(conn):
+    names = conn.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name").fetchall()
+    return [name[0] for name in names]
+
+
+def compare_db(file1, file2, skip_tables=('info',)):
+    """
+    Check that two simulation output files hold exactly the same observations
+
+    The info table is skipped by default, since it records things like the command line
+    and the run date that are expected to differ between two otherwise identical runs.
+
+    Parameters
+    ----------
+    file1 : str
+        First sqlite file
+    file2 : str
+        Second sqlite file
+    skip_tables : list of str (['info'])
+        Table names (case insensitive) to leave out of the comparison
+
+    Returns
+    -------
+    differences : list of str
+        Description of each difference found. Empty if the files match.
+    """
+    skip = [name.lower() for name in skip_tables]
+    differences = []
+    conn1 = sqlite3.connect(file1)
+    conn2 = sqlite3.connect(file2)
+    tables1 = [name for name in _tables(conn1) if name.lower() not in skip]
+    tables2 = [name for name in _tables(conn2) if name.lower() not in skip]
+    if tables1 != tables2:
+        differences.append('Tables differ: %s vs %s' % (tables1, tables2))
+
+    for table in [name for name in tables1 if name in tables2]:
+        cursor1 = conn1.execute('SELECT * FROM "%s"' % table)
+        cursor2 = conn2.execute('SELECT * FROM "%s"' % table)
+        columns1 = [val[0] for val in cursor1.description]
+        columns2 = [val[0] for val in cursor2.description]
+        if columns1 != columns2:
+            differences.append('%s: columns differ' % table)
+            continue
+        row_num = 0
+        while True:
+            row1 = cursor1.fetchone()
+            row2 = cursor2.fetchone()
+            if row1 is None and row2 is None:
+                break
+            if row1 is None or row2 is None:
+                differences.append('%s: row counts differ, first extra row at %i' % (table, row_num))
+                break
+            if row1 != row2:
+                cols = [col for col, val1, val2 in zip(columns1, row1, row2) if val1 != val2]
+                differences.append('%s: row %i differs in %s' % (table, row_num, ', '.join(cols)))
+                break
+            row_num += 1
+    conn1.close()
+    conn2.close()
+    return differences
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the observations in two output .db files")
+    parser.add_argument("file1", type=str)
+    parser.add_argument("file2", type=str)
+    args = parser.parse_args()
+
+    differences = compare_db(args.file1, args.file2)
+    if len(differences) == 0:
+        print('Files match')
+    else:
+        for diff in differences:
+            print(diff)
+        raise SystemExit(1)
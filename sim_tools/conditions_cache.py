@@ -0,0 +1,177 @@
+"""
+Per-timestep cache of the HEALPix maps derived from a Conditions object.
+
+A lot of the basis functions in the drivers only depend on the current conditions and how
+they were configured: the zenith shadow, moon and planet masks, the 5-sigma depth
+difference, the slew time map, etc. Every survey has its own copies of these, so each map
+gets recomputed a dozen or more times per decision. Here the _calc_value of those classes
+is wrapped so the first basis function to ask for a map computes it, and every other one
+configured the same way gets a copy of that result until the conditions move on.
+"""
+import json
+import numpy as np
+from .monitors import Run_monitor
+
+
+__all__ = ['Conditions_cache', 'get_conditions_cache', 'Conditions_cache_monitor',
+           'default_cached_bfs']
+
+# Basis functions that only depend on the conditions and their constructor arguments
+default_cached_bfs = ['Zenith_shadow_mask_basis_function', 'Moon_avoidance_basis_function',
+                      'Planet_mask_basis_function', 'M5_diff_basis_function',
+                      'Slewtime_basis_function', 'Near_sun_twilight_basis_function',
+                      'Solar_elongation_mask_basis_function']
+
+# Attributes the base basis function uses to track its own evaluation, not configuration
+_state_attrs = ['value', 'mjd_last', 'recalc']
+
+
+class Conditions_cache(object):
+    """
+    Maps computed from one set of conditions, with hit and miss counters
+
+    The cache is emptied when the conditions it is attached to change (new mjd, filter,
+    or telescope pointing). The counters keep running.
+    """
+    def __init__(self):
+        self.step_key = None
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+        self.hits_by_name = {}
+        self.misses_by_name = {}
+
+    @staticmethod
+    def _step_key(conditions):
+        return (id(conditions), conditions.mjd, getattr(conditions, 'current_filter', None),
+                getattr(conditions, 'telRA', None), getattr(conditions, 'telDec', None))
+
+    def get(self, conditions, key, compute):
+        """
+        Return the cached value for key under the current conditions, computing it if needed
+
+        Parameters
+        ----------
+        conditions : Conditions
+        key : tuple
+            Anything hashable that identifies the map. key[0] is used as the name for the
+            per-name counters.
+        compute : callable
+            Called with no arguments to make the value on a miss.
+        """
+        step_key = self._step_key(conditions)
+        if step_key != self.step_key:
+            self.values = {}
+            self.step_key = step_key
+        name = key[0]
+        if key in self.values:
+            self.hits += 1
+            self.hits_by_name[name] = self.hits_by_name.get(name, 0) + 1
+        else:
+            self.misses += 1
+            self.misses_by_name[name] = self.misses_by_name.get(name, 0) + 1
+            self.values[key] = compute()
+        value = self.values[key]
+        # Hand out copies so nobody can change the map another survey will get
+        if hasattr(value, 'copy'):
+            value = value.copy()
+        return value
+
+    def stats(self):
+        """Hit and miss counts, total and for each name"""
+        return {'hits': self.hits, 'misses': self.misses,
+                'hits_by_name': self.hits_by_name, 'misses_by_name': self.misses_by_name}
+
+
+def get_conditions_cache(conditions):
+    """Return the Conditions_cache attached to conditions, attaching a new one if needed"""
+    cache = getattr(conditions, 'derived_cache', None)
+    if cache is None:
+        cache = Conditions_cache()
+        conditions.derived_cache = cache
+    return cache
+
+
+def _hashable(value):
+    if isinstance(value, np.ndarray):
+        return (value.shape, value.dtype.str, hash(value.tobytes()))
+    if isinstance(value, (list, tuple)):
+        return tuple([_hashable(val) for val in value])
+    if isinstance(value, dict):
+        return tuple(sorted([(key, _hashable(val)) for key, val in value.items()]))
+    return value
+
+
+def config_key(basis_function):
+    """
+    Hashable summary of how a basis function is configured
+
+    Only plain values (numbers, strings, None and lists/tuples of them) are used. Arrays
+    held by the object are work space or derived from those values.
+    """
+    key = []
+    for name, val in sorted(vars(basis_function).items()):
+        if name in _state_attrs:
+            continue
+        if isinstance(val, (int, float, str, bool, type(None))):
+            key.append((name, val))
+        elif isinstance(val, (list, tuple)) and \
+                all([isinstance(v, (int, float, str, bool, type(None))) for v in val]):
+            key.append((name, tuple(val)))
+    return tuple(key)
+
+
+class Conditions_cache_monitor(Run_monitor):
+    """
+    Share condition-only basis function maps between surveys for the length of a run
+
+    Parameters
+    ----------
+    bf_names : list of str (None)
+        Class names of the basis functions to cache. Defaults to default_cached_bfs. Only
+        list classes whose result depends on nothing but the conditions and how they were
+        constructed.
+    """
+    def __init__(self, bf_names=None):
+        if bf_names is None:
+            bf_names = default_cached_bfs
+        self.bf_names = bf_names
+        self.patched = []
+        self.conditions = None
+
+    def _wrap(self, func):
+        monitor = self
+
+        def _calc_value(bf, conditions, **kwargs):
+            monitor.conditions = conditions
+            cache = get_conditions_cache(conditions)
+            key = (type(bf).__name__, config_key(bf), _hashable(kwargs))
+            return cache.get(conditions, key, lambda: func(bf, conditions, **kwargs))
+        return _calc_value
+
+    def start(self, observatory, scheduler):
+        for survey_list in scheduler.survey_lists:
+            for survey in survey_list:
+                for basis_function in survey.basis_functions:
+                    cls = type(basis_function)
+                    if cls.__name__ not in self.bf_names or cls in [val[0] for val in self.patched]:
+                        continue
+                    self.patched.append((cls, cls.__dict__.get('_calc_value')))
+                    cls._calc_value = self._wrap(cls._calc_value)
+
+    def stats(self):
+        if self.conditions is None:
+            return Conditions_cache().stats()
+        return get_conditions_cache(self.conditions).stats()
+
+    def finish(self, observatory, scheduler, extra_info, filename):
+        for cls, original in self.patched[::-1]:
+            if original is None:
+                del cls._calc_value
+            else:
+                cls._calc_value = original
+        self.patched = []
+        stats = self.stats()
+        extra_info['conditions cache'] = json.dumps({'hits': stats['hits'], 'misses': stats['misses']})
+        if self.conditions is not None:
+            del self.conditions.derived_cache
@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import numpy as np
+
+try:
+    from lsst.sims.featureScheduler.utils import schema_converter
+except ImportError:
+    from rubin_sim.scheduler.utils import schema_converter
+
+
+__all__ = ['Streaming_writer']
+
+
+class Streaming_writer(object):
+    """
+    Append observations to the output sqlite file as the simulation goes
+
+    Each batch is converted with the featureScheduler schema_converter into a small scratch
+    file, then copied into the output file in a single transaction. Going through the
+    converter means the columns, units and types come out exactly as they would from
+    writing everything at the end, so MAF doesn't know the difference. The output file is
+    kept in WAL mode while the run is going and switched back to a normal journal on close.
+
+    Parameters
+    ----------
+    filename : str
+        The output .db file
+    delete_past : bool (True)
+        Remove any existing file before starting
+    n_written : int (0)
+        Number of observations already in the file. Used when resuming a run; any rows
+        past this (written after the snapshot was taken) are removed.
+    """
+    def __init__(self, filename, delete_past=True, n_written=0):
+        self.filename = filename
+        self.scratch_file = filename + '.batch'
+        self.converter = schema_converter()
+        self.obs_dtype = None
+        if delete_past and n_written == 0 and os.path.isfile(filename):
+            os.remove(filename)
+        self.con = sqlite3.connect(filename)
+        self.con.execute('PRAGMA journal_mode=WAL')
+        self.con.execute('PRAGMA synchronous=NORMAL')
+        self.tables = [name[0] for name in
+                       self.con.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]
+        self.n_written = n_written
+        if 'SummaryAllProps' in self.tables:
+            with self.con:
+                self.con.execute('DELETE FROM SummaryAllProps WHERE rowid > ?', (n_written,))
+
+    def _copy_tables(self, observations, info=None):
+        """Convert observations (and info) into the scratch file and copy them across"""
+        if os.path.isfile(self.scratch_file):
+            os.remove(self.scratch_file)
+        self.converter.obs2opsim(observations, filename=self.scratch_file, info=info, delete_past=True)
+        self.con.execute('ATTACH DATABASE ? AS batch', (self.scratch_file,))
+        with self.con:
+            batch_tables = self.con.execute("SELECT name, sql FROM batch.sqlite_master "
+                                            "WHERE type='table'").fetchall()
+            for name, sql in batch_tables:
+                if name not in self.tables:
+                    self.con.execute(sql)
+                    self.tables.append(name)
+                self.con.execute('INSERT INTO main."%s" SELECT * FROM batch."%s"' % (name, name))
+        self.con.execute('DETACH DATABASE batch')
+        os.remove(self.scratch_file)
+
+    def append(self, observations):
+        """
+        Write a batch of observations
+
+        Parameters
+        ----------
+        observations : list of np.array
+            The completed observations, as collected by sim_runner
+        """
+        if len(observations) == 0:
+            return
+        observations = np.array(observations)[:, 0]
+        self.obs_dtype = observations.dtype
+        self._copy_tables(observations)
+        self.n_written += observations.size
+
+    def close(self, info=None):
+        """
+        Write the info table and close the file
+        """
+        if info is not None and self.obs_dtype is not None:
+            self._copy_tables(np.zeros(0, dtype=self.obs_dtype), info=info)
+        self.con.execute('PRAGMA journal_mode=DELETE')
+        self.con.close()
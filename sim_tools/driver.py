@@ -0,0 +1,143 @@
+"""
+Command line options shared by all the driver scripts.
+
+Each driver calls add_runner_args on its parser and passes runner_kwargs(args) through
+run_sched to sim_runner, so new run-level options only need adding here.
+"""
+
+__all__ = ['add_runner_args', 'runner_kwargs', 'preview_settings']
+
+
+def add_runner_args(parser):
+    """
+    Add the sim_runner options to an argparse parser
+    """
+    parser.add_argument("--checkpoint_nights", type=int, default=0,
+                        help="Snapshot the simulation every N nights (0 for no snapshots)")
+    parser.add_argument("--checkpoint_dir", type=str, default=None,
+                        help="Directory for snapshots. Defaults to <output db>_checkpoints")
+    parser.add_argument("--resume", dest='resume', action='store_true',
+                        help="Continue from the latest snapshot, if there is one")
+    parser.set_defaults(resume=False)
+    parser.add_argument("--checkpoint_stop", type=int, default=None,
+                        help="Stop after the snapshot at this night (for testing resume)")
+    parser.add_argument("--stream_db", dest='stream', action='store_true',
+                        help="Write observations to the output file every night rather than at the end")
+    parser.set_defaults(stream=False)
+    parser.add_argument("--profile_bfs", dest='profile_bfs', action='store_true',
+                        help="Time each basis function and survey, report to <output db>_bf_profile.json")
+    parser.set_defaults(profile_bfs=False)
+    parser.add_argument("--profile_bfs_memory", dest='profile_bfs_memory', action='store_true',
+                        help="Also track peak allocations in each basis function call (slow)")
+    parser.set_defaults(profile_bfs_memory=False)
+    parser.add_argument("--cache_conditions", dest='cache_conditions', action='store_true',
+                        help="Share condition-only basis function maps between surveys each step")
+    parser.set_defaults(cache_conditions=False)
+    parser.add_argument("--intern_bfs", dest='intern_bfs', action='store_true',
+                        help="Share one object between surveys for identical basis functions")
+    parser.set_defaults(intern_bfs=False)
+    parser.add_argument("--preview", dest='preview', action='store_true',
+                        help="Quick low-fidelity run: lower nside and a shorter survey. Visits, exposures "
+                             "and slews are simulated as in a full run")
+    parser.set_defaults(preview=False)
+    parser.add_argument("--preview_nside", type=int, default=16,
+                        help="HEALpix nside for --preview runs")
+    parser.add_argument("--preview_length", type=float, default=365.25,
+                        help="Longest survey_length for --preview runs (days)")
+    parser.add_argument("--timing_file", type=str, default=None,
+                        help="Write run speed and peak memory to this json file")
+    parser.add_argument("--ephemeris_file", type=str, default=None,
+                        help="Read sun and moon positions from this file made by sim_tools.ephemeris")
+    parser.add_argument("--prefetch_sky", dest='prefetch_sky', action='store_true',
+                        help="Read the next sky brightness block in the background")
+    parser.set_defaults(prefetch_sky=False)
+    parser.add_argument("--map_dtype", type=str, default=None,
+                        help="Hold the scheduler's HEALpix maps in this type, e.g. float32")
+    parser.add_argument("--heartbeat_minutes", type=float, default=0,
+                        help="Write progress to <output db>_heartbeat.json every N minutes (0 for none)")
+    parser.add_argument("--track_memory", dest='track_memory', action='store_true',
+                        help="Write RSS and scheduler/observatory sizes to <output db>_memory.csv monthly")
+    parser.set_defaults(track_memory=False)
+    parser.add_argument("--trace", dest='trace', action='store_true',
+                        help="Record every scheduler decision to <output db>_trace.gz")
+    parser.set_defaults(trace=False)
+    parser.add_argument("--min_visits_per_night", type=float, default=0,
+                        help="Stop if mean visits per night over --min_visits_window nights is below this")
+    parser.add_argument("--min_visits_window", type=int, default=7,
+                        help="Nights to average over for --min_visits_per_night")
+    parser.add_argument("--max_night_seconds", type=float, default=0,
+                        help="Stop if one simulated night takes more wall seconds than this")
+    parser.add_argument("--max_empty_nights", type=float, default=0,
+                        help="Stop if there are no visits for more than this many nights")
+    parser.add_argument("--reward_threads", type=int, default=0,
+                        help="Evaluate each tier's survey rewards on this many threads (0 for serial)")
+    parser.add_argument("--stack_rewards", dest='stack_rewards', action='store_true',
+                        help="Evaluate each tier's shared basis functions once and sum the rewards as a stack")
+    parser.set_defaults(stack_rewards=False)
+    parser.add_argument("--incremental_bfs", dest='incremental_bfs', action='store_true',
+                        help="Update history-dependent basis function maps as observations come in")
+    parser.set_defaults(incremental_bfs=False)
+    parser.add_argument("--incremental_check_every", type=int, default=100,
+                        help="Check incremental basis function maps against a full recompute this often")
+    parser.add_argument("--gates_first", dest='gates_first', action='store_true',
+                        help="Count the steps each survey is evaluated and skipped, checking its scalar "
+                        "feasibility gates first")
+    parser.set_defaults(gates_first=False)
+    parser.add_argument("--tier_stats", dest='tier_stats', action='store_true',
+                        help="Count survey evaluations made and avoided by the scheduler's tiers")
+    parser.set_defaults(tier_stats=False)
+    return parser
+
+
+def runner_kwargs(args):
+    """
+    Pull the sim_runner options back out of parsed args
+
+    Returns
+    -------
+    kwargs : dict
+        Keyword arguments to pass through run_sched to sim_runner
+    """
+    kwargs = {'checkpoint_nights': args.checkpoint_nights,
+              'checkpoint_dir': args.checkpoint_dir,
+              'resume': args.resume,
+              'checkpoint_stop': args.checkpoint_stop,
+              'stream': args.stream,
+              'profile_bfs': args.profile_bfs,
+              'profile_bfs_memory': args.profile_bfs_memory,
+              'cache_conditions': args.cache_conditions,
+              'intern_bfs': args.intern_bfs,
+              'preview': args.preview,
+              'timing_file': args.timing_file,
+              'ephemeris_file': args.ephemeris_file,
+              'prefetch_sky': args.prefetch_sky,
+              'map_dtype': args.map_dtype,
+              'heartbeat_minutes': args.heartbeat_minutes,
+              'track_memory': args.track_memory,
+              'trace': args.trace,
+              'min_visits_per_night': args.min_visits_per_night,
+              'min_visits_window': args.min_visits_window,
+              'max_night_seconds': args.max_night_seconds,
+              'max_empty_nights': args.max_empty_nights,
+              'reward_threads': args.reward_threads,
+              'stack_rewards': args.stack_rewards,
+              'incremental_bfs': args.incremental_bfs,
+              'incremental_check_every': args.incremental_check_every,
+              'gates_first': args.gates_first,
+              'tier_stats': args.tier_stats}
+    return kwargs
+
+
+def preview_settings(args, nside, survey_length):
+    """
+    The nside and survey_length a driver should use, allowing for --preview
+
+    Returns
+    -------
+    nside : int
+    survey_length : float
+    """
+    if args.preview:
+        nside = args.preview_nside
+        survey_length = min(survey_length, args.preview_length)
+    return nside, survey_length
@@ -0,0 +1,211 @@
+"""
+Precomputed, memory-mapped sun and moon ephemeris shared by every run.
+
+Model_observatory gets the sun and moon positions, altitudes and moon phase from its
+Almanac, which evaluates quadratic interpolators every time the conditions are updated.
+Every run in a release starts at the same mjd_start and covers the same ten years, so
+build_ephemeris evaluates them once on a fixed time grid and saves the result as a .npy
+file. Ephemeris_almanac then stands in for the observatory's almanac, answering
+get_sun_moon_positions by linear interpolation from the memory-mapped table, so every
+run (and every worker in a sweep) reads the same pages. Everything else the almanac
+does (sunset times, night numbers) is passed through to the original.
+
+Example, from the repo root:
+
+    python -m sim_tools.ephemeris build ephemeris_v1.7.npy --mjd_start 59853.5 --days 3700
+    python -m sim_tools.ephemeris validate ephemeris_v1.7.npy
+
+then run drivers with --ephemeris_file ephemeris_v1.7.npy.
+"""
+import os
+import json
+import argparse
+import numpy as np
+
+
+__all__ = ['build_ephemeris', 'Ephemeris_almanac', 'use_ephemeris', 'validate_ephemeris']
+
+_two_pi = 2.*np.pi
+
+
+def _wraps(key):
+    """Angles in [0, 2pi) that are unwrapped for interpolation"""
+    return key.endswith('_RA') or key.endswith('_az')
+
+
+def _default_almanac(mjd_start):
+    try:
+        from lsst.sims.almanac import Almanac
+    except ImportError:
+        from rubin_sim.site_models import Almanac
+    return Almanac(mjd_start=mjd_start)
+
+
+def build_ephemeris(filename, almanac, mjd_start, days, step=5./60./24., chunk=100000):
+    """
+    Sample an almanac's sun and moon positions on a regular grid and save them
+
+    Parameters
+    ----------
+    filename : str
+        .npy file to write, with the grid and column names in filename + '.json'
+    almanac : Almanac
+        Anything with a get_sun_moon_positions(mjd) method taking an array of mjds.
+    mjd_start : float
+        Start of the grid
+    days : float
+        Length of the grid (days)
+    step : float (5 minutes)
+        Grid spacing (days)
+    """
+    n_samples = int(np.ceil(days/step)) + 1
+    mjds = mjd_start + np.arange(n_samples)*step
+    keys = None
+    table = None
+    for start in range(0, n_samples, chunk):
+        values = almanac.get_sun_moon_positions(mjds[start:start+chunk])
+        if keys is None:
+            keys = sorted(values.keys())
+            table = np.lib.format.open_memmap(filename + '.tmp', mode='w+', dtype=float,
+                                              shape=(n_samples, len(keys)))
+        for i, key in enumerate(keys):
+            table[start:start+chunk, i] = values[key]
+    # Unwrap the angles so linear interpolation between samples works across 2pi
+    for i, key in enumerate(keys):
+        if _wraps(key):
+            table[:, i] = np.unwrap(table[:, i])
+    table.flush()
+    del table
+    os.replace(filename + '.tmp', filename)
+    with open(filename + '.json', 'w') as f:
+        json.dump({'mjd_start': mjd_start, 'step': step, 'n_samples': n_samples, 'keys': keys}, f)
+
+
+class Ephemeris_almanac(object):
+    """
+    Stand-in for an Almanac that reads sun and moon positions from a build_ephemeris file
+
+    Parameters
+    ----------
+    almanac : Almanac
+        The almanac to replace. Used for everything other than get_sun_moon_positions, and
+        for times outside the stored grid.
+    filename : str
+        The ephemeris .npy file
+    """
+    def __init__(self, almanac, filename):
+        self.source = almanac
+        self.filename = filename
+        with open(filename + '.json') as f:
+            info = json.load(f)
+        self.mjd_start = info['mjd_start']
+        self.step = info['step']
+        self.keys = info['keys']
+        self.table = np.load(filename, mmap_mode='r')
+
+    def __getstate__(self):
+        # Reopen the memory map on unpickling rather than copying the table into snapshots
+        state = self.__dict__.copy()
+        del state['table']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.table = np.load(self.filename, mmap_mode='r')
+
+    def __getattr__(self, name):
+        if name == 'source':
+            raise AttributeError(name)
+        return getattr(self.source, name)
+
+    def covers(self, mjd):
+        position = (np.asarray(mjd) - self.mjd_start)/self.step
+        return np.all((position >= 0) & (position <= self.table.shape[0] - 1))
+
+    def get_sun_moon_positions(self, mjd):
+        if not self.covers(mjd):
+            return self.source.get_sun_moon_positions(mjd)
+        position = (np.asarray(mjd, dtype=float) - self.mjd_start)/self.step
+        indx = np.minimum(np.floor(position).astype(int), self.table.shape[0] - 2)
+        frac = position - indx
+        rows = (self.table[indx], self.table[indx + 1])
+        result = {}
+        for i, key in enumerate(self.keys):
+            value = rows[0][..., i] * (1. - frac) + rows[1][..., i] * frac
+            if _wraps(key):
+                value = value % _two_pi
+            result[key] = value
+        return result
+
+
+def use_ephemeris(observatory, filename):
+    """
+    Point observatory at an ephemeris file instead of its own almanac interpolation
+
+    Does nothing if the observatory is already using one (e.g., restored from a snapshot).
+    """
+    if not isinstance(observatory.almanac, Ephemeris_almanac):
+        observatory.almanac = Ephemeris_almanac(observatory.almanac, filename)
+    return observatory
+
+
+def validate_ephemeris(filename, almanac=None, n_test=10000, seed=42):
+    """
+    Compare interpolated ephemeris values with the almanac at random times
+
+    Parameters
+    ----------
+    filename : str
+        The ephemeris .npy file
+    almanac : Almanac (None)
+        What to compare against. Defaults to a new Almanac for the file's mjd_start.
+    n_test : int (10000)
+        Number of random times to check
+
+    Returns
+    -------
+    max_diff : dict
+        Largest absolute difference for each quantity (radians for angles)
+    """
+    store = Ephemeris_almanac(almanac, filename)
+    if almanac is None:
+        almanac = _default_almanac(store.mjd_start)
+        store.source = almanac
+    span = (store.table.shape[0] - 1)*store.step
+    mjds = store.mjd_start + np.random.RandomState(seed).uniform(0, span, size=n_test)
+    stored = store.get_sun_moon_positions(mjds)
+    direct = almanac.get_sun_moon_positions(mjds)
+    max_diff = {}
+    for key in store.keys:
+        diff = np.abs(stored[key] - direct[key])
+        if _wraps(key):
+            diff = np.minimum(diff, _two_pi - diff)
+        max_diff[key] = float(np.max(diff))
+    return max_diff
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or check a shared sun/moon ephemeris file")
+    subparsers = parser.add_subparsers(dest='command')
+    build_parser = subparsers.add_parser('build', help="sample the almanac and write the ephemeris file")
+    build_parser.add_argument("filename", type=str)
+    build_parser.add_argument("--mjd_start", type=float, default=59853.5)
+    build_parser.add_argument("--days", type=float, default=3700.)
+    build_parser.add_argument("--step", type=float, default=5., help="grid spacing (minutes)")
+    validate_parser = subparsers.add_parser('validate', help="compare the file with the almanac")
+    validate_parser.add_argument("filename", type=str)
+    validate_parser.add_argument("--n_test", type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_ephemeris(args.filename, _default_almanac(args.mjd_start), args.mjd_start, args.days,
+                        step=args.step/60./24.)
+        print('Wrote %s' % args.filename)
+    elif args.command == 'validate':
+        for key, diff in sorted(validate_ephemeris(args.filename, n_test=args.n_test).items()):
+            if key.endswith('_phase'):
+                print('%-12s max diff %.3g' % (key, diff))
+            else:
+                print('%-12s max diff %.3g (%.3g arcsec if radians)' % (key, diff, np.degrees(diff)*3600.))
+    else:
+        parser.print_help()
@@ -0,0 +1,106 @@
+"""
+Check the cheap scalar feasibility gates of each survey before anything else.
+
+A survey's reward is only computed when all of its basis functions say it is feasible,
+but the checks run in the order the basis functions were listed. The drivers list the
+HEALPix maps first and gates like Not_twilight, Time_to_twilight or Filter_loaded last.
+Feasibility_order_monitor runs the gates in scalar_gates first, and a survey that fails
+one goes straight to -inf without its other checks or any of its maps being touched.
+When all the gates pass, the survey's own check runs as usual (checking the gates again,
+which costs next to nothing). Feasibility checks don't change anything, so the outcome,
+and the schedule, are the same. Each survey's gates are picked out once, in start(),
+from the basis functions it holds then.
+
+The scheduler already skips the reward maps of an infeasible survey, so reordering only
+saves the feasibility checks of the map basis functions ahead of the gates, and there is
+no measured speedup to promise. The main use is the counts: for each survey the steps
+where the reward was evaluated and the steps skipped as infeasible, and how many of
+those were stopped by a gate. They go in extra_info as 'feasibility'.
+"""
+import json
+import threading
+from .monitors import Run_monitor
+
+
+__all__ = ['scalar_gates', 'Feasibility_order_monitor']
+
+# Basis functions whose feasibility check only looks at scalars in the conditions
+scalar_gates = ['Not_twilight_basis_function', 'Time_to_twilight_basis_function',
+                'Filter_loaded_basis_function', 'Strict_filter_basis_function',
+                'Night_modulo_basis_function', 'Sun_alt_limit_basis_function',
+                'Limit_obs_pnight_basis_function', 'Time_to_scheduled_basis_function',
+                'Time_in_twilight_basis_function']
+
+
+def _survey_label(tier, index, survey):
+    name = getattr(survey, 'survey_name', '')
+    return '%i/%i %s' % (tier, index, name if name else type(survey).__name__)
+
+
+class Feasibility_order_monitor(Run_monitor):
+    """
+    Check each survey's scalar gates before the rest of its feasibility check
+    """
+    def __init__(self):
+        self.gates = {}
+        self.labels = {}
+        self.counts = {}
+        self.last_step = {}
+        self.patched = []
+        self.local = threading.local()
+
+    def _count(self, survey, conditions, result, by_gate):
+        key = (id(conditions), conditions.mjd)
+        # Count each survey once per step, however many times it is checked
+        if self.last_step.get(id(survey)) == key:
+            return
+        self.last_step[id(survey)] = key
+        counts = self.counts[id(survey)]
+        if result:
+            counts['evaluated'] += 1
+        else:
+            counts['skipped'] += 1
+            if by_gate:
+                counts['skipped by gates'] += 1
+
+    def _wrap(self, func):
+        monitor = self
+
+        def _check_feasibility(survey, conditions, *args, **kwargs):
+            if getattr(monitor.local, 'inside', False) or id(survey) not in monitor.counts:
+                return func(survey, conditions, *args, **kwargs)
+            for gate in monitor.gates[id(survey)]:
+                result = gate.check_feasibility(conditions)
+                if not result:
+                    monitor._count(survey, conditions, result, True)
+                    return result
+            monitor.local.inside = True
+            try:
+                result = func(survey, conditions, *args, **kwargs)
+            finally:
+                monitor.local.inside = False
+            monitor._count(survey, conditions, result, False)
+            return result
+        return _check_feasibility
+
+    def start(self, observatory, scheduler):
+        for tier, survey_list in enumerate(scheduler.survey_lists):
+            for index, survey in enumerate(survey_list):
+                self.labels[id(survey)] = _survey_label(tier, index, survey)
+                self.counts[id(survey)] = {'evaluated': 0, 'skipped': 0, 'skipped by gates': 0}
+                self.gates[id(survey)] = [basis_function for basis_function in survey.basis_functions
+                                          if type(basis_function).__name__ in scalar_gates]
+                cls = type(survey)
+                if cls not in [val[0] for val in self.patched]:
+                    self.patched.append((cls, cls.__dict__.get('_check_feasibility')))
+                    cls._check_feasibility = self._wrap(cls._check_feasibility)
+
+    def finish(self, observatory, scheduler, extra_info, filename):
+        for cls, original in self.patched[::-1]:
+            if original is None:
+                del cls._check_feasibility
+            else:
+                cls._check_feasibility = original
+        self.patched = []
+        summary = dict([(self.labels[key], self.counts[key]) for key in self.counts])
+        extra_info['feasibility'] = json.dumps(summary)
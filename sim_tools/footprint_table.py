@@ -0,0 +1,199 @@
+"""
+Night-indexed lookup tables for rolling footprints.
+
+A rolling Footprints object re-evaluates the Step_slopes step function of each of its
+footprints for every pixel whenever it is asked for a new mjd. Footprint_table evaluates it
+once per night up front and saves the (nights, filters, npix) result as a float32 .npy file,
+so the Footprint_basis_function lookup during the run is an index into a memory-mapped
+array. Runs that use the same table file share the pages.
+
+The table holds the footprint at one time in each night (sample_offset days after the
+start of the night's day, about local midnight at the site for the usual noon-UTC
+mjd_start), so the target map is constant through a night rather than creeping forward
+with each observation. validate_table reports both the match at the sampled times and
+how far the map moves within a night.
+"""
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+
+
+__all__ = ['Footprint_table', 'compile_footprints', 'validate_table']
+
+
+def _raw_footprint(footprints, mjd):
+    """The un-normalized (filters, npix) footprint array at mjd"""
+    footprints.mjd_current = None
+    footprints._update_mjd(mjd, norm=False)
+    return np.array(footprints.current_footprints, dtype=float)
+
+
+def _source_hash(footprints):
+    return hashlib.sha1(pickle.dumps(footprints)).hexdigest()
+
+
+def compile_footprints(footprints, mjd_start, nights, filename, sample_offset=0.67):
+    """
+    Evaluate footprints once per night and save the result
+
+    Parameters
+    ----------
+    footprints : Footprints
+        The footprint object to compile, e.g., from make_rolling_footprints.
+    mjd_start : float
+        Start of night 0. Night n is the day starting at mjd_start + n.
+    nights : int
+        Number of nights to compile.
+    filename : str
+        .npy file to write. The sample times and normalizations go in filename + '.json'.
+    sample_offset : float (0.67)
+        When in each day to sample the footprint (days).
+    """
+    source_hash = _source_hash(footprints)
+    mjds = mjd_start + np.arange(nights) + sample_offset
+    first = _raw_footprint(footprints, mjds[0])
+    table = np.lib.format.open_memmap(filename + '.tmp', mode='w+', dtype=np.float32,
+                                      shape=(nights,) + first.shape)
+    sums = np.zeros(nights, dtype=float)
+    for i, mjd in enumerate(mjds):
+        raw = first if i == 0 else _raw_footprint(footprints, mjd)
+        table[i] = raw
+        sums[i] = np.sum(raw)
+    table.flush()
+    del table
+    os.replace(filename + '.tmp', filename)
+    info = {'mjd_start': mjd_start, 'nights': nights, 'sample_offset': sample_offset,
+            'sums': sums.tolist(), 'source_hash': source_hash}
+    with open(filename + '.json', 'w') as f:
+        json.dump(info, f)
+    footprints.mjd_current = None
+
+
+class Footprint_table(object):
+    """
+    Stand-in for a Footprints object that looks the footprint up by night
+
+    Anything other than evaluating the footprint (get_footprint, arr2struc, the static
+    footprints, etc.) is passed through to the original object. Times outside the table
+    are computed by the original object as usual.
+
+    Parameters
+    ----------
+    footprints : Footprints
+        The object to replace.
+    mjd_start : float
+        Start of night 0, usually conditions.mjd_start.
+    nights : int
+        Number of nights to cover, usually survey_length plus a day or so.
+    filename : str
+        Where the table lives. An existing table is reused if it was compiled from an
+        identical footprints object with the same nights and sampling, otherwise it is
+        recompiled.
+    sample_offset : float (0.67)
+        When in each day to sample the footprint (days).
+    """
+    def __init__(self, footprints, mjd_start, nights, filename, sample_offset=0.67):
+        self.source = footprints
+        self.filename = filename
+        self.mjd_start = mjd_start
+        self.sample_offset = sample_offset
+        expected = {'mjd_start': mjd_start, 'nights': nights, 'sample_offset': sample_offset,
+                    'source_hash': _source_hash(footprints)}
+        info = None
+        if os.path.isfile(filename) and os.path.isfile(filename + '.json'):
+            with open(filename + '.json') as f:
+                info = json.load(f)
+            if any([info.get(key) != expected[key] for key in expected]):
+                info = None
+        if info is None:
+            compile_footprints(footprints, mjd_start, nights, filename, sample_offset=sample_offset)
+            with open(filename + '.json') as f:
+                info = json.load(f)
+        self.sums = np.array(info['sums'])
+        self.table = np.load(filename, mmap_mode='r')
+        self.night_current = None
+        self.mjd_current = None
+        self.current_footprints = None
+
+    def __getstate__(self):
+        # The memory map is reopened on unpickling rather than copied into the snapshot
+        state = self.__dict__.copy()
+        del state['table']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.table = np.load(self.filename, mmap_mode='r')
+
+    def __getattr__(self, name):
+        if name == 'source':
+            raise AttributeError(name)
+        return getattr(self.source, name)
+
+    def night(self, mjd):
+        """Table index for mjd, or None if it is outside the table"""
+        night = int(np.floor(mjd - self.mjd_start))
+        if night < 0 or night >= self.table.shape[0]:
+            return None
+        return night
+
+    def _update_mjd(self, mjd, norm=True):
+        night = self.night(mjd)
+        if night is None:
+            self.source._update_mjd(mjd, norm=norm)
+            self.current_footprints = self.source.current_footprints
+            self.night_current = None
+        elif (night, norm) != self.night_current:
+            current = np.array(self.table[night], dtype=float)
+            if norm and self.sums[night] != 0:
+                current /= self.sums[night]
+            self.current_footprints = current
+            self.night_current = (night, norm)
+        self.mjd_current = mjd
+
+    def __call__(self, mjd, array=False, norm=True):
+        self._update_mjd(mjd, norm=norm)
+        if array:
+            return self.current_footprints
+        return self.arr2struc(self.current_footprints)
+
+
+def validate_table(table, footprints, step=1./24., rtol=1e-6):
+    """
+    Compare a Footprint_table with the Footprints it was compiled from
+
+    Parameters
+    ----------
+    table : Footprint_table
+    footprints : Footprints
+        An object identical to the one the table was compiled from
+    step : float (1/24)
+        Time step for measuring how much the footprint changes within a night (days)
+    rtol : float (1e-6)
+        Largest difference allowed at the sampled times, relative to the largest value in
+        the table. float32 holds about 7 significant figures.
+
+    Returns
+    -------
+    result : dict
+        'max_sample_diff' is the largest difference at the sampled times (should be float32
+        round-off), 'max_night_drift' the largest difference between the table and the
+        original anywhere on the step grid, 'ok' whether the sampled difference is within rtol.
+    """
+    max_sample_diff = 0.
+    max_night_drift = 0.
+    scale = 0.
+    for night in range(table.table.shape[0]):
+        day = table.mjd_start + night
+        looked_up = np.array(table.table[night], dtype=float)
+        scale = max(scale, np.max(np.abs(looked_up)))
+        exact = _raw_footprint(footprints, day + table.sample_offset)
+        max_sample_diff = max(max_sample_diff, np.max(np.abs(looked_up - exact)))
+        for mjd in np.arange(day, day + 1., step):
+            max_night_drift = max(max_night_drift,
+                                  np.max(np.abs(looked_up - _raw_footprint(footprints, mjd))))
+    footprints.mjd_current = None
+    return {'max_sample_diff': max_sample_diff, 'max_night_drift': max_night_drift,
+            'ok': bool(max_sample_diff <= rtol * max(scale, 1.))}
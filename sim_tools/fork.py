@@ -0,0 +1,231 @@
+"""
+Run several variants of a survey that only differ in their footprints, sharing the
+part of the simulation before the footprints diverge.
+
+The rolling cadence sweeps are the motivating case: every scale/nslice variant starts with
+the same uniform footprint and only starts rolling a year or more in. fork_sched simulates
+that common prefix once, snapshots it, then finishes each variant from the snapshot with
+its own footprints swapped in.
+"""
+import os
+import json
+import multiprocessing
+import numpy as np
+from .runner import sim_runner
+from .shared import get_observatory
+
+try:
+    from lsst.sims.featureScheduler.schedulers import Core_scheduler, simple_filter_sched
+except ImportError:
+    from rubin_sim.scheduler.schedulers import Core_scheduler, simple_filter_sched
+
+
+__all__ = ['prefix_options', 'first_divergence', 'Footprint_swap', 'fork_sched']
+
+# sim_runner options that only make sense for the branches' own output files
+_branch_only = ['stream', 'checkpoint_nights', 'resume', 'checkpoint_stop', 'timing_file']
+
+# sim_runner options that change the schedule, so a prefix made without them can't be reused
+prefix_options = ['preview', 'map_dtype', 'intern_bfs', 'ephemeris_file']
+
+
+def _footprint_array(footprints, mjd):
+    result = footprints(mjd)
+    if isinstance(result, dict):
+        result = np.array([result[key] for key in sorted(result)])
+    return np.asarray(result)
+
+
+def first_divergence(footprints_list, mjd_start, mjd_end, step=1./24.):
+    """
+    Find the last time before any of the footprints differ from the first one
+
+    Parameters
+    ----------
+    footprints_list : list of Footprints
+        The footprint objects for each variant
+    mjd_start : float
+        Where to start looking
+    mjd_end : float
+        Where to stop looking
+    step : float (1/24)
+        Time step to check on (days)
+
+    Returns
+    -------
+    mjd : float
+        The last mjd on the grid where all the footprints agree. Returns mjd_end if they
+        never differ.
+    """
+    mjds = np.arange(mjd_start, mjd_end, step)
+    last_same = mjd_start
+    for mjd in mjds:
+        reference = _footprint_array(footprints_list[0], mjd)
+        for footprints in footprints_list[1:]:
+            if not np.array_equal(reference, _footprint_array(footprints, mjd), equal_nan=True):
+                return last_same
+        last_same = mjd
+    return mjd_end
+
+
+def _basis_functions(scheduler):
+    for survey_list in scheduler.survey_lists:
+        for survey in survey_list:
+            for basis_function in survey.basis_functions:
+                yield basis_function
+
+
+class Footprint_swap(object):
+    """
+    Replace the footprints object used by a restored scheduler
+
+    Any basis function attribute holding an object of the same class as the new footprints
+    is pointed at the new one. There must be only one such object in the scheduler, otherwise
+    there's no way to know which footprints the variant is meant to replace.
+
+    Parameters
+    ----------
+    footprints : Footprints
+        The footprints for the variant
+    """
+    def __init__(self, footprints):
+        self.footprints = footprints
+
+    def __call__(self, state):
+        old = {}
+        for basis_function in _basis_functions(state['scheduler']):
+            for key, val in vars(basis_function).items():
+                if isinstance(val, self.footprints.__class__):
+                    old[id(val)] = val
+                    setattr(basis_function, key, self.footprints)
+        if len(old) != 1:
+            raise ValueError('Expected one %s object in the scheduler, found %i' %
+                             (self.footprints.__class__.__name__, len(old)))
+
+
+def _check_prefix(settings_file, settings):
+    if not os.path.isfile(settings_file):
+        raise ValueError('No %s to say how the existing prefix snapshot was made. Delete the snapshot '
+                         'or pick another snapshot_file' % settings_file)
+    with open(settings_file) as f:
+        saved = json.load(f)
+    settings = json.loads(json.dumps(settings, sort_keys=True, default=str))
+    differ = sorted([key for key in set(saved) | set(settings) if saved.get(key) != settings.get(key)])
+    if len(differ) > 0:
+        raise ValueError('The existing prefix snapshot was made with different %s, see %s. Delete it '
+                         'or pick another snapshot_file' % (', '.join(differ), settings_file))
+
+
+def _run_branch(kwargs):
+    # A guardrail stops a run with SystemExit, which must not get out of a pool worker
+    # (the pool would wait for it forever) or stop the variants after it
+    try:
+        sim_runner(None, None, **kwargs)
+    except SystemExit as err:
+        return kwargs['filename'], str(err.code)
+    return kwargs['filename'], None
+
+
+def fork_sched(surveys, variant_footprints, fileroots, survey_length=365.25, nside=32,
+               verbose=False, extra_info=None, illum_limit=40., variant_info=None,
+               processes=1, snapshot_file=None, observatory=None, settings=None, **kwargs):
+    """
+    Run a set of variants that only differ in footprints, simulating their common start once
+
+    Parameters
+    ----------
+    surveys : list of lists
+        Survey tiers, built with variant_footprints[0]
+    variant_footprints : list of Footprints
+        The footprints for each variant
+    fileroots : list of str
+        Output fileroot for each variant (same meaning as in run_sched)
+    variant_info : list of str (None)
+        A description of each variant to put in the output info table
+    processes : int (1)
+        How many variants to run at once after the fork
+    snapshot_file : str (None)
+        Where to save the shared prefix. Defaults to fileroots[0] + 'prefix.pkl'. If the
+        file already exists it is reused rather than re-simulated, as long as it was made
+        with the same settings. Those are kept in a _settings.json file next to it, and a
+        snapshot made with different ones is refused.
+    observatory : Model_observatory (None)
+        Observatory to simulate the shared prefix with, e.g., the one the driver already
+        built. A new one is made if None.
+    settings : dict (None)
+        Driver options the surveys were built with (nexp etc.), checked along with nside,
+        survey_length and the sim_runner options in prefix_options before an existing
+        prefix is reused.
+    **kwargs
+        Passed on to sim_runner for each variant (checkpointing, guardrails etc.). A
+        variant stopped by a guardrail doesn't stop the others; the stopped ones are
+        listed once all the variants are done, then fork_sched exits with an error. The
+        prefix is run with the same options, apart from streaming, checkpointing and
+        timing_file, which only apply to the branches. Files the options put next to the
+        output (trace, heartbeat, ...) are written next to fileroots[0] + 'prefix.db' for
+        the prefix.
+    """
+    years = np.round(survey_length/365.25)
+    if extra_info is None:
+        extra_info = {}
+    if variant_info is None:
+        variant_info = [os.path.basename(fileroot) for fileroot in fileroots]
+    if snapshot_file is None:
+        snapshot_file = fileroots[0] + 'prefix.pkl'
+    settings_file = os.path.splitext(snapshot_file)[0] + '_settings.json'
+    # Each branch writes checkpoints next to its own output file
+    kwargs.pop('checkpoint_dir', None)
+    kwargs.pop('snapshot', None)
+
+    if observatory is None:
+        observatory = get_observatory(nside=nside)
+    mjd_start = observatory.mjd + 0
+    fork_mjd = first_divergence(variant_footprints, mjd_start, mjd_start + survey_length)
+    if fork_mjd >= mjd_start + survey_length:
+        raise ValueError('The variant footprints never differ, so there is nothing to fork. Run a '
+                         'single variant instead')
+    print('Variants diverge after mjd %f, %.1f days in' % (fork_mjd, fork_mjd - mjd_start))
+
+    prefix_kwargs = dict([(key, val) for key, val in kwargs.items() if key not in _branch_only])
+    prefix_settings = {'nside': nside, 'survey_length': survey_length, 'illum_limit': illum_limit,
+                       'mjd_start': mjd_start, 'fork_mjd': fork_mjd}
+    prefix_settings.update([(key, kwargs.get(key)) for key in prefix_options])
+    if settings is not None:
+        prefix_settings.update(settings)
+    if os.path.isfile(snapshot_file):
+        _check_prefix(settings_file, prefix_settings)
+    else:
+        scheduler = Core_scheduler(surveys, nside=nside)
+        filter_sched = simple_filter_sched(illum_limit=illum_limit)
+        sim_runner(observatory, scheduler, survey_length=survey_length, verbose=verbose,
+                   extra_info=dict(extra_info), filter_scheduler=filter_sched,
+                   filename=fileroots[0] + 'prefix.db', stop_mjd=fork_mjd, stop_snapshot=snapshot_file,
+                   **prefix_kwargs)
+        with open(settings_file, 'w') as f:
+            json.dump(prefix_settings, f, sort_keys=True, default=str, indent=1)
+    del observatory
+
+    branches = []
+    for footprints, fileroot, info in zip(variant_footprints, fileroots, variant_info):
+        branch_info = dict(extra_info)
+        branch_info['fork variant'] = info
+        branch_kwargs = dict(kwargs)
+        branch_kwargs.update({'survey_length': survey_length, 'filename': fileroot+'%iyrs.db' % years,
+                              'delete_past': True, 'verbose': verbose, 'extra_info': branch_info,
+                              'snapshot': snapshot_file, 'on_restore': Footprint_swap(footprints)})
+        branches.append(branch_kwargs)
+
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.map(_run_branch, branches, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        results = [_run_branch(branch) for branch in branches]
+
+    stopped = [(info, reason) for info, (filename, reason) in zip(variant_info, results) if reason is not None]
+    if len(stopped) > 0:
+        for info, reason in stopped:
+            print('Variant %s: %s' % (info, reason))
+        raise SystemExit('%i of %i variants were stopped' % (len(stopped), len(results)))
+    return [filename for filename, reason in results]
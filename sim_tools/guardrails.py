@@ -0,0 +1,132 @@
+"""
+Stop runs that have gone wrong instead of letting them use up their whole allocation.
+
+Some corners of a parameter sweep make schedulers that barely observe, or that grind
+through each night very slowly. Guardrail_monitor watches a run and stops it when
+
+- the mean number of visits per night over the last min_visits_window nights drops
+  below min_visits_per_night (nights lost to weather or downtime count as 0 visits),
+- one simulated night takes more than max_night_seconds of wall time, or
+- there has been no visit for more than max_empty_nights days.
+
+Before stopping it writes <output>_aborted.json with the rule that tripped, where the run
+had got to and the recent per-night visit counts and timings. sim_runner then finishes
+the other monitors and exits with an error, without writing the output file.
+"""
+import os
+import sys
+import json
+import time
+import socket
+from collections import deque
+from .monitors import Run_monitor
+
+
+__all__ = ['Run_aborted', 'Guardrail_monitor']
+
+
+class Run_aborted(Exception):
+    """Raised by a monitor to stop a run"""
+    pass
+
+
+class Guardrail_monitor(Run_monitor):
+    """
+    Stop a run that is observing too little or going too slowly
+
+    Parameters
+    ----------
+    filename : str
+        Where to write the diagnostic record if the run is stopped
+    min_visits_per_night : float (0)
+        Smallest acceptable mean visits per night over the window. 0 to not check.
+        Nights without a visit count as 0, so leave room for weather and downtime.
+    min_visits_window : int (7)
+        Number of nights to average over
+    max_night_seconds : float (0)
+        Most wall seconds one simulated night may take. 0 to not check.
+    max_empty_nights : float (0)
+        Most days allowed without a visit. Should be longer than any scheduled downtime.
+        0 to not check.
+    """
+    def __init__(self, filename, min_visits_per_night=0, min_visits_window=7, max_night_seconds=0,
+                 max_empty_nights=0):
+        self.filename = filename
+        self.min_visits_per_night = min_visits_per_night
+        self.min_visits_window = min_visits_window
+        self.max_night_seconds = max_night_seconds
+        self.max_empty_nights = max_empty_nights
+        # The last few nights, kept for the diagnostic record
+        self.recent = deque(maxlen=max(min_visits_window, 14))
+        self.window = deque(maxlen=min_visits_window)
+        self.n_visits = 0
+        self.night_visits = 0
+        self.night_start = None
+        # mjd of the first visit of the current night
+        self.mjd_night = None
+        self.mjd_start = None
+        self.mjd_last_visit = None
+        self.t_start = None
+
+    def start(self, observatory, scheduler):
+        self.t_start = time.time()
+        self.night_start = self.t_start
+        self.mjd_start = observatory.mjd + 0
+        self.mjd_last_visit = observatory.mjd + 0
+        # Clear the record of an earlier attempt at the same run
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+
+    def _check_progress(self, observatory):
+        if self.max_night_seconds > 0 and time.time() - self.night_start > self.max_night_seconds:
+            self.abort('night took more than %g wall seconds' % self.max_night_seconds, observatory)
+        if self.max_empty_nights > 0 and observatory.mjd - self.mjd_last_visit > self.max_empty_nights:
+            self.abort('no visits for more than %g nights' % self.max_empty_nights, observatory)
+
+    def observation(self, observation):
+        self.n_visits += 1
+        self.night_visits += 1
+        self.mjd_last_visit = observation['mjd']
+        if self.mjd_night is None:
+            self.mjd_night = observation['mjd']
+        if self.max_night_seconds > 0 and time.time() - self.night_start > self.max_night_seconds:
+            self.abort('night took more than %g wall seconds' % self.max_night_seconds, None)
+
+    def no_observation(self, observatory, scheduler):
+        self._check_progress(observatory)
+
+    def night(self, night, observatory, scheduler):
+        now = time.time()
+        # The runner only sees a new night at its first visit, so nights with no visits
+        # show up as more than a day between the first visits of two nights
+        skipped = 0
+        if self.mjd_night is not None:
+            skipped = max(int(round(observatory.mjd - self.mjd_night)) - 1, 0)
+        self.mjd_night = observatory.mjd + 0
+        self.recent.append({'night': night, 'visits': self.night_visits, 'wall seconds': now - self.night_start,
+                            'nights without visits after': skipped})
+        self.window.append(self.night_visits)
+        self.window.extend([0] * skipped)
+        self.night_visits = 0
+        self.night_start = now
+        self._check_progress(observatory)
+        if (self.min_visits_per_night > 0 and len(self.window) == self.min_visits_window and
+                sum(self.window) / float(len(self.window)) < self.min_visits_per_night):
+            self.abort('mean of %.1f visits per night over the last %i nights, below %g' %
+                       (sum(self.window) / float(len(self.window)), len(self.window), self.min_visits_per_night),
+                       observatory)
+
+    def abort(self, reason, observatory):
+        record = {'reason': reason, 'command': ' '.join(sys.argv), 'host': socket.gethostname(),
+                  'mjd start': self.mjd_start, 'mjd last visit': self.mjd_last_visit,
+                  'visits': self.n_visits, 'wall seconds': time.time() - self.t_start,
+                  'recent nights': list(self.recent),
+                  'guardrails': {'min_visits_per_night': self.min_visits_per_night,
+                                 'min_visits_window': self.min_visits_window,
+                                 'max_night_seconds': self.max_night_seconds,
+                                 'max_empty_nights': self.max_empty_nights}}
+        if observatory is not None:
+            record['mjd'] = observatory.mjd
+        with open(self.filename, 'w') as f:
+            json.dump(record, f, indent=1)
+        raise Run_aborted('%s, details in %s' % (reason, self.filename))
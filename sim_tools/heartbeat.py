@@ -0,0 +1,81 @@
+"""
+Heartbeat files for long runs, and a summary of all the heartbeats in a sweep.
+
+With --heartbeat_minutes N a run rewrites <output>_heartbeat.json every N minutes with the
+simulated night, visits so far, visits per second, fraction done, projected finish time
+and RSS. The file is written once more with status 'finished' (or 'stopped' after a
+checkpoint_stop) at the end. Check on a sweep with:
+
+    python -m sim_tools.heartbeat /gscratch/sweep_dir
+
+which lists every heartbeat under the directory. A run still marked 'running' whose
+file has not been updated for more than two intervals is flagged as stale, since it has
+most likely been killed or has hung.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import datetime
+import argparse
+
+
+__all__ = ['read_heartbeats']
+
+
+def read_heartbeats(directory, now=None):
+    """
+    Read all the heartbeat files under directory
+
+    Returns
+    -------
+    heartbeats : list of dict
+        Heartbeat contents, with 'run' (file name without _heartbeat.json) added, and
+        status set to 'stale' for running jobs that have missed two beats
+    """
+    if now is None:
+        now = time.time()
+    heartbeats = []
+    for filename in sorted(glob.glob(os.path.join(directory, '**', '*_heartbeat.json'), recursive=True)):
+        try:
+            with open(filename) as f:
+                beat = json.load(f)
+        except ValueError:
+            continue
+        beat['run'] = os.path.relpath(filename, directory)[:-len('_heartbeat.json')]
+        if beat['status'] == 'running' and now - beat['updated'] > 2 * beat['interval']:
+            beat['status'] = 'stale'
+        heartbeats.append(beat)
+    return heartbeats
+
+
+def _clock(timestamp):
+    if timestamp is None:
+        return '-'
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%m-%d %H:%M')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise the heartbeat files in a sweep directory")
+    parser.add_argument("directory", type=str)
+    args = parser.parse_args()
+
+    now = time.time()
+    heartbeats = read_heartbeats(args.directory, now=now)
+    if len(heartbeats) == 0:
+        print('No heartbeat files under %s' % args.directory)
+        sys.exit(0)
+    width = max([len(beat['run']) for beat in heartbeats] + [3])
+    print('%-*s %-9s %6s %8s %8s %7s %12s %8s %8s' % (width, 'run', 'status', 'night', 'visits', 'vis/sec',
+                                                      'done', 'finish', 'RSS MB', 'age min'))
+    counts = {}
+    for beat in heartbeats:
+        counts[beat['status']] = counts.get(beat['status'], 0) + 1
+        print('%-*s %-9s %6i %8i %8.1f %6.1f%% %12s %8.0f %8.1f' % (width, beat['run'], beat['status'],
+                                                                   beat['night'], beat['visits'],
+                                                                   beat['visits per sec'],
+                                                                   beat['fraction done']*100,
+                                                                   _clock(beat['projected finish']),
+                                                                   beat['rss mb'], (now - beat['updated'])/60.))
+    print(', '.join(['%i %s' % (count, status) for status, count in sorted(counts.items())]))
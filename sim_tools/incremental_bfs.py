@@ -0,0 +1,184 @@
+"""
+Keep the maps of history-dependent basis functions up to date as observations come in.
+
+Some basis functions rebuild their whole map from their feature counters at every reward
+call, even though an observation only changes the pixels under the field of view.
+Incremental_bf_monitor keeps the map ready instead, updated in add_observation for just
+the pixels the observation touched. Limit_repeat_basis_function keeps its 0/1 map of
+pixels at the per-night limit, and rebuilds it when the night count resets.
+
+Basis functions whose map moves with the mjd at every pixel (N_obs_per_year,
+Avoid_long_gaps, Cadence_enhance_trapezoid) are left alone. Tracking which pixels cross a
+time threshold each step in python costs more than the few vectorized passes over the
+map they make now. Footprint_basis_function is left alone too: a running total of
+N_obs_all only saves the one sum, 47 to 40 us a call, and the rest of its map (the
+footprint times that total, less N_obs) still has to be rebuilt every call.
+
+The library's own _calc_value stays in place as the recompute path. The first call after
+a basis function has taken in an observation, and every check_every-th call for its class,
+runs both and compares them element for element. If they ever differ, that class goes
+back to the recompute path for the rest of the run and the mismatch is reported. These
+are spot checks: a map that starts to differ between two of them is used until the next
+one, and can change the schedule in the meantime. Use check_every=1 to compare every call
+when trying a new library version.
+"""
+import json
+import time
+import warnings
+import numpy as np
+from .monitors import Run_monitor
+
+
+__all__ = ['incremental_classes', 'Incremental_bf_monitor']
+
+
+def _touched(indx):
+    return np.unique(np.asarray(indx, dtype=int).ravel())
+
+
+class _Limit_repeat_state(object):
+    """Map of pixels still under the per-night limit"""
+    def __init__(self, basis_function):
+        self.feature = basis_function.survey_features['n_obs']
+        self.n_limit = basis_function.n_limit
+        self.refresh()
+
+    def refresh(self):
+        self.night = getattr(self.feature, 'night', None)
+        self.result = np.ones(np.size(self.feature.feature))
+        self.result[np.where(self.feature.feature >= self.n_limit)] = 0
+
+    def update(self, indx):
+        if indx is None or getattr(self.feature, 'night', None) != self.night:
+            self.refresh()
+            return
+        pixels = _touched(indx)
+        self.result[pixels] = np.where(self.feature.feature[pixels] >= self.n_limit, 0., 1.)
+
+    def value(self, conditions):
+        return self.result.copy()
+
+
+# Basis function classes with an incremental version
+incremental_classes = {'Limit_repeat_basis_function': _Limit_repeat_state}
+
+
+def _same(value1, value2):
+    value1 = np.asarray(value1)
+    value2 = np.asarray(value2)
+    return value1.dtype == value2.dtype and np.array_equal(value1, value2, equal_nan=True)
+
+
+class Incremental_bf_monitor(Run_monitor):
+    """
+    Use incrementally maintained maps for the classes in incremental_classes
+
+    For each class, the number of calls, the mean microseconds per call on the
+    incremental path, the number of calls checked against the recompute path and the mean
+    microseconds the recompute path took on those go in extra_info as 'incremental bfs',
+    along with any class that was switched back to recomputing and why.
+
+    Parameters
+    ----------
+    check_every : int (100)
+        Compare with the recompute path on the first call after each basis function has
+        taken in an observation, and on every check_every-th call for its class. 1 checks
+        every call, 0 only the first.
+    """
+    def __init__(self, check_every=100):
+        self.check_every = check_every
+        self.states = {}
+        # Basis functions that have taken in an observation, and those not checked since
+        self.observed = set()
+        self.awaiting_check = set()
+        self.patched = []
+        self.stats = {}
+        self.disabled = {}
+
+    def _wrap_calc_value(self, func):
+        monitor = self
+
+        def _calc_value(bf, conditions, **kwargs):
+            name = type(bf).__name__
+            state = monitor.states.get(id(bf))
+            if state is None or name in monitor.disabled:
+                return func(bf, conditions, **kwargs)
+            stats = monitor.stats[name]
+            t0 = time.perf_counter()
+            value = state.value(conditions)
+            stats['seconds'] += time.perf_counter() - t0
+            stats['calls'] += 1
+            # The first check waits for an observation, so it covers the incremental updates
+            if id(bf) in monitor.awaiting_check or \
+                    (monitor.check_every > 0 and stats['calls'] % monitor.check_every == 0):
+                monitor.awaiting_check.discard(id(bf))
+                t0 = time.perf_counter()
+                expected = func(bf, conditions, **kwargs)
+                stats['recompute seconds'] += time.perf_counter() - t0
+                stats['checked'] += 1
+                if not _same(value, expected):
+                    monitor.disabled[name] = 'differs from the recompute path at mjd %.6f' % conditions.mjd
+                    warnings.warn('%s %s, recomputing it from now on' % (name, monitor.disabled[name]))
+                    return expected
+            return value
+        return _calc_value
+
+    def _wrap_add_observation(self, func):
+        monitor = self
+
+        def add_observation(bf, observation, *args, **kwargs):
+            state = monitor.states.get(id(bf))
+            if state is None or type(bf).__name__ in monitor.disabled:
+                return func(bf, observation, *args, **kwargs)
+            indx = kwargs.get('indx', args[0] if len(args) > 0 else None)
+            result = func(bf, observation, *args, **kwargs)
+            state.update(indx)
+            if id(bf) not in monitor.observed:
+                monitor.observed.add(id(bf))
+                monitor.awaiting_check.add(id(bf))
+            return result
+        return add_observation
+
+    def start(self, observatory, scheduler):
+        for survey_list in scheduler.survey_lists:
+            for survey in survey_list:
+                for basis_function in survey.basis_functions:
+                    cls = type(basis_function)
+                    name = cls.__name__
+                    if name not in incremental_classes or id(basis_function) in self.states or \
+                            name in self.disabled:
+                        continue
+                    try:
+                        self.states[id(basis_function)] = incremental_classes[name](basis_function)
+                    except (KeyError, AttributeError) as err:
+                        self.disabled[name] = 'not supported by this version (%s)' % err
+                        continue
+                    if cls not in [val[0] for val in self.patched]:
+                        self.patched.append((cls, cls.__dict__.get('_calc_value'),
+                                             cls.__dict__.get('add_observation')))
+                        cls._calc_value = self._wrap_calc_value(cls._calc_value)
+                        cls.add_observation = self._wrap_add_observation(cls.add_observation)
+                        self.stats[name] = {'calls': 0, 'seconds': 0., 'checked': 0, 'recompute seconds': 0.}
+
+    def finish(self, observatory, scheduler, extra_info, filename):
+        for cls, calc_value, add_observation in self.patched[::-1]:
+            if calc_value is None:
+                del cls._calc_value
+            else:
+                cls._calc_value = calc_value
+            if add_observation is None:
+                del cls.add_observation
+            else:
+                cls.add_observation = add_observation
+        self.patched = []
+        self.states = {}
+        self.observed = set()
+        self.awaiting_check = set()
+        summary = {}
+        for name, stats in self.stats.items():
+            summary[name] = {'calls': stats['calls'], 'checked': stats['checked'],
+                             'incremental us': round(1e6 * stats['seconds'] / max(stats['calls'], 1), 1),
+                             'recompute us': round(1e6 * stats['recompute seconds'] / max(stats['checked'], 1), 1)}
+        for name, reason in self.disabled.items():
+            summary.setdefault(name, {})['recomputed'] = reason
+        extra_info['incremental bfs'] = json.dumps(summary)
@@ -0,0 +1,149 @@
+"""
+Share one basis function object between all the surveys that build an identical one.
+
+gen_greedy_surveys and generate_blobs make a new Planet_mask, Moon_avoidance,
+Zenith_shadow_mask, Footprint, etc. for every filter and filter pair, so the same map is
+evaluated once per survey every step. Bf_registry hands back one instance for each
+distinct (class, configuration), so the masks get evaluated once per step (the base
+basis function keeps its value until the mjd changes) and stateful basis functions keep
+a single set of counters.
+
+Every survey passes every observation to all of its basis functions, so a shared instance
+would see each observation several times. Interned classes get an add_observation that
+skips an observation the instance has already seen. Surveys skip the observations named
+in their ignore_obs, so basis functions are only shared between surveys that ignore the
+same ones; otherwise a shared counter would pick up visits one of its surveys never passes
+on.
+"""
+import types
+import numpy as np
+
+
+__all__ = ['Bf_registry', 'intern_basis_functions']
+
+
+_opaque_types = (types.FunctionType, types.MethodType, types.BuiltinFunctionType,
+                 types.ModuleType, type)
+
+
+def _fingerprint(value, memo):
+    """Hashable, exact summary of an object's contents"""
+    if isinstance(value, (int, float, complex, str, bytes, bool, type(None))):
+        return (type(value).__name__, value)
+    if id(value) in memo:
+        return ('cycle', memo[id(value)])
+    memo[id(value)] = len(memo)
+    if isinstance(value, np.memmap):
+        # Memory-mapped tables are compared by file rather than read in
+        return ('memmap', value.filename, value.offset, value.shape, value.dtype.str)
+    if isinstance(value, np.ma.MaskedArray):
+        return ('masked', value.shape, value.dtype.str, value.data.tobytes(),
+                np.ma.getmaskarray(value).tobytes(), _fingerprint(value.fill_value, memo))
+    if isinstance(value, np.ndarray):
+        return ('array', value.shape, value.dtype.str, value.tobytes())
+    if isinstance(value, np.generic):
+        return ('scalar', value.dtype.str, value.tobytes())
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple([_fingerprint(val, memo) for val in value])
+    if isinstance(value, dict):
+        return ('dict',) + tuple([(_fingerprint(key, memo), _fingerprint(value[key], memo))
+                                  for key in sorted(value.keys(), key=repr)])
+    if hasattr(value, '__dict__') and not isinstance(value, _opaque_types):
+        return ('object', type(value), _fingerprint(vars(value), memo))
+    # Functions, modules and anything else opaque only match themselves
+    return ('id', id(value))
+
+
+def _shared_add_observation(func):
+    def add_observation(self, observation, *args, **kwargs):
+        # Pass straight through for unshared objects, and for calls to a parent class
+        # add_observation from inside one already being run
+        if not getattr(self, '_interned', False) or getattr(self, '_adding', False):
+            return func(self, observation, *args, **kwargs)
+        key = observation.tobytes() if hasattr(observation, 'tobytes') else id(observation)
+        if key == getattr(self, '_last_observation', None):
+            return
+        self._last_observation = key
+        self._adding = True
+        try:
+            return func(self, observation, *args, **kwargs)
+        finally:
+            self._adding = False
+    add_observation._shared = True
+    return add_observation
+
+
+class Bf_registry(object):
+    """
+    Keeps one instance of each distinct basis function
+
+    Two basis functions count as the same if they are the same class and everything
+    they hold compares equal (arrays element for element, other objects recursively,
+    functions by identity), which for freshly built objects means the same constructor
+    arguments.
+
+    Can be used as a factory, registry(bf.Planet_mask_basis_function, nside=nside), or
+    on objects that already exist with intern(basis_function, ignore_obs).
+    """
+    def __init__(self):
+        self.instances = {}
+        self.requested = 0
+
+    def intern(self, basis_function, ignore_obs=None):
+        """
+        Return the registered instance equivalent to basis_function, registering it if new
+
+        Parameters
+        ----------
+        basis_function : Base_basis_function
+        ignore_obs : str or list of str (None)
+            The ignore_obs of the survey that holds it. Only basis functions held by
+            surveys that ignore the same observations are shared.
+        """
+        self.requested += 1
+        key = (_fingerprint(ignore_obs, {}), _fingerprint(basis_function, {}))
+        shared = self.instances.get(key)
+        if shared is None:
+            self.instances[key] = basis_function
+            shared = basis_function
+        elif shared is not basis_function:
+            shared._interned = True
+        # Objects restored from a snapshot are already shared, but their class may not be set up yet
+        if getattr(shared, '_interned', False):
+            cls = type(shared)
+            if not getattr(cls.add_observation, '_shared', False):
+                cls.add_observation = _shared_add_observation(cls.add_observation)
+        return shared
+
+    def __call__(self, cls, *args, **kwargs):
+        return self.intern(cls(*args, **kwargs))
+
+    def stats(self):
+        return {'requested': self.requested, 'unique': len(self.instances)}
+
+
+def intern_basis_functions(scheduler, registry=None):
+    """
+    Replace duplicate basis functions in all of a scheduler's surveys with shared instances
+
+    Should be called before the scheduler has seen any observations, or on a scheduler
+    restored from a snapshot of a run that was interned.
+
+    Parameters
+    ----------
+    scheduler : Core_scheduler
+    registry : Bf_registry (None)
+        Registry to use, a new one by default
+
+    Returns
+    -------
+    registry : Bf_registry
+    """
+    if registry is None:
+        registry = Bf_registry()
+    for survey_list in scheduler.survey_lists:
+        for survey in survey_list:
+            ignore_obs = getattr(survey, 'ignore_obs', None)
+            survey.basis_functions = [registry.intern(basis_function, ignore_obs)
+                                      for basis_function in survey.basis_functions]
+    return registry
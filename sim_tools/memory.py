@@ -0,0 +1,164 @@
+"""
+Track how the memory of a run grows over the simulated survey.
+
+Memory_monitor records the RSS of the process and the size of the main parts of the
+scheduler and observatory once a simulated month, and writes them to
+<output>_memory.csv as it goes, so a run that dies still leaves its table behind. The
+table is in long form, one row per (time, item):
+
+    night, mjd, visits, item, mb
+
+Items are 'rss' and 'peak rss', every attribute of the scheduler and observatory
+('scheduler.queue', 'observatory.sky_model', ...), the total for each survey class
+('surveys Blob_survey') and each tier of surveys ('tier scheduler.survey_lists[0]').
+Sizes are of everything reachable from the item: numpy data plus python object
+overhead. Objects reachable from more than one item are counted under the first one, so
+the survey class, scheduler and observatory items add up to the memory held by the two.
+The tier items are sized on their own and overlap the survey class items, so they are
+left out of that sum.
+"""
+import os
+import sys
+import csv
+import types
+import numpy as np
+from .monitors import Run_monitor, Timing_monitor, current_rss_mb
+
+
+__all__ = ['deep_size', 'Memory_monitor']
+
+_skip_types = (types.FunctionType, types.MethodType, types.BuiltinFunctionType,
+               types.ModuleType, type)
+
+_columns = ['night', 'mjd', 'visits', 'item', 'mb']
+
+
+def deep_size(value, memo=None):
+    """
+    Bytes held by value and everything it refers to
+
+    Memory-mapped arrays and views count only their headers, since their data is held
+    elsewhere. Functions, classes and modules are not counted.
+
+    Parameters
+    ----------
+    value : object
+    memo : set (None)
+        ids of objects already counted, shared between calls to count each object once
+
+    Returns
+    -------
+    size : int
+        bytes
+    """
+    if memo is None:
+        memo = set()
+    size = 0
+    # Walk with a stack rather than recursion, observation histories can be long chains
+    stack = [value]
+    while len(stack) > 0:
+        value = stack.pop()
+        if id(value) in memo or isinstance(value, _skip_types):
+            continue
+        memo.add(id(value))
+        size += sys.getsizeof(value)
+        if isinstance(value, np.ndarray):
+            if value.base is None and not isinstance(value, np.memmap):
+                size += value.nbytes
+            if value.dtype == object:
+                stack.extend(value.ravel().tolist())
+            continue
+        if isinstance(value, (str, bytes, int, float, complex, bool, np.generic)) or value is None:
+            continue
+        if isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            stack.extend(value)
+        if hasattr(value, '__dict__'):
+            stack.append(vars(value))
+        for name in getattr(type(value), '__slots__', ()):
+            if hasattr(value, name):
+                stack.append(getattr(value, name))
+    return size
+
+
+class Memory_monitor(Run_monitor):
+    """
+    Write RSS and the sizes of the scheduler and observatory to a table every month
+
+    Parameters
+    ----------
+    filename : str
+        csv file to write. Rows later than the start of the run are dropped from an
+        existing file, so a resumed run carries on the table of the run it resumes.
+    interval : float (30.4375)
+        Simulated days between rows
+    night : int (0)
+        The night the run starts on (e.g. from the checkpoint a run was resumed from)
+    n_visits : int (0)
+        Visits made before the run starts (e.g. restored from a checkpoint)
+    """
+    def __init__(self, filename, interval=30.4375, night=0, n_visits=0):
+        self.filename = filename
+        self.interval = interval
+        self.n_visits = n_visits
+        self.current_night = night
+        self.mjd_last = None
+
+    def start(self, observatory, scheduler):
+        kept = []
+        if os.path.isfile(self.filename):
+            with open(self.filename) as f:
+                kept = [row for row in csv.DictReader(f) if float(row['mjd']) < observatory.mjd - 1e-4]
+        with open(self.filename, 'w') as f:
+            writer = csv.DictWriter(f, fieldnames=_columns)
+            writer.writeheader()
+            writer.writerows(kept)
+        self.record(observatory, scheduler)
+
+    def observation(self, observation):
+        self.n_visits += 1
+
+    def night(self, night, observatory, scheduler):
+        self.current_night = night
+        if observatory.mjd - self.mjd_last >= self.interval:
+            self.record(observatory, scheduler)
+
+    def finish(self, observatory, scheduler, extra_info, filename):
+        self.record(observatory, scheduler)
+
+    def sizes(self, observatory, scheduler):
+        """
+        Sizes of the parts of the scheduler and observatory
+
+        Returns
+        -------
+        sizes : list of [item, bytes]
+        """
+        memo = set()
+        sizes = []
+        # Surveys first, so they are counted under their class rather than their tier
+        classes = {}
+        for survey_list in getattr(scheduler, 'survey_lists', []):
+            for survey in survey_list:
+                name = 'surveys %s' % type(survey).__name__
+                classes[name] = classes.get(name, 0) + deep_size(survey, memo)
+        sizes.extend(sorted(classes.items()))
+        for label, obj in [('scheduler', scheduler), ('observatory', observatory)]:
+            for key in sorted(vars(obj).keys()):
+                sizes.append(['%s.%s' % (label, key), deep_size(vars(obj)[key], memo)])
+        # Tiers get their own memo, the surveys in them are already counted above
+        for i, survey_list in enumerate(getattr(scheduler, 'survey_lists', [])):
+            sizes.append(['tier scheduler.survey_lists[%i]' % i, deep_size(survey_list)])
+        return sizes
+
+    def record(self, observatory, scheduler):
+        self.mjd_last = observatory.mjd + 0
+        rows = [['rss', current_rss_mb() * 1024.**2], ['peak rss', Timing_monitor.peak_rss_mb() * 1024.**2]]
+        rows.extend(self.sizes(observatory, scheduler))
+        with open(self.filename, 'a') as f:
+            writer = csv.writer(f)
+            for item, nbytes in rows:
+                writer.writerow([self.current_night, '%.5f' % self.mjd_last, self.n_visits, item,
+                                 '%.3f' % (nbytes / 1024.**2)])
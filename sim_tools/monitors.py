@@ -0,0 +1,172 @@
+import os
+import sys
+import time
+import json
+import socket
+import resource
+
+
+__all__ = ['Run_monitor', 'Timing_monitor', 'Heartbeat_monitor']
+
+
+class Run_monitor(object):
+    """
+    Base class for things that watch a simulation run by sim_runner
+
+    sim_runner calls these at fixed points in the observe loop. Subclasses override
+    the ones they need; the defaults do nothing.
+    """
+    def start(self, observatory, scheduler):
+        """Called once, before the first observation (or after restoring a snapshot)"""
+        pass
+
+    def observation(self, observation):
+        """Called with each completed observation"""
+        pass
+
+    def night(self, night, observatory, scheduler):
+        """Called each time the observatory rolls over to a new night"""
+        pass
+
+    def no_observation(self, observatory, scheduler):
+        """Called when the scheduler has nothing to observe and the loop steps forward"""
+        pass
+
+    def finish(self, observatory, scheduler, extra_info, filename):
+        """
+        Called when the loop ends, before extra_info is written to the output file.
+        filename is None if the run stopped early (e.g., at a snapshot) and no output
+        will be written.
+        """
+        pass
+
+
+class Timing_monitor(Run_monitor):
+    """
+    Record how fast a run went and write it to a json file at the end
+
+    The file has the wall clock time the observe loop started ('loop_start', unix
+    seconds, so a caller that noted when it launched the process can work out the startup
+    time), the loop's wall time, the number of visits and nights, and the peak RSS of the
+    process (MB) both before the first visit and for the whole run.
+
+    Parameters
+    ----------
+    filename : str
+        json file to write
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.loop_start = None
+        self.startup_rss_mb = None
+        self.n_visits = 0
+        self.n_nights = 0
+
+    @staticmethod
+    def peak_rss_mb():
+        # ru_maxrss is in kB on linux, bytes on macOS
+        scale = 1024.**2 if sys.platform == 'darwin' else 1024.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+    def start(self, observatory, scheduler):
+        self.loop_start = time.time()
+        self.startup_rss_mb = self.peak_rss_mb()
+
+    def observation(self, observation):
+        self.n_visits += 1
+
+    def night(self, night, observatory, scheduler):
+        self.n_nights += 1
+
+    def finish(self, observatory, scheduler, extra_info, filename):
+        loop_seconds = time.time() - self.loop_start
+        result = {'loop_start': self.loop_start, 'loop_seconds': loop_seconds,
+                  'n_visits': self.n_visits, 'n_nights': self.n_nights,
+                  'startup_rss_mb': self.startup_rss_mb, 'peak_rss_mb': self.peak_rss_mb(),
+                  'output': filename}
+        with open(self.filename, 'w') as f:
+            json.dump(result, f, indent=1)
+
+
+def current_rss_mb():
+    """Resident memory of this process now (MB), or the peak where that isn't available"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1024.**2
+    except (IOError, OSError, ValueError):
+        return Timing_monitor.peak_rss_mb()
+
+
+class Heartbeat_monitor(Run_monitor):
+    """
+    Write a small json progress file every few minutes
+
+    Parameters
+    ----------
+    filename : str
+        The heartbeat file, rewritten in place
+    end_mjd : float
+        mjd the run finishes at, for the fraction done and projected finish
+    interval : float (600)
+        Seconds between heartbeats. Checked after each visit, each step with no
+        observation and each new night, so daytime, weather and a stalled scheduler keep
+        the heartbeat going too.
+    night : int (0)
+        The night the run starts on, counted from the start of the survey (e.g. from the
+        checkpoint a run was resumed from)
+    """
+    def __init__(self, filename, end_mjd, interval=600., night=0):
+        self.filename = filename
+        self.end_mjd = end_mjd
+        self.interval = interval
+        self.t_start = None
+        self.mjd_start = None
+        self.last_beat = None
+        self.n_visits = 0
+        self.current_night = night
+        self.observatory = None
+
+    def start(self, observatory, scheduler):
+        self.t_start = time.time()
+        self.mjd_start = observatory.mjd + 0
+        self.observatory = observatory
+        self.beat('running')
+
+    def _check(self):
+        if time.time() - self.last_beat >= self.interval:
+            self.beat('running')
+
+    def observation(self, observation):
+        self.n_visits += 1
+        self._check()
+
+    def no_observation(self, observatory, scheduler):
+        self._check()
+
+    def night(self, night, observatory, scheduler):
+        self.current_night = night
+        self._check()
+
+    def finish(self, observatory, scheduler, extra_info, filename):
+        self.beat('finished' if filename is not None else 'stopped')
+        self.observatory = None
+
+    def beat(self, status):
+        now = time.time()
+        self.last_beat = now
+        elapsed = now - self.t_start
+        mjd = self.observatory.mjd
+        done = (mjd - self.mjd_start) / (self.end_mjd - self.mjd_start) if self.end_mjd > self.mjd_start else 1.
+        eta = None
+        if status == 'running' and mjd > self.mjd_start:
+            eta = now + elapsed * (self.end_mjd - mjd) / (mjd - self.mjd_start)
+        beat = {'status': status, 'updated': now, 'interval': self.interval,
+                'host': socket.gethostname(), 'pid': os.getpid(),
+                'night': self.current_night, 'mjd': mjd, 'fraction done': min(done, 1.),
+                'visits': self.n_visits, 'visits per sec': self.n_visits / elapsed if elapsed > 0 else 0.,
+                'elapsed sec': elapsed, 'projected finish': eta, 'rss mb': current_rss_mb()}
+        # Write then rename, so a reader never sees half a file
+        with open(self.filename + '.tmp', 'w') as f:
+            json.dump(beat, f, indent=1)
+        os.replace(self.filename + '.tmp', self.filename)
@@ -0,0 +1,218 @@
+"""
+Evaluate the surveys of a tier on a thread pool.
+
+Core_scheduler asks each survey of a tier for its reward in turn, and most of each
+survey's time goes on numpy HEALpix arithmetic that releases the GIL. With
+Parallel_reward_monitor, the first time the scheduler asks a survey of a tier for its
+reward in a step, every survey of that tier is evaluated on the pool. The scheduler then
+gets the stored results in its usual order. A lower tier is only evaluated if the
+scheduler asks for it, the same as serial evaluation.
+
+Surveys that share a stateful object (an interned basis function, a shared feature, ...)
+are evaluated one after the other in the same thread, so no object is ever updated by
+two threads at once. Shared footprint objects (classes in warm_classes) would put every
+survey in one group. Instead they are brought up to the step's mjd on the main thread
+before the pool starts, after which the surveys only read them. The same goes for the
+maps the conditions object works out the first time they are asked for (hour angle,
+azimuth to the sun, the per-filter 5-sigma depths, ...). Every property of the
+conditions is read on the main thread first (read_conditions), so the survey threads
+never compute, or see half-filled, lazy maps. Each survey does exactly
+the same arithmetic as it would serially, so the rewards and the schedule are identical.
+"""
+import json
+import time
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .monitors import Run_monitor
+
+
+__all__ = ['warm_classes', 'read_conditions', 'survey_groups', 'Parallel_reward_monitor']
+
+# Shared objects that only change when called with a new mjd
+warm_classes = ['Footprints', 'Footprint', 'Footprint_table']
+
+_skip_types = (types.FunctionType, types.MethodType, types.BuiltinFunctionType,
+               types.ModuleType, type, np.ndarray, str, bytes, int, float, complex, bool)
+
+
+def read_conditions(conditions):
+    """
+    Read every property of conditions, so lazily computed maps are filled in
+
+    Conditions computes some maps the first time they are read after the conditions
+    change, some of them a filter at a time (M5Depth), so they must not be first read
+    from several threads at once. All properties are read rather than a list of known
+    lazy ones, so ones added to Conditions later are covered too.
+
+    Parameters
+    ----------
+    conditions : Conditions
+    """
+    names = set()
+    for cls in type(conditions).__mro__:
+        names.update(name for name, value in vars(cls).items() if isinstance(value, property))
+    for name in sorted(names):
+        try:
+            getattr(conditions, name)
+        except Exception:
+            # Not computable with what the conditions hold, a survey asking for it
+            # would fail the same way in a serial run
+            pass
+
+
+def _instances(value, found, warm):
+    """ids of the class instances reachable from value, and the warm-able ones among them"""
+    stack = [value]
+    while len(stack) > 0:
+        value = stack.pop()
+        if value is None or isinstance(value, _skip_types) or isinstance(value, np.generic):
+            continue
+        if isinstance(value, dict):
+            stack.extend(value.values())
+            continue
+        if isinstance(value, (list, tuple, set, frozenset)):
+            stack.extend(value)
+            continue
+        if id(value) in found or not hasattr(value, '__dict__'):
+            continue
+        if type(value).__name__ in warm_classes:
+            warm[id(value)] = value
+            continue
+        found.add(id(value))
+        stack.extend(vars(value).values())
+
+
+def survey_groups(surveys):
+    """
+    Split surveys into groups that share no stateful objects
+
+    Returns
+    -------
+    groups : list of lists of int
+        Indices into surveys, in order
+    warm : list
+        Shared objects from warm_classes, to update before evaluating in parallel
+    """
+    owner = {}
+    parent = list(range(len(surveys)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    warm = {}
+    for i, survey in enumerate(surveys):
+        found = set()
+        _instances(survey, found, warm)
+        for key in found:
+            if key in owner:
+                parent[find(i)] = find(owner[key])
+            else:
+                owner[key] = i
+    groups = {}
+    for i in range(len(surveys)):
+        groups.setdefault(find(i), []).append(i)
+    return sorted(groups.values()), list(warm.values())
+
+
+class Parallel_reward_monitor(Run_monitor):
+    """
+    Evaluate each tier's survey rewards on a thread pool
+
+    The number of tiers evaluated, surveys evaluated, groups run and the wall seconds
+    spent go in extra_info as 'parallel rewards'.
+
+    Parameters
+    ----------
+    n_threads : int (4)
+    """
+    def __init__(self, n_threads=4):
+        self.n_threads = n_threads
+        self.executor = None
+        self.local = threading.local()
+        self.tiers = []
+        self.tier_of = {}
+        self.patched = []
+        self.step_key = None
+        self.results = {}
+        self.counts = {'tiers': 0, 'surveys': 0, 'groups': 0, 'seconds': 0.}
+
+    def _wrap(self, func):
+        monitor = self
+
+        def calc_reward_function(survey, conditions, *args, **kwargs):
+            tier = monitor.tier_of.get(id(survey))
+            if getattr(monitor.local, 'in_pool', False) or tier is None or len(args) > 0 or len(kwargs) > 0:
+                return func(survey, conditions, *args, **kwargs)
+            key = (id(conditions), conditions.mjd)
+            if key != monitor.step_key:
+                monitor.step_key = key
+                monitor.results = {}
+            if id(survey) not in monitor.results:
+                monitor.evaluate_tier(tier, conditions)
+            result = monitor.results.pop(id(survey))
+            if isinstance(result, BaseException):
+                raise result
+            return result
+        return calc_reward_function
+
+    def _run_group(self, surveys, conditions):
+        self.local.in_pool = True
+        results = []
+        try:
+            for survey in surveys:
+                try:
+                    results.append(survey.calc_reward_function(conditions))
+                except Exception as err:
+                    results.append(err)
+        finally:
+            self.local.in_pool = False
+        return results
+
+    def evaluate_tier(self, tier, conditions):
+        t0 = time.time()
+        surveys, groups, warm = self.tiers[tier]
+        for obj in warm:
+            obj(conditions.mjd)
+        read_conditions(conditions)
+        futures = [self.executor.submit(self._run_group, [surveys[i] for i in group], conditions)
+                   for group in groups]
+        for group, future in zip(groups, futures):
+            for i, result in zip(group, future.result()):
+                self.results[id(surveys[i])] = result
+        self.counts['tiers'] += 1
+        self.counts['surveys'] += len(surveys)
+        self.counts['groups'] += len(groups)
+        self.counts['seconds'] += time.time() - t0
+
+    def start(self, observatory, scheduler):
+        self.executor = ThreadPoolExecutor(max_workers=self.n_threads)
+        for tier, survey_list in enumerate(scheduler.survey_lists):
+            groups, warm = survey_groups(survey_list)
+            self.tiers.append((list(survey_list), groups, warm))
+            for survey in survey_list:
+                self.tier_of[id(survey)] = tier
+                cls = type(survey)
+                if cls not in [val[0] for val in self.patched]:
+                    self.patched.append((cls, cls.__dict__.get('calc_reward_function')))
+                    cls.calc_reward_function = self._wrap(cls.calc_reward_function)
+
+    def finish(self, observatory, scheduler, extra_info, filename):
+        for cls, original in self.patched[::-1]:
+            if original is None:
+                del cls.calc_reward_function
+            else:
+                cls.calc_reward_function = original
+        self.patched = []
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        counts = dict(self.counts)
+        counts['seconds'] = round(counts['seconds'], 3)
+        counts['threads'] = self.n_threads
+        counts['group sizes'] = [[len(group) for group in groups] for surveys, groups, warm in self.tiers]
+        extra_info['parallel rewards'] = json.dumps(counts)
@@ -0,0 +1,314 @@
+"""
+Hold the scheduler's HEALpix maps in float32 rather than float64.
+
+The footprints, basis function maps, survey feature counters and reward maps are all
+float64 arrays of one value per HEALpix (per filter for footprints). At nside=64 and
+above they make up most of a run's memory. Map_dtype_monitor converts them at the start of
+a run, and converts the per-pixel conditions maps listed in conditions_maps on each new set
+of conditions too, so the basis function values and the reward sum in each survey stay in
+float32 rather than being promoted back to float64. Masked arrays keep their masks.
+
+Maps of times (mjd of last observation, etc.) keep float64. float32 has a resolution of
+about 6 minutes at mjd 60000. They are recognised by attribute name, by feature class
+(time_valued_features) and by value. slewtime is a map of slew durations in seconds, not
+a time, so it is converted.
+
+Check what it does to a given driver with:
+
+    python -m sim_tools.precision baseline/baseline.py --nexp 2 --survey_length 60
+
+which runs the driver with and without --map_dtype float32 and reports where the
+observations first differ, how far the summary metrics moved, and the speed and memory of
+the two runs.
+"""
+import os
+import glob
+import json
+import time
+import types
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import numpy as np
+from .monitors import Run_monitor
+from .compare_db import compare_db
+from .check_resume import run_driver
+from .preview import summary_metrics
+
+
+__all__ = ['time_valued_features', 'conditions_maps', 'convert_maps', 'convert_conditions',
+           'Map_dtype_monitor', 'precision_study']
+
+# Survey features whose maps hold mjds
+time_valued_features = ['Last_observed', 'Last_N_obs_times', 'Last_N_obs_times_pnight',
+                        'Last_observed_night']
+
+# Per-pixel maps of the conditions (dicts hold one map per filter)
+conditions_maps = ['ra', 'dec', 'alt', 'az', 'airmass', 'slewtime', 'skybrightness',
+                   'FWHMeff', 'M5Depth']
+
+# Names that look like times but aren't
+_not_times = ['slewtime']
+
+_opaque_types = (types.FunctionType, types.MethodType, types.BuiltinFunctionType,
+                 types.ModuleType, type)
+
+# Larger than any count or magnitude; an mjd or a time in seconds will be above it
+_max_value = 1e4
+
+
+def _keep(name):
+    name = str(name).lower()
+    return name not in _not_times and ('mjd' in name or 'time' in name)
+
+
+def _convert(array, npix, dtype, counts, check_values=True):
+    """array converted to dtype, or None if it isn't a float64 map of non-times"""
+    if (type(array) not in (np.ndarray, np.ma.MaskedArray) or array.dtype != np.float64
+            or array.ndim == 0 or array.shape[-1] != npix):
+        return None
+    if check_values:
+        finite = np.ma.getdata(array)[np.isfinite(np.ma.getdata(array))]
+        if finite.size > 0 and np.max(np.abs(finite)) > _max_value:
+            return None
+    counts['arrays'] += 1
+    counts['bytes before'] += array.nbytes
+    result = array.astype(dtype)
+    counts['bytes after'] += result.nbytes
+    return result
+
+
+def convert_maps(value, npix, dtype=np.float32, memo=None, counts=None):
+    """
+    Convert float64 per-HEALpix arrays reachable from value to dtype, in place
+
+    Arrays are replaced on the objects, lists and dicts holding them. Only float64 arrays
+    with a last dimension of npix are touched.
+
+    Parameters
+    ----------
+    value : object
+        Where to start, e.g., a Core_scheduler
+    npix : int
+        Number of HEALpix in the maps
+    dtype : numpy dtype (np.float32)
+
+    Returns
+    -------
+    counts : dict
+        Number of arrays converted and their total size before and after (bytes)
+    """
+    if memo is None:
+        memo = set()
+    if counts is None:
+        counts = {'arrays': 0, 'bytes before': 0, 'bytes after': 0}
+    if id(value) in memo:
+        return counts
+    memo.add(id(value))
+
+    if isinstance(value, list):
+        items = enumerate(value)
+    elif isinstance(value, dict):
+        items = [(key, val) for key, val in value.items() if not _keep(key)]
+    elif hasattr(value, '__dict__') and not isinstance(value, _opaque_types):
+        if type(value).__name__ in time_valued_features:
+            return counts
+        items = [(key, val) for key, val in vars(value).items() if not _keep(key)]
+    else:
+        return counts
+
+    for key, val in list(items):
+        if isinstance(val, np.ndarray):
+            converted = _convert(val, npix, dtype, counts)
+            if converted is None:
+                continue
+            if hasattr(value, '__dict__') and not isinstance(value, (list, dict)):
+                setattr(value, key, converted)
+            else:
+                value[key] = converted
+        elif isinstance(val, tuple):
+            for item in val:
+                convert_maps(item, npix, dtype=dtype, memo=memo, counts=counts)
+        else:
+            convert_maps(val, npix, dtype=dtype, memo=memo, counts=counts)
+    return counts
+
+
+def convert_conditions(conditions, npix, dtype=np.float32, counts=None):
+    """
+    Convert the float64 maps in conditions_maps to dtype, in place
+
+    None of them hold times, so unlike convert_maps their values aren't checked.
+
+    Returns
+    -------
+    counts : dict
+        Number of arrays converted and their total size before and after (bytes)
+    """
+    if counts is None:
+        counts = {'arrays': 0, 'bytes before': 0, 'bytes after': 0}
+    for name in conditions_maps:
+        value = getattr(conditions, name, None)
+        if isinstance(value, dict):
+            for key in list(value.keys()):
+                converted = _convert(value[key], npix, dtype, counts, check_values=False)
+                if converted is not None:
+                    value[key] = converted
+        else:
+            converted = _convert(value, npix, dtype, counts, check_values=False)
+            if converted is not None:
+                setattr(conditions, name, converted)
+    return counts
+
+
+def _wrap_return_conditions(func, monitor):
+    def return_conditions(observatory, *args, **kwargs):
+        conditions = func(observatory, *args, **kwargs)
+        t0 = time.time()
+        convert_conditions(conditions, monitor.npix, dtype=monitor.dtype)
+        monitor.conditions_seconds += time.time() - t0
+        monitor.conditions_calls += 1
+        return conditions
+    return return_conditions
+
+
+class Map_dtype_monitor(Run_monitor):
+    """
+    Keep the scheduler's maps, and the per-pixel conditions, in a smaller float type
+
+    The number of arrays converted at the start, the memory they took before and after,
+    and the number of conditions converted and the seconds that took go in extra_info as
+    'map dtype'.
+
+    Parameters
+    ----------
+    dtype : str ('float32')
+    """
+    def __init__(self, dtype='float32'):
+        self.dtype = np.dtype(dtype)
+        self.npix = None
+        self.patched = None
+        self.counts = None
+        self.conditions_seconds = 0.
+        self.conditions_calls = 0
+
+    def start(self, observatory, scheduler):
+        self.npix = 12 * scheduler.nside**2
+        self.counts = convert_maps(scheduler, self.npix, dtype=self.dtype)
+        cls = type(observatory)
+        self.patched = (cls, cls.__dict__.get('return_conditions'))
+        cls.return_conditions = _wrap_return_conditions(cls.return_conditions, self)
+        # The scheduler already holds conditions from before the run started
+        if getattr(scheduler, 'conditions', None) is not None:
+            convert_conditions(scheduler.conditions, self.npix, dtype=self.dtype)
+
+    def finish(self, observatory, scheduler, extra_info, filename):
+        if self.patched is not None:
+            cls, original = self.patched
+            if original is None:
+                del cls.return_conditions
+            else:
+                cls.return_conditions = original
+            self.patched = None
+        extra_info['map dtype'] = json.dumps({'dtype': self.dtype.name, 'arrays': self.counts['arrays'],
+                                              'MB before': round(self.counts['bytes before'] / 1024.**2, 2),
+                                              'MB after': round(self.counts['bytes after'] / 1024.**2, 2),
+                                              'conditions converted': self.conditions_calls,
+                                              'conditions seconds': round(self.conditions_seconds, 3)})
+
+
+def _read_positions(filename):
+    conn = sqlite3.connect(filename)
+    rows = conn.execute('SELECT observationStartMJD, fieldRA, fieldDec, filter FROM SummaryAllProps').fetchall()
+    conn.close()
+    return rows
+
+
+def precision_study(driver, driver_args, work_dir, dtype='float32', survey_length=60.):
+    """
+    Run a driver in float64 and in dtype and compare the results
+
+    Returns
+    -------
+    report : dict
+        Differences found by compare_db, visits identical before the first difference,
+        summary metrics of both runs and their fractional changes, and the speed and
+        peak RSS of both runs
+    """
+    results = {}
+    for label, extra in [('float64', []), (dtype, ['--map_dtype', dtype])]:
+        out_dir = os.path.join(work_dir, label)
+        if os.path.isdir(out_dir):
+            shutil.rmtree(out_dir)
+        os.makedirs(out_dir)
+        timing_file = os.path.join(out_dir, 'timing.json')
+        run_driver(driver, driver_args, out_dir,
+                   ['--survey_length', str(survey_length), '--timing_file', timing_file] + extra)
+        with open(timing_file) as f:
+            timing = json.load(f)
+        results[label] = {'filename': glob.glob(os.path.join(out_dir, '*.db'))[0], 'timing': timing}
+
+    file1 = results['float64']['filename']
+    file2 = results[dtype]['filename']
+    rows1 = _read_positions(file1)
+    rows2 = _read_positions(file2)
+    n_same = 0
+    for row1, row2 in zip(rows1, rows2):
+        if row1 != row2:
+            break
+        n_same += 1
+    metrics1 = summary_metrics(file1)
+    metrics2 = summary_metrics(file2)
+    metric_changes = {}
+    for key in sorted(set(metrics1.keys()) & set(metrics2.keys())):
+        if metrics1[key] != 0:
+            metric_changes[key] = (metrics2[key] - metrics1[key]) / abs(metrics1[key])
+    report = {'dtype': dtype, 'survey_length': survey_length,
+              'differences': compare_db(file1, file2),
+              'visits identical before first difference': n_same,
+              'visits': [len(rows1), len(rows2)],
+              'metrics float64': metrics1, 'metrics %s' % dtype: metrics2,
+              'metric fractional changes': metric_changes}
+    for label in results:
+        timing = results[label]['timing']
+        report['%s visits per sec' % label] = timing['n_visits'] / timing['loop_seconds']
+        report['%s peak RSS MB' % label] = timing['peak_rss_mb']
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare a driver run with float64 and float32 maps")
+    parser.add_argument("driver", type=str, help="driver script to run")
+    parser.add_argument("--dtype", type=str, default='float32')
+    parser.add_argument("--survey_length", type=float, default=60.)
+    parser.add_argument("--tolerance", type=float, default=0.01,
+                        help="largest fractional change in a summary metric to accept")
+    parser.add_argument("--work_dir", type=str, default=None)
+    args, driver_args = parser.parse_known_args()
+
+    work_dir = args.work_dir
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='precision_')
+    report = precision_study(args.driver, driver_args, work_dir, dtype=args.dtype,
+                             survey_length=args.survey_length)
+    out_file = os.path.join(work_dir, 'precision_report.json')
+    with open(out_file, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    if len(report['differences']) == 0:
+        print('Observations identical (%i visits)' % report['visits'][0])
+    else:
+        print('First %i visits identical, then %s' % (report['visits identical before first difference'],
+                                                      report['differences'][0]))
+    worst = 0.
+    for key, change in sorted(report['metric fractional changes'].items()):
+        print('%-32s %+8.3f%%' % (key, change*100))
+        worst = max(worst, abs(change))
+    for label in ['float64', args.dtype]:
+        print('%-8s %8.2f visits/sec, peak RSS %.0f MB' % (label, report['%s visits per sec' % label],
+                                                           report['%s peak RSS MB' % label]))
+    print('Wrote %s' % out_file)
+    if worst > args.tolerance:
+        print('Largest metric change %.3f%% is beyond the %.3f%% tolerance' % (worst*100, args.tolerance*100))
+        raise SystemExit(1)
@@ -0,0 +1,120 @@
+"""
+Compare a reduced-fidelity preview run with a full run of the same driver.
+
+Example, after running the baseline both ways:
+
+    python baseline.py --nexp 2
+    python baseline.py --nexp 2 --preview
+    python -m sim_tools.preview baseline_nexp2_v1.7_10yrs.db baseline_nexp2_v1.7_1yrs_preview.db
+
+The full run is cut down to the nights the preview covers, the same summary metrics are
+computed from both files, and each metric is reported with the preview/full ratio. The
+report is also written as json next to the preview file.
+"""
+import os
+import json
+import sqlite3
+import argparse
+import numpy as np
+
+
+__all__ = ['summary_metrics', 'calibration_report']
+
+filters = ['u', 'g', 'r', 'i', 'z', 'y']
+
+
+def _read(filename, mjd_max=None):
+    conn = sqlite3.connect(filename)
+    query = ('SELECT observationStartMJD, night, filter, airmass, slewTime, fiveSigmaDepth, '
+             'seeingFwhmEff, visitExposureTime, note FROM SummaryAllProps')
+    if mjd_max is not None:
+        query += ' WHERE observationStartMJD <= %f' % mjd_max
+    rows = conn.execute(query).fetchall()
+    conn.close()
+    names = ['mjd', 'night', 'filter', 'airmass', 'slewtime', 'm5', 'seeing', 'exptime', 'note']
+    return dict([(name, np.array([row[i] for row in rows])) for i, name in enumerate(names)])
+
+
+def summary_metrics(filename, mjd_max=None):
+    """
+    Summary metrics of one output file, normalized so runs of different lengths compare
+
+    Parameters
+    ----------
+    filename : str
+        Output .db file
+    mjd_max : float (None)
+        Only use observations up to this mjd
+
+    Returns
+    -------
+    metrics : dict
+        Metric name and value
+    """
+    data = _read(filename, mjd_max=mjd_max)
+    n_obs = data['mjd'].size
+    metrics = {'n visits': n_obs}
+    if n_obs == 0:
+        return metrics
+    span_nights = data['night'].max() - data['night'].min() + 1
+    metrics['nights'] = int(span_nights)
+    metrics['visits per night'] = n_obs / float(span_nights)
+    metrics['fraction of nights observed'] = np.unique(data['night']).size / float(span_nights)
+    metrics['median airmass'] = np.median(data['airmass'])
+    metrics['median slewtime (s)'] = np.median(data['slewtime'])
+    metrics['mean slewtime (s)'] = np.mean(data['slewtime'])
+    metrics['median seeingFwhmEff'] = np.median(data['seeing'])
+    metrics['exposure hours per night'] = np.sum(data['exptime']) / 3600. / span_nights
+    for filtername in filters:
+        in_filt = np.where(data['filter'] == filtername)[0]
+        metrics['fraction in %s' % filtername] = in_filt.size / float(n_obs)
+        if in_filt.size > 0:
+            metrics['median m5 %s' % filtername] = np.median(data['m5'][in_filt])
+    notes = np.array([str(note).split(',')[0] for note in data['note']])
+    for note in np.unique(notes):
+        metrics['fraction note %s' % note] = np.sum(notes == note) / float(n_obs)
+    return dict([(key, float(val)) for key, val in metrics.items()])
+
+
+def _format(val):
+    return '%12s' % ('-' if val is None else '%.4g' % val)
+
+
+def calibration_report(full_file, preview_file):
+    """
+    Compare preview metrics with the full run over the same nights
+
+    Returns
+    -------
+    report : list of [metric, full value, preview value, preview/full]
+    """
+    conn = sqlite3.connect(preview_file)
+    mjd_max = conn.execute('SELECT MAX(observationStartMJD) FROM SummaryAllProps').fetchone()[0]
+    conn.close()
+    full = summary_metrics(full_file, mjd_max=mjd_max)
+    preview = summary_metrics(preview_file)
+    report = []
+    for key in sorted(set(full.keys()) | set(preview.keys())):
+        full_val = full.get(key)
+        preview_val = preview.get(key)
+        ratio = None
+        if full_val not in (None, 0) and preview_val is not None:
+            ratio = preview_val / full_val
+        report.append([key, full_val, preview_val, ratio])
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare a preview run with a full run")
+    parser.add_argument("full_file", type=str, help="output .db from the full-fidelity run")
+    parser.add_argument("preview_file", type=str, help="output .db from the --preview run")
+    args = parser.parse_args()
+
+    report = calibration_report(args.full_file, args.preview_file)
+    print('%-32s %12s %12s %12s' % ('metric', 'full', 'preview', 'ratio'))
+    for key, full_val, preview_val, ratio in report:
+        print('%-32s %s %s %s' % (key, _format(full_val), _format(preview_val), _format(ratio)))
+    out_file = os.path.splitext(args.preview_file)[0] + '_calibration.json'
+    with open(out_file, 'w') as f:
+        json.dump({'full': args.full_file, 'preview': args.preview_file, 'metrics': report}, f, indent=1)
+    print('Wrote %s' % out_file)
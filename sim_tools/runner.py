@@ -0,0 +1,428 @@
+import os
+import sys
+import time
+import warnings
+import numpy as np
+from .checkpoint import write_snapshot, save_checkpoint, load_checkpoint, latest_checkpoint
+from .db_writer import Streaming_writer
+from .bf_profile import Bf_profiler
+from .conditions_cache import Conditions_cache_monitor
+from .interning import intern_basis_functions
+from .sky_prefetch import Sky_prefetch_monitor
+from .monitors import Timing_monitor, Heartbeat_monitor
+from .memory import Memory_monitor
+from .sampling_profile import profile_from_env
+from .guardrails import Run_aborted, Guardrail_monitor
+from .parallel_rewards import Parallel_reward_monitor
+from .stacked_rewards import Stacked_reward_monitor
+from .incremental_bfs import Incremental_bf_monitor
+from .feasibility import Feasibility_order_monitor
+from .tiers import Tier_monitor
+
+try:
+    from lsst.sims.featureScheduler import sim_runner as fs_sim_runner
+    from lsst.sims.featureScheduler.schedulers import simple_filter_sched
+    from lsst.sims.featureScheduler.utils import schema_converter, run_info_table
+except ImportError:
+    from rubin_sim.scheduler import sim_runner as fs_sim_runner
+    from rubin_sim.scheduler.schedulers import simple_filter_sched
+    from rubin_sim.scheduler.utils import schema_converter, run_info_table
+
+
+__all__ = ['sim_runner']
+
+# Everything needed to pick the observe loop back up from a snapshot
+_state_keys = ['observatory', 'scheduler', 'filter_scheduler', 'observations',
+               'mjd_start', 'end_mjd', 'nskip', 'night', 'mjd_last_flush', 'n_written']
+
+
+def _loop_state(loop_locals):
+    return dict([(key, loop_locals[key]) for key in _state_keys])
+
+
+def sim_runner(observatory, scheduler, filter_scheduler=None, mjd_start=None, survey_length=3.,
+               filename=None, delete_past=True, n_visit_limit=None, step_none=15.,
+               verbose=True, extra_info=None, checkpoint_nights=0, checkpoint_dir=None,
+               resume=False, checkpoint_stop=None, snapshot=None, on_restore=None,
+               stop_mjd=None, stop_snapshot=None, stream=False, monitors=None,
+               profile_bfs=False, profile_bfs_memory=False, cache_conditions=False,
+               intern_bfs=False, preview=False, timing_file=None, ephemeris_file=None,
+               prefetch_sky=False, map_dtype=None, heartbeat_minutes=0,
+               track_memory=False, trace=False, min_visits_per_night=0, min_visits_window=7,
+               max_night_seconds=0, max_empty_nights=0, reward_threads=0, stack_rewards=False,
+               incremental_bfs=False, incremental_check_every=100, gates_first=False,
+               tier_stats=False):
+    """
+    Run a simulation, optionally saving snapshots so it can be resumed
+
+    A drop-in replacement for lsst.sims.featureScheduler.sim_runner. If none of the extra
+    options are used, the call is passed straight through to the featureScheduler version.
+    Otherwise the same observe loop is run here, with hooks at the night boundaries.
+    Setting the environment variable SIM_TOOLS_PROFILE=1 runs a sampling profiler over the
+    loop and writes a flame graph next to filename (see sim_tools.sampling_profile).
+
+    Parameters
+    ----------
+    survey_length : float (3.)
+        The length of the survey to run (days)
+    step_none : float (15)
+        The amount of time to advance if the scheduler fails to return a target (minutes).
+    extra_info : dict (None)
+        If present, dict gets added onto the information from the observatory model.
+    checkpoint_nights : int (0)
+        Snapshot the observatory, scheduler and observations every checkpoint_nights
+        nights. Zero turns checkpointing off.
+    checkpoint_dir : str (None)
+        Where to write snapshots. Defaults to filename with '_checkpoints' in place of '.db'.
+    resume : bool (False)
+        Continue from the latest snapshot in checkpoint_dir. If there is no snapshot yet,
+        the simulation starts from the beginning, so the same command can be resubmitted.
+    checkpoint_stop : int (None)
+        Stop, without writing the output file, right after the snapshot at this night. Behaves
+        like a job killed by the queue, for checking that resumed runs match.
+    snapshot : str (None)
+        Start from this snapshot file rather than from observatory and scheduler. A
+        checkpoint found with resume takes precedence.
+    on_restore : callable (None)
+        Called with the state dict after loading snapshot, before the loop starts. Used
+        to change the restored scheduler, e.g., to branch one run into several variants.
+    stop_mjd : float (None)
+        Stop the loop once the observatory reaches this mjd and write a snapshot to
+        stop_snapshot instead of the output file. The snapshot keeps the full survey_length,
+        so a run started from it finishes the same survey.
+    stop_snapshot : str (None)
+        The file to write when stopping at stop_mjd.
+    stream : bool (False)
+        Write each night's observations to filename as the run goes, rather than holding
+        them all in memory until the end. The returned observations are then None.
+    monitors : list of Run_monitor (None)
+        Objects to call at the start, on each observation, each night and at the end.
+    profile_bfs : bool (False)
+        Time every basis function and survey reward calculation. A summary goes in
+        extra_info and the full report to <filename>_bf_profile.json.
+    profile_bfs_memory : bool (False)
+        Also record peak memory allocated in each basis function call (slow).
+    cache_conditions : bool (False)
+        Compute the condition-only basis function maps (masks, depth, slew time) once per
+        set of conditions and share them between surveys. Hit and miss counts go in extra_info.
+    intern_bfs : bool (False)
+        Replace identical basis functions in different surveys with one shared object. A
+        resumed run needs the same setting as the run that wrote the snapshot.
+    preview : bool (False)
+        Low-fidelity run for triaging sweeps. step_none is doubled and '_preview' is added
+        to the output filename. The driver is expected to have lowered nside and
+        survey_length already (see driver.preview_settings). Those are what make a preview
+        fast; the visits themselves are simulated at full cadence, and the doubled
+        step_none only coarsens the wait when there is nothing to observe.
+    timing_file : str (None)
+        Write the loop wall time, visit and night counts and peak RSS to this json file.
+    ephemeris_file : str (None)
+        Read the sun and moon positions from this file (see sim_tools.ephemeris) rather than
+        the observatory's almanac interpolators.
+    prefetch_sky : bool (False)
+        Read the next block of sky brightness on a background thread while the current
+        one is in use. Counts of blocks loaded in time and stalls go in extra_info.
+    map_dtype : str (None)
+        Convert the scheduler's HEALpix maps and the per-pixel conditions to this type
+        (e.g., 'float32') to save memory. The schedule can differ slightly from a float64
+        run; see sim_tools.precision.
+    heartbeat_minutes : float (0)
+        Write progress (night, visits, speed, projected finish, RSS) to
+        <filename>_heartbeat.json this often. Zero turns heartbeats off.
+    track_memory : bool (False)
+        Write the RSS and the sizes of the scheduler and observatory attributes to
+        <filename>_memory.csv once a simulated month.
+    trace : bool (False)
+        Record every scheduler decision (winning survey, reward, pointing) to
+        <filename>_trace.gz, for comparing runs with python -m sim_tools.trace.
+    min_visits_per_night : float (0)
+        Stop the run if the mean visits per night over min_visits_window nights falls
+        below this. The reason goes in <filename>_aborted.json and the process exits
+        with an error. 0 turns the check off.
+    min_visits_window : int (7)
+        Nights to average over for min_visits_per_night
+    max_night_seconds : float (0)
+        Stop the run if one simulated night takes more wall seconds than this
+    max_empty_nights : float (0)
+        Stop the run if there are no visits for more than this many nights
+    reward_threads : int (0)
+        Evaluate the survey rewards of each tier on a pool of this many threads. The
+        rewards are the same as serial evaluation. 0 evaluates them serially as usual.
+    stack_rewards : bool (False)
+        Evaluate each distinct basis function of a tier's Greedy and Blob surveys once
+        and sum all their rewards together as one stack (see sim_tools.stacked_rewards).
+        The rewards are the same as the surveys' own sums.
+    incremental_bfs : bool (False)
+        Keep the maps of the history-dependent basis functions in
+        sim_tools.incremental_bfs up to date as observations come in, rather than
+        rebuilding them at every reward call.
+    incremental_check_every : int (100)
+        Check the incremental maps against the basis functions' own calculation on the
+        first call after each one has taken in an observation, and every this many calls.
+        A class that ever differs is recomputed for the rest of the run.
+    gates_first : bool (False)
+        Check each survey's scalar feasibility gates (twilight, filter loaded, ...)
+        before the rest of its feasibility check, and count evaluated and skipped steps
+        for each survey in the info table.
+    tier_stats : bool (False)
+        Count the survey evaluations made and avoided by the scheduler's tiers each time
+        it fills its queue, and put them in the info table.
+    """
+    if preview:
+        step_none = step_none * 2
+        if filename is not None:
+            filename = os.path.splitext(filename)[0] + '_preview.db'
+
+    if checkpoint_dir is None and filename is not None:
+        checkpoint_dir = os.path.splitext(filename)[0] + '_checkpoints'
+    if (checkpoint_nights > 0 or resume) and checkpoint_dir is None:
+        raise ValueError('Need a filename or checkpoint_dir to save or resume checkpoints')
+
+    guardrails = min_visits_per_night > 0 or max_night_seconds > 0 or max_empty_nights > 0
+    if (heartbeat_minutes > 0 or track_memory or trace or guardrails) and filename is None:
+        raise ValueError('Need a filename to put the heartbeat, memory, trace and abort files next to')
+
+    if reward_threads > 0 and (cache_conditions or profile_bfs or profile_bfs_memory):
+        raise ValueError('reward_threads can not be combined with cache_conditions or profile_bfs')
+    if stack_rewards and (reward_threads > 0 or profile_bfs or profile_bfs_memory):
+        raise ValueError('stack_rewards can not be combined with reward_threads or profile_bfs')
+    if incremental_bfs and reward_threads > 0:
+        raise ValueError('incremental_bfs can not be combined with reward_threads')
+
+    if stop_mjd is not None and stop_snapshot is None:
+        raise ValueError('Need a stop_snapshot file to write when stopping at stop_mjd')
+
+    if monitors is None:
+        monitors = []
+    else:
+        monitors = list(monitors)
+    if cache_conditions:
+        monitors.append(Conditions_cache_monitor())
+    if profile_bfs or profile_bfs_memory:
+        monitors.append(Bf_profiler(trace_memory=profile_bfs_memory))
+    if reward_threads > 0:
+        monitors.append(Parallel_reward_monitor(n_threads=reward_threads))
+    if stack_rewards:
+        monitors.append(Stacked_reward_monitor())
+    if incremental_bfs:
+        monitors.append(Incremental_bf_monitor(check_every=incremental_check_every))
+    if gates_first:
+        monitors.append(Feasibility_order_monitor())
+    if tier_stats:
+        monitors.append(Tier_monitor())
+    if prefetch_sky:
+        monitors.append(Sky_prefetch_monitor())
+    if map_dtype is not None:
+        # Imported here since sim_tools.precision is also run with python -m
+        from .precision import Map_dtype_monitor
+        monitors.append(Map_dtype_monitor(dtype=map_dtype))
+    if trace:
+        # Imported here since sim_tools.trace is also run with python -m
+        from .trace import Trace_recorder
+        monitors.append(Trace_recorder(os.path.splitext(filename)[0] + '_trace.gz'))
+    if guardrails:
+        monitors.append(Guardrail_monitor(os.path.splitext(filename)[0] + '_aborted.json',
+                                          min_visits_per_night=min_visits_per_night,
+                                          min_visits_window=min_visits_window,
+                                          max_night_seconds=max_night_seconds,
+                                          max_empty_nights=max_empty_nights))
+    if timing_file is not None:
+        monitors.append(Timing_monitor(timing_file))
+    profiler = profile_from_env(filename)
+    if profiler is not None:
+        monitors.append(profiler)
+
+    if extra_info is None:
+        extra_info = {}
+
+    if preview:
+        extra_info['preview'] = 'nside %s, step_none %.0f min, %.1f days' % (getattr(scheduler, 'nside', None),
+                                                                             step_none, survey_length)
+
+    t0 = time.time()
+
+    restored = None
+    if resume:
+        last = latest_checkpoint(checkpoint_dir)
+        if last is not None:
+            print('Resuming from ', last)
+            restored = load_checkpoint(last)
+            extra_info['resumed from'] = last
+    if restored is None and snapshot is not None:
+        print('Starting from snapshot ', snapshot)
+        restored = load_checkpoint(snapshot)
+        extra_info['started from snapshot'] = snapshot
+        if on_restore is not None:
+            on_restore(restored)
+
+    if ephemeris_file is not None:
+        # Imported here since sim_tools.ephemeris is also run with python -m
+        from .ephemeris import use_ephemeris
+        extra_info['ephemeris file'] = ephemeris_file
+
+    # A restored run gets its observatory and scheduler from the snapshot, set up below
+    if restored is None:
+        if ephemeris_file is not None:
+            use_ephemeris(observatory, ephemeris_file)
+        if intern_bfs:
+            registry = intern_basis_functions(scheduler)
+            extra_info['interned basis functions'] = '%i of %i' % (len(registry.instances),
+                                                                   registry.requested)
+
+    if (checkpoint_nights == 0 and not resume and snapshot is None and stop_mjd is None and not stream
+            and len(monitors) == 0 and heartbeat_minutes == 0):
+        return fs_sim_runner(observatory, scheduler, filter_scheduler=filter_scheduler,
+                             mjd_start=mjd_start, survey_length=survey_length, filename=filename,
+                             delete_past=delete_past, n_visit_limit=n_visit_limit,
+                             step_none=step_none, verbose=verbose, extra_info=extra_info)
+
+    if filter_scheduler is None:
+        filter_scheduler = simple_filter_sched()
+
+    if restored is None:
+        if mjd_start is None:
+            mjd_start = observatory.mjd + 0
+        else:
+            observatory.mjd = mjd_start
+            observatory.ra = None
+            observatory.dec = None
+            observatory.status = None
+            observatory.filtername = None
+        end_mjd = mjd_start + survey_length
+        observations = []
+        nskip = 0
+        night = 0
+        mjd_last_flush = -1
+        n_written = 0
+    else:
+        observatory = restored['observatory']
+        scheduler = restored['scheduler']
+        filter_scheduler = restored['filter_scheduler']
+        observations = restored['observations']
+        mjd_start = restored['mjd_start']
+        end_mjd = restored['end_mjd']
+        nskip = restored['nskip']
+        night = restored['night']
+        mjd_last_flush = restored['mjd_last_flush']
+        n_written = restored['n_written']
+        if ephemeris_file is not None:
+            use_ephemeris(observatory, ephemeris_file)
+        if intern_bfs:
+            registry = intern_basis_functions(scheduler)
+            extra_info['interned basis functions'] = '%i of %i' % (len(registry.instances),
+                                                                   registry.requested)
+
+    if heartbeat_minutes > 0:
+        monitors.append(Heartbeat_monitor(os.path.splitext(filename)[0] + '_heartbeat.json', end_mjd,
+                                          interval=heartbeat_minutes*60., night=night))
+    if track_memory:
+        monitors.append(Memory_monitor(os.path.splitext(filename)[0] + '_memory.csv', night=night,
+                                       n_visits=len(observations) + n_written))
+
+    writer = None
+    if stream and filename is not None:
+        writer = Streaming_writer(filename, delete_past=delete_past, n_written=n_written)
+    elif n_written > 0:
+        raise ValueError('Snapshot was taken from a streaming run, need stream=True to continue it')
+
+    # Monitors are finished in reverse, so ones that wrap the same method unwrap it in turn
+    for monitor in monitors:
+        monitor.start(observatory, scheduler)
+
+    mjd = observatory.mjd + 0
+    mjd_track = mjd + 0
+    step = 1./24.
+    step_none = step_none/60./24.  # to days
+    mjd_run = end_mjd-mjd_start
+    new_night = False
+
+    try:
+        while mjd < end_mjd:
+            if stop_mjd is not None and mjd >= stop_mjd:
+                write_snapshot(stop_snapshot, _loop_state(locals()))
+                print('Stopped at mjd %f, wrote snapshot %s' % (mjd, stop_snapshot))
+                for monitor in monitors[::-1]:
+                    monitor.finish(observatory, scheduler, extra_info, None)
+                return observatory, scheduler, None
+            if not scheduler._check_queue_mjd_only(observatory.mjd):
+                scheduler.update_conditions(observatory.return_conditions())
+            desired_obs = scheduler.request_observation(mjd=observatory.mjd)
+            if desired_obs is None:
+                # No observation. Just step into the future and try again.
+                warnings.warn('No observation. Step into the future and trying again.')
+                observatory.mjd = observatory.mjd + step_none
+                scheduler.update_conditions(observatory.return_conditions())
+                nskip += 1
+                for monitor in monitors:
+                    monitor.no_observation(observatory, scheduler)
+                continue
+            completed_obs, new_night = observatory.observe(desired_obs)
+
+            if completed_obs is not None:
+                scheduler.add_observation(completed_obs[0])
+                observations.append(completed_obs)
+                filter_scheduler.add_observation(completed_obs[0])
+                for monitor in monitors:
+                    monitor.observation(completed_obs[0])
+            else:
+                # An observation failed to execute, usually it was outside the altitude limits.
+                if observatory.mjd == mjd_last_flush:
+                    raise RuntimeError("Scheduler has failed to provide a valid observation multiple times.")
+                # if this is a first offence, might just be that targets set. Flush queue and get some new targets.
+                scheduler.flush_queue()
+                mjd_last_flush = observatory.mjd + 0
+            if new_night:
+                # find out what filters we want mounted
+                conditions = observatory.return_conditions()
+                filters_needed = filter_scheduler(conditions)
+                observatory.observatory.mount_filters(filters_needed)
+                night += 1
+                if writer is not None:
+                    writer.append(observations)
+                    n_written = writer.n_written
+                    observations = []
+                for monitor in monitors:
+                    monitor.night(night, observatory, scheduler)
+                if checkpoint_nights > 0 and night % checkpoint_nights == 0:
+                    save_checkpoint(checkpoint_dir, night, _loop_state(locals()))
+                    if checkpoint_stop is not None and night >= checkpoint_stop:
+                        print('Stopping after checkpoint at night %i' % night)
+                        for monitor in monitors[::-1]:
+                            monitor.finish(observatory, scheduler, extra_info, None)
+                        return observatory, scheduler, None
+
+            mjd = observatory.mjd + 0
+            if verbose:
+                if (mjd-mjd_track) > step:
+                    progress = float(mjd-mjd_start)/mjd_run*100
+                    text = "\rprogress = %.2f%%" % progress
+                    sys.stdout.write(text)
+                    sys.stdout.flush()
+                    mjd_track = mjd+0
+            if n_visit_limit is not None:
+                if len(observations) + n_written == n_visit_limit:
+                    break
+    except Run_aborted as err:
+        for monitor in monitors[::-1]:
+            monitor.finish(observatory, scheduler, extra_info, None)
+        raise SystemExit('Run stopped: %s' % err)
+
+    for monitor in monitors[::-1]:
+        monitor.finish(observatory, scheduler, extra_info, filename)
+
+    runtime = time.time() - t0
+    print('Skipped %i observations' % nskip)
+    print('Flushed %i observations from queue for being stale' % scheduler.flushed)
+    print('Completed %i observations' % (len(observations) + n_written))
+    print('ran in %i min = %.1f hours' % (runtime/60., runtime/3600.))
+    print('Writing results to ', filename)
+    if writer is not None:
+        writer.append(observations)
+        writer.close(info=run_info_table(observatory, extra_info=extra_info))
+        return observatory, scheduler, None
+    observations = np.array(observations)[:, 0]
+    if filename is not None:
+        info = run_info_table(observatory, extra_info=extra_info)
+        converter = schema_converter()
+        converter.obs2opsim(observations, filename=filename, info=info, delete_past=delete_past)
+    return observatory, scheduler, observations
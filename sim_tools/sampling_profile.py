@@ -0,0 +1,165 @@
+"""
+Sampling profiler for whole runs, switched on with an environment variable.
+
+    SIM_TOOLS_PROFILE=1 python baseline.py --nexp 2
+
+samples the stack of the simulating thread every 5 ms (SIM_TOOLS_PROFILE_INTERVAL, in
+seconds) from a background thread for the length of the observe loop, then writes
+<output>_profile.collapsed, one line per distinct stack ('outer;inner;leaf count', the
+format flamegraph.pl and speedscope read), and <output>_profile.svg, a flame graph of it.
+The drivers don't need changing since sim_runner checks the variable itself.
+"""
+import os
+import sys
+import zlib
+import threading
+from .monitors import Run_monitor
+
+
+__all__ = ['Sampling_profiler', 'profile_from_env', 'write_collapsed', 'write_flamegraph']
+
+_env_var = 'SIM_TOOLS_PROFILE'
+_interval_var = 'SIM_TOOLS_PROFILE_INTERVAL'
+
+
+def _label(frame):
+    code = frame.f_code
+    return '%s (%s)' % (code.co_name, os.path.basename(code.co_filename))
+
+
+class Sampling_profiler(Run_monitor):
+    """
+    Sample the simulating thread's stack at a fixed interval
+
+    Parameters
+    ----------
+    filename : str
+        Output .db the profile goes next to, as <filename>_profile.collapsed and .svg
+    interval : float (0.005)
+        Seconds between samples
+    """
+    def __init__(self, filename, interval=0.005):
+        self.basename = os.path.splitext(filename)[0] + '_profile'
+        self.interval = interval
+        self.counts = {}
+        self.n_samples = 0
+        self.thread = None
+        self.stop_event = None
+        self.target = None
+
+    def _sample(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                stack.append(_label(frame))
+                frame = frame.f_back
+            key = ';'.join(stack[::-1])
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.n_samples += 1
+
+    def start(self, observatory, scheduler):
+        self.target = threading.get_ident()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._sample, name='sampling profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+    def finish(self, observatory, scheduler, extra_info, filename):
+        self.stop()
+        write_collapsed(self.counts, self.basename + '.collapsed')
+        write_flamegraph(self.counts, self.basename + '.svg',
+                         title='%s, %i samples every %g ms' % (os.path.basename(self.basename),
+                                                              self.n_samples, self.interval*1000))
+        extra_info['sampling profile'] = self.basename + '.collapsed'
+
+
+def profile_from_env(filename):
+    """
+    A Sampling_profiler for filename if SIM_TOOLS_PROFILE is set (and not 0), else None
+    """
+    if os.environ.get(_env_var, '0') in ('', '0') or filename is None:
+        return None
+    return Sampling_profiler(filename, interval=float(os.environ.get(_interval_var, 0.005)))
+
+
+def write_collapsed(counts, filename):
+    with open(filename, 'w') as f:
+        for stack in sorted(counts.keys()):
+            f.write('%s %i\n' % (stack, counts[stack]))
+
+
+def _escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+
+def write_flamegraph(counts, filename, title='', width=1200, frame_height=16, min_width=0.5):
+    """
+    Draw collapsed stacks as an SVG flame graph
+
+    Parameters
+    ----------
+    counts : dict
+        Collapsed stack string and number of samples
+    filename : str
+        SVG file to write
+    width : int (1200)
+        Image width (pixels)
+    min_width : float (0.5)
+        Frames narrower than this (pixels) are left out
+    """
+    # Merge the stacks into a tree of [samples, children]
+    root = [0, {}]
+    for stack, count in counts.items():
+        node = root
+        node[0] += count
+        for name in stack.split(';'):
+            node = node[1].setdefault(name, [0, {}])
+            node[0] += count
+    total = max(root[0], 1)
+    scale = (width - 20.) / total
+
+    boxes = []
+    depth_max = 0
+    todo = [(name, node, 10., 0) for name, node in sorted(root[1].items())]
+    while len(todo) > 0:
+        name, node, x, depth = todo.pop()
+        box_width = node[0] * scale
+        if box_width < min_width:
+            continue
+        boxes.append((name, node[0], x, depth, box_width))
+        depth_max = max(depth_max, depth)
+        child_x = x
+        for child_name, child in sorted(node[1].items()):
+            todo.append((child_name, child, child_x, depth + 1))
+            child_x += child[0] * scale
+
+    height = (depth_max + 1) * frame_height + 50
+    lines = ['<?xml version="1.0" standalone="no"?>',
+             '<svg version="1.1" width="%i" height="%i" xmlns="http://www.w3.org/2000/svg">' % (width, height),
+             '<rect x="0" y="0" width="%i" height="%i" fill="#f8f8f8"/>' % (width, height),
+             '<text x="%i" y="24" font-size="15" font-family="Verdana" text-anchor="middle">%s</text>' %
+             (width // 2, _escape(title))]
+    for name, samples, x, depth, box_width in boxes:
+        y = height - (depth + 1) * frame_height - 10
+        # Stable warm colour per function name
+        hue = zlib.crc32(name.encode()) % 1000 / 1000.
+        colour = 'rgb(%i,%i,%i)' % (205 + 50*hue, 80 + 150*(1 - hue), 50*hue)
+        lines.append('<g><title>%s (%i samples, %.2f%%)</title>' % (_escape(name), samples, 100.*samples/total))
+        lines.append('<rect x="%.1f" y="%i" width="%.1f" height="%i" fill="%s" rx="2" ry="2"/>' %
+                     (x, y, box_width, frame_height - 1, colour))
+        # Roughly 7 pixels per character at this font size
+        n_chars = int((box_width - 6) / 7)
+        if n_chars >= 3:
+            text = name if len(name) <= n_chars else name[:n_chars - 2] + '..'
+            lines.append('<text x="%.1f" y="%i" font-size="12" font-family="Verdana">%s</text>' %
+                         (x + 3, y + frame_height - 4, _escape(text)))
+        lines.append('</g>')
+    lines.append('</svg>')
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
@@ -0,0 +1,40 @@
+"""
+Process-wide observatory shared by the driver scripts.
+
+Drivers ask for their observatory with get_observatory rather than constructing
+Model_observatory directly. Normally that just builds a new one. When a sweep executor
+has built an observatory before forking its workers, the workers get that object back
+instead, so the sky brightness, almanac and weather arrays loaded by the parent are shared
+copy-on-write between all the runs rather than loaded again by each one.
+"""
+try:
+    from lsst.sims.featureScheduler.modelObservatory import Model_observatory
+except ImportError:
+    from rubin_sim.scheduler.modelObservatory import Model_observatory
+
+
+__all__ = ['register_observatory', 'get_observatory']
+
+_registered = {}
+
+
+def register_observatory(observatory, nside):
+    """
+    Make observatory the one returned by get_observatory(nside=nside) in this process
+
+    Should be called before forking workers. Each forked worker then has its own
+    (copy-on-write) version of the object to run a simulation with.
+    """
+    _registered[nside] = observatory
+
+
+def get_observatory(nside=None, **kwargs):
+    """
+    Return the registered observatory for nside, or build a new Model_observatory
+
+    Any kwargs other than nside mean the caller wants a non-default observatory, so a new
+    one is always built in that case.
+    """
+    if len(kwargs) == 0 and nside in _registered:
+        return _registered[nside]
+    return Model_observatory(nside=nside, **kwargs)
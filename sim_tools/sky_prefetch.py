@@ -0,0 +1,173 @@
+"""
+Load the next block of pre-computed sky brightness in the background.
+
+SkyModelPre holds one file (a block of nights) of sky brightness at a time. When the
+simulation moves past the end of the loaded block, returnMags stops and reads the next
+file, which on a busy shared filesystem can take a while. Prefetching_sky_model wraps the
+observatory's sky model: as soon as a block is in use it starts reading the following one
+on a background thread into a separate copy of the model, so by the time the simulation
+gets there the data is usually already in memory. Loaded blocks are kept in a small cache
+(by default the current block and the one after it), and the time the simulation spent
+waiting for data is counted.
+"""
+import copy
+import json
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .monitors import Run_monitor
+
+
+__all__ = ['Prefetching_sky_model', 'Sky_prefetch_monitor']
+
+
+class Prefetching_sky_model(object):
+    """
+    Stand-in for a SkyModelPre that reads the next block ahead of time
+
+    Parameters
+    ----------
+    sky_model : SkyModelPre
+        The sky model to wrap, with a block already loaded
+    max_blocks : int (2)
+        Most blocks to hold in memory at once, counting the one in use and the one being
+        read. Needs to be at least 2 for prefetching to happen.
+    """
+    def __init__(self, sky_model, max_blocks=2):
+        self.current = sky_model
+        self.max_blocks = max_blocks
+        self.counts = {'blocks used': 0, 'prefetched': 0, 'stalls': 0, 'stall seconds': 0.,
+                       'background loads': 0, 'background seconds': 0.}
+        self._start()
+
+    def _start(self):
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        block = self._block(np.mean(self.current.loaded_range))
+        if block is not None:
+            self.cache[block] = self.current
+            self._prefetch(block + 1)
+
+    def __getstate__(self):
+        # Threads and futures can't be pickled, so snapshots just keep the block in use
+        state = self.__dict__.copy()
+        for key in ['cache', 'pending', 'lock', 'executor']:
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._start()
+
+    def __getattr__(self, name):
+        if name == 'current':
+            raise AttributeError(name)
+        return getattr(self.current, name)
+
+    def _block(self, mjd):
+        indx = np.where((mjd >= self.current.mjd_left) & (mjd <= self.current.mjd_right))[0]
+        if indx.size == 0:
+            return None
+        return indx.min()
+
+    def _load(self, block, template):
+        # A shallow copy shares the file list with the model in use. _load_data replaces
+        # the arrays rather than writing into them, so the model in use is not touched.
+        model = copy.copy(template)
+        model._load_data((template.mjd_left[block] + template.mjd_right[block]) / 2.)
+        return model
+
+    def _background_load(self, block, template):
+        t0 = time.time()
+        model = self._load(block, template)
+        with self.lock:
+            self.counts['background loads'] += 1
+            self.counts['background seconds'] += time.time() - t0
+        return model
+
+    def _prefetch(self, block):
+        if (self.max_blocks < 2 or block >= np.size(self.current.mjd_left) or block in self.cache
+                or block in self.pending):
+            return
+        # Make room, keeping the block in use
+        while len(self.cache) + len(self.pending) >= self.max_blocks and len(self.cache) > 1:
+            for key in self.cache:
+                if self.cache[key] is not self.current:
+                    del self.cache[key]
+                    break
+        if len(self.cache) + len(self.pending) < self.max_blocks:
+            self.pending[block] = self.executor.submit(self._background_load, block, self.current)
+
+    def _switch(self, mjd):
+        block = self._block(mjd)
+        if block is None:
+            # Let the sky model raise its usual error
+            self.current._load_data(mjd)
+            return
+        t0 = time.time()
+        if block in self.cache:
+            self.cache.move_to_end(block)
+            self.counts['prefetched'] += 1
+        elif block in self.pending:
+            future = self.pending.pop(block)
+            if future.done():
+                self.counts['prefetched'] += 1
+            else:
+                self.counts['stalls'] += 1
+            self.cache[block] = future.result()
+        else:
+            self.counts['stalls'] += 1
+            self.cache[block] = self._load(block, self.current)
+        self.counts['stall seconds'] += time.time() - t0
+        self.counts['blocks used'] += 1
+        self.current = self.cache[block]
+        self._prefetch(block + 1)
+
+    def returnMags(self, mjd, *args, **kwargs):
+        loaded_range = self.current.loaded_range
+        if np.size(loaded_range) < 2 or mjd < np.min(loaded_range) or mjd > np.max(loaded_range):
+            self._switch(mjd)
+        return self.current.returnMags(mjd, *args, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.pending = {}
+
+
+class Sky_prefetch_monitor(Run_monitor):
+    """
+    Swap the observatory's sky model for a Prefetching_sky_model for the length of a run
+
+    The counts (blocks used, how many were ready in time, stalls and the seconds spent
+    waiting) go in extra_info as 'sky prefetch'.
+
+    Parameters
+    ----------
+    max_blocks : int (2)
+        Passed to Prefetching_sky_model
+    """
+    def __init__(self, max_blocks=2):
+        self.max_blocks = max_blocks
+
+    def start(self, observatory, scheduler):
+        if not isinstance(observatory.sky_model, Prefetching_sky_model):
+            observatory.sky_model = Prefetching_sky_model(observatory.sky_model, max_blocks=self.max_blocks)
+
+    def finish(self, observatory, scheduler, extra_info, filename):
+        prefetcher = observatory.sky_model
+        if not isinstance(prefetcher, Prefetching_sky_model):
+            return
+        prefetcher.close()
+        observatory.sky_model = prefetcher.current
+        stats = prefetcher.stats()
+        stats['stall seconds'] = round(stats['stall seconds'], 3)
+        stats['background seconds'] = round(stats['background seconds'], 3)
+        extra_info['sky prefetch'] = json.dumps(stats)
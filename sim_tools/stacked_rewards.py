@@ -0,0 +1,198 @@
+"""
+Evaluate the basis functions of a whole tier of surveys at once, as one stack.
+
+Each Blob_survey and Greedy_survey sums weight * basis function over its own list, so
+the blob and greedy surveys made for each filter evaluate overlapping maps over and over.
+With Stacked_reward_monitor, the first time the scheduler asks a survey of a tier for its
+reward in a step, every feasible survey of that tier is handled together:
+
+- every distinct basis function object in the tier is evaluated once, into a
+  (n_unique + 1, npix) stack (the last row is zeros, for padding),
+- each survey's list becomes a row of indices into the stack and a row of weights, and
+- all the surveys' sums are computed together, one basis function position at a time:
+  total += stack[index[:, p]] * weights[:, p].
+
+A single weights-matrix product would add the terms in a different order (and with
+BLAS, differently rounded), which can flip near-ties between fields. Going position by
+position keeps each survey's additions in its own order, so the sums are bit-for-bit the
+same as the survey's own loop. NaN (out of bounds) and infinite values propagate exactly
+as they do there.
+
+The survey's own calc_reward_function is then run with its basis functions swapped for
+two stand-ins: the summed map (weight 1) and, if the survey has weight-0 mask basis
+functions, a map that is 0 where any of them is 0 (weight 0). Everything after the sum,
+such as Blob_survey turning the weight-0 masks into NaN, smoothing and area cuts, is done
+by the survey's own code as usual. A survey with a weight-0 basis function that returns a
+scalar is left to its own code entirely, since Blob_survey's loop only masks the first
+pixel for a scalar 0.
+
+Basis functions are only shared when they are the same object, so use --intern_bfs to
+get the most out of this.
+"""
+import json
+import time
+import numpy as np
+from .monitors import Run_monitor
+
+
+__all__ = ['stacked_classes', 'Stacked_reward_monitor']
+
+# Survey classes whose reward is the weighted sum of their basis functions
+stacked_classes = ['Greedy_survey', 'Blob_survey']
+
+
+class _Fixed_basis_function(object):
+    """Stands in for a survey's basis functions, returning a precomputed map"""
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, conditions, indx=None):
+        return self.value
+
+    def check_feasibility(self, conditions):
+        return True
+
+
+def _stackable(survey):
+    return any([cls.__name__ in stacked_classes for cls in type(survey).__mro__])
+
+
+class Stacked_reward_monitor(Run_monitor):
+    """
+    Evaluate the rewards of each tier's Greedy and Blob surveys as one stack
+
+    Counts of tiers stacked, surveys stacked, basis functions evaluated against those
+    the surveys hold, surveys left to their own code and the seconds spent go in
+    extra_info as 'stacked rewards'.
+    """
+    def __init__(self):
+        self.tiers = []
+        self.tier_of = {}
+        self.patched = []
+        self.step_key = None
+        self.stacked = {}
+        self.inside = False
+        self.counts = {'tiers': 0, 'surveys': 0, 'bf evaluated': 0, 'bf held': 0, 'not stacked': 0,
+                       'seconds': 0.}
+
+    def _wrap(self, func):
+        monitor = self
+
+        def calc_reward_function(survey, conditions, *args, **kwargs):
+            tier = monitor.tier_of.get(id(survey))
+            if monitor.inside or tier is None or len(args) > 0 or len(kwargs) > 0:
+                return func(survey, conditions, *args, **kwargs)
+            key = (id(conditions), conditions.mjd)
+            if key != monitor.step_key:
+                monitor.step_key = key
+                monitor.stacked = {}
+            if id(survey) not in monitor.stacked:
+                monitor.stack_tier(tier, conditions)
+            entry = monitor.stacked.pop(id(survey))
+            if entry is None:
+                return func(survey, conditions)
+            total, mask = entry
+            basis_functions = survey.basis_functions
+            basis_weights = survey.basis_weights
+            survey.basis_functions = [_Fixed_basis_function(total)]
+            survey.basis_weights = [1.]
+            if mask is not None:
+                survey.basis_functions.append(_Fixed_basis_function(mask))
+                survey.basis_weights.append(0.)
+            monitor.inside = True
+            try:
+                return func(survey, conditions)
+            finally:
+                monitor.inside = False
+                survey.basis_functions = basis_functions
+                survey.basis_weights = basis_weights
+        return calc_reward_function
+
+    def stack_tier(self, tier, conditions):
+        t0 = time.time()
+        surveys = self.tiers[tier]
+        for survey in surveys:
+            self.stacked[id(survey)] = None
+        feasible = [survey for survey in surveys if survey._check_feasibility(conditions)]
+        if len(feasible) == 0:
+            return
+        npix = 12 * feasible[0].nside**2
+        indx = np.arange(npix)
+        rows = []
+        row_of = {}
+        lists = []
+        for survey in feasible:
+            lists.append([])
+            for basis_function in survey.basis_functions:
+                if id(basis_function) not in row_of:
+                    row_of[id(basis_function)] = len(rows)
+                    rows.append(basis_function(conditions, indx=indx))
+                lists[-1].append(row_of[id(basis_function)])
+
+        # Only stack plain float64 maps (or scalars), where the sum is sure to match
+        usable = []
+        scalar = []
+        for row in rows:
+            if isinstance(row, np.ndarray):
+                usable.append(type(row) is np.ndarray and row.dtype == np.float64 and row.shape == (npix,))
+            else:
+                usable.append(isinstance(row, (int, float, np.floating, np.integer)))
+            scalar.append(np.ndim(row) == 0)
+        # A scalar from a weight-0 mask would only mask pixel 0 in Blob_survey's own loop,
+        # so a survey with one is left to its own code
+        chosen = [i for i, survey in enumerate(feasible) if
+                  survey.nside == feasible[0].nside and all([usable[j] for j in lists[i]]) and
+                  not any([scalar[j] for j, weight in zip(lists[i], survey.basis_weights) if weight == 0])]
+        self.counts['not stacked'] += len(feasible) - len(chosen)
+        if len(chosen) == 0:
+            return
+
+        stack = np.zeros((len(rows) + 1, npix))
+        for j, row in enumerate(rows):
+            if usable[j]:
+                stack[j] = row
+        n_positions = max([len(lists[i]) for i in chosen])
+        index = np.zeros((len(chosen), n_positions), dtype=int) + len(rows)
+        weights = np.zeros((len(chosen), n_positions))
+        for k, i in enumerate(chosen):
+            index[k, :len(lists[i])] = lists[i]
+            weights[k, :len(lists[i])] = feasible[i].basis_weights
+        total = np.zeros((len(chosen), npix))
+        for p in range(n_positions):
+            total += stack[index[:, p]] * weights[:, p][:, np.newaxis]
+
+        for k, i in enumerate(chosen):
+            mask = None
+            zero_weight = [j for j, weight in zip(lists[i], feasible[i].basis_weights) if weight == 0]
+            if len(zero_weight) > 0:
+                mask = np.ones(npix)
+                for j in zero_weight:
+                    mask[np.where(stack[j] == 0)] = 0
+            self.stacked[id(feasible[i])] = (total[k], mask)
+        self.counts['tiers'] += 1
+        self.counts['surveys'] += len(chosen)
+        self.counts['bf evaluated'] += len(rows)
+        self.counts['bf held'] += sum([len(lists[i]) for i in range(len(feasible))])
+        self.counts['seconds'] += time.time() - t0
+
+    def start(self, observatory, scheduler):
+        for tier, survey_list in enumerate(scheduler.survey_lists):
+            surveys = [survey for survey in survey_list if _stackable(survey)]
+            self.tiers.append(surveys)
+            for survey in surveys:
+                self.tier_of[id(survey)] = tier
+                cls = type(survey)
+                if cls not in [val[0] for val in self.patched]:
+                    self.patched.append((cls, cls.__dict__.get('calc_reward_function')))
+                    cls.calc_reward_function = self._wrap(cls.calc_reward_function)
+
+    def finish(self, observatory, scheduler, extra_info, filename):
+        for cls, original in self.patched[::-1]:
+            if original is None:
+                del cls.calc_reward_function
+            else:
+                cls.calc_reward_function = original
+        self.patched = []
+        counts = dict(self.counts)
+        counts['seconds'] = round(counts['seconds'], 3)
+        extra_info['stacked rewards'] = json.dumps(counts)
@@ -0,0 +1,294 @@
+"""
+Run a file of driver commands from a single process, sharing the read-only observatory data.
+
+Example, in place of `cat monster.sh | parallel -j 20`:
+
+    python -m sim_tools.sweep monster.sh --processes 20 --log_dir logs
+
+Each line of the command file is a normal driver command (`python driver.py --args`).
+The executor builds a Model_observatory once, then forks a fresh worker for every command
+and runs the driver inside it as if it were __main__. The drivers get the pre-built
+observatory from sim_tools.shared.get_observatory, so its sky brightness, almanac and
+weather arrays are shared copy-on-write across the workers instead of being loaded again
+by each run. A worker only runs one command so every run starts from the untouched
+observatory.
+
+Before forking, the executor also imports every module the drivers in the command file
+import (healpy, astropy, featureScheduler, ...) and loads the observatory's first block
+of sky brightness, so a worker starts simulating almost straight away instead of
+repeating the imports and model setup. Modules that sit next to a driver (several
+directories have their own footprint_tune.py) are loaded from that directory and kept
+apart by directory, and each worker is given the ones from its own driver's directory.
+"""
+import os
+import gc
+import sys
+import ast
+import json
+import time
+import importlib
+import importlib.util
+import shlex
+import runpy
+import argparse
+import traceback
+import multiprocessing
+from .shared import register_observatory, get_observatory
+
+
+__all__ = ['read_commands', 'driver_imports', 'preload', 'preload_local', 'run_sweep']
+
+# Modules preloaded from the drivers' own directories, {directory: {name: module}}
+_local_modules = {}
+
+
+def read_commands(filename):
+    """
+    Read a file of driver commands
+
+    Blank lines and lines starting with # are skipped. A leading python executable is
+    dropped, so each command comes back as [driver, arg1, arg2, ...].
+    """
+    commands = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            argv = shlex.split(line)
+            if os.path.basename(argv[0]).startswith('python'):
+                argv = argv[1:]
+            commands.append(argv)
+    return commands
+
+
+def driver_imports(filenames):
+    """
+    Names of the modules imported by some driver scripts
+
+    Imports inside functions or the __main__ block are included too, since those run
+    for every command anyway. Relative imports are skipped.
+    """
+    modules = []
+    for filename in filenames:
+        with open(filename) as f:
+            tree = ast.parse(f.read(), filename=filename)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                if name not in modules:
+                    modules.append(name)
+    return modules
+
+
+def preload(modules, verbose=True):
+    """
+    Import modules now so forked workers inherit them
+
+    A module that fails to import is skipped; the driver that needs it will hit the
+    same error in its own worker and report it there.
+
+    Returns
+    -------
+    loaded : list of str
+    """
+    loaded = []
+    for name in modules:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except Exception as err:
+            if verbose:
+                print('Not preloading %s: %s' % (name, err))
+    return loaded
+
+
+def _local_file(dirname, name):
+    """The file in dirname that import name would load first, or None"""
+    base = os.path.join(dirname, name.split('.')[0])
+    for filename in [base + '.py', os.path.join(base, '__init__.py')]:
+        if os.path.isfile(filename):
+            return filename
+    return None
+
+
+def preload_local(dirname, modules, verbose=True):
+    """
+    Import the modules that live in a driver's own directory, without leaving them in sys.modules
+
+    They are imported with dirname first on sys.path, as they would be when running the
+    driver, then taken back out of sys.modules so a module of the same name next to
+    another driver isn't mistaken for them.
+
+    Returns
+    -------
+    loaded : dict
+        The imported modules, by name, including any other modules from dirname they
+        imported in turn
+    """
+    loaded = {}
+    before = set(sys.modules)
+    sys.path.insert(0, dirname)
+    try:
+        for name in modules:
+            try:
+                importlib.import_module(name)
+            except Exception as err:
+                if verbose:
+                    print('Not preloading %s from %s: %s' % (name, dirname, err))
+    finally:
+        sys.path.remove(dirname)
+    for name in set(sys.modules) - before:
+        filename = getattr(sys.modules[name], '__file__', None)
+        if filename is not None and os.path.abspath(filename).startswith(dirname + os.sep):
+            loaded[name] = sys.modules.pop(name)
+    return loaded
+
+
+def _use_local_modules(dirname):
+    """Swap in the modules preloaded from dirname, and out those from other directories"""
+    for modules in _local_modules.values():
+        for name, module in modules.items():
+            if sys.modules.get(name) is module:
+                del sys.modules[name]
+    sys.modules.update(_local_modules.get(dirname, {}))
+
+
+def _run_command(argv, log_file=None, timing_file=None):
+    """
+    Run one driver command as __main__ in this process
+
+    Returns
+    -------
+    exit_code : int
+    startup : float
+        Seconds from the worker starting to the first observation, or None if unknown
+    """
+    forked = time.time()
+    if log_file is not None:
+        log = open(log_file, 'w')
+        sys.stdout = log
+        sys.stderr = log
+    sys.argv = list(argv)
+    # As python driver.py would, so drivers can import the modules next to them
+    sys.path[0] = os.path.dirname(os.path.abspath(argv[0]))
+    _use_local_modules(sys.path[0])
+    if timing_file is not None:
+        sys.argv += ['--timing_file', timing_file]
+    print(' '.join(sys.argv))
+    exit_code = 0
+    try:
+        runpy.run_path(argv[0], run_name='__main__')
+    except SystemExit as err:
+        if err.code not in (None, 0):
+            exit_code = err.code if isinstance(err.code, int) else 1
+    except Exception:
+        traceback.print_exc()
+        exit_code = 1
+    startup = None
+    if timing_file is not None and os.path.isfile(timing_file):
+        with open(timing_file) as f:
+            startup = json.load(f)['loop_start'] - forked
+        print('Startup %.2f s' % startup)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return exit_code, startup
+
+
+def run_sweep(commands, processes=1, nside=32, log_dir=None, preload_imports=True, timing_dir=None):
+    """
+    Run driver commands in forked workers that share one pre-built observatory
+
+    Parameters
+    ----------
+    commands : list of lists
+        Driver commands, as returned by read_commands
+    processes : int (1)
+        Number of commands to run at once
+    nside : int (32)
+        The nside of the shared observatory. Drivers asking for a different nside build
+        their own.
+    log_dir : str (None)
+        If set, the output of each command goes to log_dir/<line number>.log
+    preload_imports : bool (True)
+        Import everything the drivers import before forking.
+    timing_dir : str (None)
+        If set, each command is run with --timing_file timing_dir/<line number>.json and
+        its startup time (worker start to first observation) is returned.
+
+    Returns
+    -------
+    exit_codes : list of int
+    startups : list of float
+        Startup time of each command (None without timing_dir)
+    """
+    if preload_imports:
+        drivers = sorted(set([os.path.abspath(command[0]) for command in commands]))
+        sweep_path = sys.path[0]
+        for dirname in sorted(set([os.path.dirname(driver) for driver in drivers])):
+            modules = driver_imports([driver for driver in drivers if os.path.dirname(driver) == dirname])
+            local = [name for name in modules if _local_file(dirname, name) is not None]
+            # Import with the path the drivers' workers will have
+            sys.path[0] = dirname
+            preload([name for name in modules if name not in local])
+            _local_modules[dirname] = preload_local(dirname, local)
+        sys.path[0] = sweep_path
+    observatory = get_observatory(nside=nside)
+    # Load the first sky brightness block and almanac lookups now rather than in every worker
+    observatory.return_conditions()
+    register_observatory(observatory, nside)
+    for dirname in [log_dir, timing_dir]:
+        if dirname is not None and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+    log_files = [None] * len(commands)
+    if log_dir is not None:
+        log_files = [os.path.join(log_dir, '%04i.log' % i) for i in range(len(commands))]
+    timing_files = [None] * len(commands)
+    if timing_dir is not None:
+        timing_files = [os.path.join(timing_dir, '%04i.json' % i) for i in range(len(commands))]
+
+    # Keep the garbage collector from touching (and so copying) the parent's objects in the workers
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+    context = multiprocessing.get_context('fork')
+    pool = context.Pool(processes, maxtasksperchild=1)
+    results = pool.starmap(_run_command, zip(commands, log_files, timing_files), chunksize=1)
+    pool.close()
+    pool.join()
+    exit_codes = [result[0] for result in results]
+    startups = [result[1] for result in results]
+    return exit_codes, startups
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a file of driver commands sharing one observatory")
+    parser.add_argument("command_file", type=str)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--nside", type=int, default=32)
+    parser.add_argument("--log_dir", type=str, default=None)
+    parser.add_argument("--no_preload", dest='preload', action='store_false',
+                        help="Don't import the drivers' modules before forking")
+    parser.set_defaults(preload=True)
+    parser.add_argument("--timing_dir", type=str, default=None,
+                        help="Record each run's timing here and report startup times")
+    args = parser.parse_args()
+
+    commands = read_commands(args.command_file)
+    exit_codes, startups = run_sweep(commands, processes=args.processes, nside=args.nside, log_dir=args.log_dir,
+                                     preload_imports=args.preload, timing_dir=args.timing_dir)
+    startups = [startup for startup in startups if startup is not None]
+    if len(startups) > 0:
+        print('Startup per run: median %.2f s, max %.2f s' % (sorted(startups)[len(startups)//2], max(startups)))
+    failed = [' '.join(command) for command, code in zip(commands, exit_codes) if code != 0]
+    print('Ran %i commands, %i failed' % (len(commands), len(failed)))
+    for command in failed:
+        print('FAILED: ' + command)
+    if len(failed) > 0:
+        raise SystemExit(1)
@@ -0,0 +1,98 @@
+"""
+Count the survey evaluations that tiering saves.
+
+The drivers hand Core_scheduler tiered lists like [ddfs, blobs, greedy] or
+[ddfs, prevent_gaps, blobs, greedy]. When the scheduler fills its queue it asks the
+surveys of one tier for their rewards, and only goes on to the next tier if none of them
+has a finite reward, so a lower tier is never evaluated once a higher one has a winner.
+Tier_monitor checks that this is what happens, and shows what it is worth, by counting
+which surveys were actually asked for a reward each time the queue was filled.
+
+The counts go in extra_info as 'tiers': the number of queue fills, survey evaluations
+made and avoided (against evaluating every tier every time), and for each tier, its
+number of surveys, how often it was evaluated and how often it supplied the winner.
+"""
+import json
+from .monitors import Run_monitor
+
+
+__all__ = ['Tier_monitor']
+
+
+class Tier_monitor(Run_monitor):
+    """
+    Count the surveys evaluated and skipped each time the scheduler fills its queue
+    """
+    def __init__(self):
+        self.tier_of = {}
+        self.tier_sizes = []
+        self.patched = []
+        self.evaluated = None
+        self.counts = {'fills': 0, 'evaluated': 0, 'avoided': 0}
+        self.tier_counts = []
+
+    def _wrap_fill_queue(self, func):
+        monitor = self
+
+        def _fill_queue(scheduler, *args, **kwargs):
+            if monitor.evaluated is not None:
+                return func(scheduler, *args, **kwargs)
+            monitor.evaluated = set()
+            try:
+                result = func(scheduler, *args, **kwargs)
+            finally:
+                evaluated = monitor.evaluated
+                monitor.evaluated = None
+            monitor.fill(scheduler, evaluated)
+            return result
+        return _fill_queue
+
+    def _wrap_calc_reward_function(self, func):
+        monitor = self
+
+        def calc_reward_function(survey, *args, **kwargs):
+            if monitor.evaluated is not None:
+                monitor.evaluated.add(id(survey))
+            return func(survey, *args, **kwargs)
+        return calc_reward_function
+
+    def fill(self, scheduler, evaluated):
+        self.counts['fills'] += 1
+        n_evaluated = 0
+        for tier, size in enumerate(self.tier_sizes):
+            n_tier = len([key for key in evaluated if self.tier_of.get(key) == tier])
+            if n_tier > 0:
+                self.tier_counts[tier]['evaluated'] += 1
+            n_evaluated += n_tier
+        self.counts['evaluated'] += n_evaluated
+        self.counts['avoided'] += sum(self.tier_sizes) - n_evaluated
+        tier = scheduler.survey_index[0]
+        if tier is not None and len(scheduler.queue) > 0:
+            self.tier_counts[tier]['won'] += 1
+
+    def start(self, observatory, scheduler):
+        self.tier_sizes = [len(survey_list) for survey_list in scheduler.survey_lists]
+        self.tier_counts = [{'surveys': size, 'evaluated': 0, 'won': 0} for size in self.tier_sizes]
+        for tier, survey_list in enumerate(scheduler.survey_lists):
+            for survey in survey_list:
+                self.tier_of[id(survey)] = tier
+                cls = type(survey)
+                if cls not in [val[0] for val in self.patched]:
+                    self.patched.append((cls, 'calc_reward_function', cls.__dict__.get('calc_reward_function')))
+                    cls.calc_reward_function = self._wrap_calc_reward_function(cls.calc_reward_function)
+        cls = type(scheduler)
+        self.patched.append((cls, '_fill_queue', cls.__dict__.get('_fill_queue')))
+        cls._fill_queue = self._wrap_fill_queue(cls._fill_queue)
+
+    def finish(self, observatory, scheduler, extra_info, filename):
+        for cls, name, original in self.patched[::-1]:
+            if original is None:
+                delattr(cls, name)
+            else:
+                setattr(cls, name, original)
+        self.patched = []
+        counts = dict(self.counts)
+        total = counts['evaluated'] + counts['avoided']
+        counts['avoided fraction'] = round(float(counts['avoided']) / total, 4) if total > 0 else 0.
+        counts['tiers'] = self.tier_counts
+        extra_info['tiers'] = json.dumps(counts)
@@ -0,0 +1,210 @@
+"""
+Record every scheduler decision, and find where two runs' decisions first differ.
+
+With --trace, each time the scheduler fills its queue the run records the mjd, the
+winning tier and survey, the survey's maximum reward, the first pointing of the new queue
+(RA, dec, filter), the queue length and a checksum of the whole queue. Records are
+written every night to <output>_trace.gz (gzip-compressed binary, see trace_dtype) with
+the survey names in <output>_trace.gz.json.
+
+To check that a change to survey or basis function code leaves the schedule alone, run
+the same driver before and after with --trace and compare:
+
+    python -m sim_tools.trace before/baseline_trace.gz after/baseline_trace.gz
+
+which reports the first decision that differs, with the decisions around it from both
+runs, and exits non-zero if there is one.
+"""
+import os
+import gzip
+import json
+import zlib
+import argparse
+import numpy as np
+from .monitors import Run_monitor
+
+
+__all__ = ['trace_dtype', 'Trace_recorder', 'read_trace', 'first_divergence']
+
+trace_dtype = np.dtype([('mjd', '<f8'), ('tier', '<i2'), ('survey', '<i2'), ('reward', '<f8'),
+                        ('RA', '<f8'), ('dec', '<f8'), ('filter', 'S1'), ('n_queue', '<i4'),
+                        ('queue_hash', '<u4')])
+
+
+def _survey_name(survey):
+    name = getattr(survey, 'survey_name', '')
+    return '%s %s' % (type(survey).__name__, name) if name else type(survey).__name__
+
+
+def _wrap_fill_queue(func, recorder):
+    def _fill_queue(scheduler, *args, **kwargs):
+        result = func(scheduler, *args, **kwargs)
+        recorder.decision(scheduler)
+        return result
+    return _fill_queue
+
+
+class Trace_recorder(Run_monitor):
+    """
+    Record each time the scheduler fills its queue
+
+    Parameters
+    ----------
+    filename : str
+        Trace file to write. Records at or after the start of the run are dropped from an
+        existing file, so a resumed run carries on the trace of the run it resumes.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.records = []
+        self.patched = None
+
+    def start(self, observatory, scheduler):
+        kept = np.zeros(0, dtype=trace_dtype)
+        if os.path.isfile(self.filename):
+            kept = read_trace(self.filename)
+            kept = kept[kept['mjd'] < observatory.mjd]
+        with gzip.open(self.filename, 'wb') as f:
+            f.write(kept.tobytes())
+        names = [[_survey_name(survey) for survey in survey_list] for survey_list in scheduler.survey_lists]
+        with open(self.filename + '.json', 'w') as f:
+            json.dump({'surveys': names, 'dtype': trace_dtype.descr}, f)
+        cls = type(scheduler)
+        self.patched = (cls, cls.__dict__.get('_fill_queue'))
+        cls._fill_queue = _wrap_fill_queue(cls._fill_queue, self)
+
+    def decision(self, scheduler):
+        record = np.zeros(1, dtype=trace_dtype)
+        record['mjd'] = scheduler.conditions.mjd
+        tier, index = scheduler.survey_index
+        queue = scheduler.queue
+        if tier is None or index is None or len(queue) == 0:
+            record['tier'] = -1
+            record['survey'] = -1
+            record['reward'] = np.nan
+        else:
+            record['tier'] = tier
+            record['survey'] = index
+            reward = getattr(scheduler.survey_lists[tier][index], 'reward', np.nan)
+            record['reward'] = np.nanmax(reward) if np.size(reward) > 0 else np.nan
+            record['RA'] = queue[0]['RA']
+            record['dec'] = queue[0]['dec']
+            record['filter'] = str(np.asarray(queue[0]['filter']).ravel()[0]).encode()
+            record['n_queue'] = len(queue)
+            record['queue_hash'] = zlib.crc32(b''.join([np.asarray(obs).tobytes() for obs in queue]))
+        self.records.append(record)
+
+    def flush(self):
+        if len(self.records) > 0:
+            # Each flush adds a gzip member, which gzip reads back as one stream
+            with gzip.open(self.filename, 'ab') as f:
+                f.write(np.concatenate(self.records).tobytes())
+            self.records = []
+
+    def night(self, night, observatory, scheduler):
+        self.flush()
+
+    def finish(self, observatory, scheduler, extra_info, filename):
+        if self.patched is not None:
+            cls, original = self.patched
+            if original is None:
+                del cls._fill_queue
+            else:
+                cls._fill_queue = original
+            self.patched = None
+        self.flush()
+        extra_info['decision trace'] = self.filename
+
+
+def read_trace(filename):
+    """
+    Returns
+    -------
+    records : numpy array of trace_dtype
+    """
+    with gzip.open(filename, 'rb') as f:
+        return np.frombuffer(f.read(), dtype=trace_dtype)
+
+
+def _match(rec1, rec2, reward_rtol):
+    for name in trace_dtype.names:
+        if name == 'reward':
+            if np.isnan(rec1[name]) and np.isnan(rec2[name]):
+                continue
+            if not np.isclose(rec1[name], rec2[name], rtol=reward_rtol, atol=0.):
+                return False
+        elif rec1[name] != rec2[name]:
+            return False
+    return True
+
+
+def first_divergence(trace1, trace2, reward_rtol=0.):
+    """
+    Index of the first decision that differs between two traces
+
+    Parameters
+    ----------
+    trace1, trace2 : numpy arrays of trace_dtype
+    reward_rtol : float (0)
+        Relative tolerance on the reward. Everything else must match exactly.
+
+    Returns
+    -------
+    index : int
+        None if the traces are the same
+    """
+    n_common = min(trace1.size, trace2.size)
+    # Compare the raw bytes first, then check the mismatches field by field
+    bytes1 = trace1[:n_common].view(np.uint8).reshape(n_common, -1)
+    bytes2 = trace2[:n_common].view(np.uint8).reshape(n_common, -1)
+    candidates = np.where(np.any(bytes1 != bytes2, axis=1))[0]
+    for indx in candidates:
+        if not _match(trace1[indx], trace2[indx], reward_rtol):
+            return int(indx)
+    if trace1.size != trace2.size:
+        return n_common
+    return None
+
+
+def _describe(record, names):
+    if record['tier'] < 0:
+        return '%.6f  no observation' % record['mjd']
+    try:
+        survey = names[record['tier']][record['survey']]
+    except (IndexError, TypeError):
+        survey = '%i/%i' % (record['tier'], record['survey'])
+    return '%.6f  %-40s reward %-12.6g RA %8.4f dec %8.4f %s  n=%i hash=%08x' % (
+        record['mjd'], survey[:40], record['reward'], np.degrees(record['RA']), np.degrees(record['dec']),
+        record['filter'].decode(), record['n_queue'], record['queue_hash'])
+
+
+def _names(filename):
+    if os.path.isfile(filename + '.json'):
+        with open(filename + '.json') as f:
+            return json.load(f)['surveys']
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the first decision where two traces differ")
+    parser.add_argument("trace1", type=str)
+    parser.add_argument("trace2", type=str)
+    parser.add_argument("--context", type=int, default=3, help="decisions to show either side")
+    parser.add_argument("--reward_rtol", type=float, default=0., help="relative tolerance on rewards")
+    args = parser.parse_args()
+
+    trace1 = read_trace(args.trace1)
+    trace2 = read_trace(args.trace2)
+    names1 = _names(args.trace1)
+    names2 = _names(args.trace2)
+    indx = first_divergence(trace1, trace2, reward_rtol=args.reward_rtol)
+    if indx is None:
+        print('Traces match: %i decisions' % trace1.size)
+        raise SystemExit(0)
+    print('First divergence at decision %i of %i/%i' % (indx, trace1.size, trace2.size))
+    for i in range(max(indx - args.context, 0), indx + args.context + 1):
+        marker = '>' if i == indx else ' '
+        for label, trace, names in [('1', trace1, names1), ('2', trace2, names2)]:
+            text = _describe(trace[i], names) if i < trace.size else '(end of trace)'
+            print('%s %6i %s %s' % (marker, i, label, text))
+    raise SystemExit(1)
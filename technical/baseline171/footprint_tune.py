@@ -1,19 +1,19 @@
 import numpy as np
 import matplotlib.pylab as plt
 import healpy as hp
-from lsst.sims.featureScheduler.modelObservatory import Model_observatory
 from lsst.sims.featureScheduler.schedulers import Core_scheduler, simple_filter_sched
 from lsst.sims.featureScheduler.utils import (standard_goals, NES_healpixels, Footprint,
                                               Footprints, ra_dec_hp_map, Step_slopes, magellanic_clouds_healpixels)
 import lsst.sims.featureScheduler.basis_functions as bf
 from lsst.sims.featureScheduler.surveys import (Greedy_survey, generate_dd_surveys,
                                                 Blob_survey)
-from lsst.sims.featureScheduler import sim_runner
 import lsst.sims.featureScheduler.detailers as detailers
 import sys
 import subprocess
 import os
 import argparse
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..'))
+from sim_tools import sim_runner, add_runner_args, runner_kwargs, preview_settings, get_observatory
 from astropy.coordinates import SkyCoord
 from astropy import units as u
 from lsst.utils import getPackageDir
@@ -71,11 +71,11 @@ def slice_wfd_area(nslice, target_map, scale_down_factor=0.2):
     return scaled_maps
 
 
-def wfd_half(target_map=None):
+def wfd_half(target_map=None, nside=32):
     """return Two maps that split the WFD in two dec bands
     """
     if target_map is None:
-        sg = combo_dust_fp()
+        sg = combo_dust_fp(nside=nside)
         target_map = sg['r'] + 0
     wfd_pix = np.where(target_map == 1)[0]
     wfd_map = target_map*0
@@ -136,7 +136,7 @@ def gen_greedy_surveys(nside=32, footprints=None,
 
     surveys = []
     detailer = detailers.Camera_rot_detailer(min_rot=np.min(camera_rot_limits), max_rot=np.max(camera_rot_limits))
-    wfd_halves = wfd_half()
+    wfd_halves = wfd_half(nside=nside)
     for filtername in filters:
         bfs = []
         bfs.append((bf.M5_diff_basis_function(filtername=filtername, nside=nside), m5_weight))
@@ -225,7 +225,7 @@ def generate_blobs(nside, nexp=1, footprints=None,
                           'twilight_scale': True}
 
     surveys = []
-    wfd_halves = wfd_half()
+    wfd_halves = wfd_half(nside=nside)
     times_needed = [pair_time, pair_time*2]
     for filtername, filtername2 in zip(filter1s, filter2s):
         detailer_list = []
@@ -308,18 +308,19 @@ def generate_blobs(nside, nexp=1, footprints=None,
 
 
 def run_sched(surveys, survey_length=365.25, nside=32, fileroot='baseline_', verbose=False,
-              extra_info=None, illum_limit=40.):
+              extra_info=None, illum_limit=40., observatory=None, **kwargs):
     years = np.round(survey_length/365.25)
     scheduler = Core_scheduler(surveys, nside=nside)
     n_visit_limit = None
     filter_sched = simple_filter_sched(illum_limit=illum_limit)
-    observatory = Model_observatory(nside=nside)
+    if observatory is None:
+        observatory = get_observatory(nside=nside)
     observatory, scheduler, observations = sim_runner(observatory, scheduler,
                                                       survey_length=survey_length,
                                                       filename=fileroot+'%iyrs.db' % years,
                                                       delete_past=True, n_visit_limit=n_visit_limit,
                                                       verbose=verbose, extra_info=extra_info,
-                                                      filter_scheduler=filter_sched)
+                                                      filter_scheduler=filter_sched, **kwargs)
 
 
 def make_rolling_footprints(mjd_start=59853.5, sun_RA_start=3.27717639, nslice=2, scale=0.8, nside=32):
@@ -337,12 +338,12 @@ def make_rolling_footprints(mjd_start=59853.5, sun_RA_start=3.27717639, nslice=2
         rolling = [up, down, down, down, down, down]
     all_slopes = [start + np.roll(rolling, i).tolist()+end for i in range(nslice)]
 
-    fp_non_wfd = Footprint(mjd_start, sun_RA_start=sun_RA_start)
+    fp_non_wfd = Footprint(mjd_start, sun_RA_start=sun_RA_start, nside=nside)
     rolling_footprints = []
     for i in range(nslice):
         step_func = Step_slopes(rise=all_slopes[i])
         rolling_footprints.append(Footprint(mjd_start, sun_RA_start=sun_RA_start,
-                                            step_func=step_func))
+                                            step_func=step_func, nside=nside))
 
     split_wfd_indices = slice_wfd_area_quad(hp_footprints)
     wfd = hp_footprints['r'] * 0
@@ -460,40 +461,40 @@ def combo_dust_fp(nside=32,
     return result
 
 
-def footprint_maker(fpid):
+def footprint_maker(fpid, nside=32):
 
     fps = []
     # 0 Defaults
-    fps.append(combo_dust_fp())
+    fps.append(combo_dust_fp(nside=nside))
     # 1 No northern stripe
-    fps.append(combo_dust_fp(north_weights={}))
+    fps.append(combo_dust_fp(nside=nside, north_weights={}))
     # 2 No north, bring in the WFD a bit. wfd_north_dec=7.8, wfd_south_dec=-70.2,
-    fps.append(combo_dust_fp(north_weights={},
+    fps.append(combo_dust_fp(nside=nside, north_weights={},
                              wfd_north_dec=8., wfd_south_dec=-67.4))
     # 3 No north, bring in the WFD a bit. Old footprint is -62.5 to 3.6, extend bridge south
-    fps.append(combo_dust_fp(north_weights={},
+    fps.append(combo_dust_fp(nside=nside, north_weights={},
                              wfd_north_dec=8., wfd_south_dec=-67.4,
                              outer_bridge_l=240, outer_bridge_width=20., outer_bridge_alt=13.))
 
     # 4 No north, bring WFD all the way down
-    fps.append(combo_dust_fp(north_weights={},
+    fps.append(combo_dust_fp(nside=nside, north_weights={},
                              wfd_north_dec=3.6, wfd_south_dec=-62.5,
                              outer_bridge_l=255, outer_bridge_width=33., outer_bridge_alt=30))
 
     # 5 and with bigger bridge
-    fps.append(combo_dust_fp(north_weights={},
+    fps.append(combo_dust_fp(nside=nside, north_weights={},
                              wfd_north_dec=8., wfd_south_dec=-67.4,
                              outer_bridge_l=240, outer_bridge_width=20., outer_bridge_alt=13.))
 
     # 6 
-    fps.append(combo_dust_fp(north_weights={},
+    fps.append(combo_dust_fp(nside=nside, north_weights={},
                              wfd_north_dec=8., wfd_south_dec=-67.4,
                              outer_bridge_l=260, outer_bridge_width=20., outer_bridge_alt=13.))
     # 7 no north, no SES
-    fps.append(combo_dust_fp(north_weights={}, ses_dist_eclip=0.))
+    fps.append(combo_dust_fp(nside=nside, north_weights={}, ses_dist_eclip=0.))
 
     # 8 heavy exgal
-    fps.append(combo_dust_fp(north_weights={}, ses_dist_eclip=0., outer_bridge_width=0,
+    fps.append(combo_dust_fp(nside=nside, north_weights={}, ses_dist_eclip=0., outer_bridge_width=0,
                              bulge_lon_span=0., bulge_alt_span=0., mc_wfd=False,
                              wfd_north_dec=12.5, wfd_south_dec=-70.4))
 
@@ -514,6 +515,8 @@ if __name__ == "__main__":
     parser.add_argument("--nexp", type=int, default=2)
     parser.add_argument("--fpid", type=int, default=0)
 
+    add_runner_args(parser)
+
     args = parser.parse_args()
     survey_length = args.survey_length  # Days
     outDir = args.outDir
@@ -525,6 +528,7 @@ if __name__ == "__main__":
     fpid = args.fpid
 
     nside = 32
+    nside, survey_length = preview_settings(args, nside, survey_length)
     per_night = True  # Dither DDF per night
     mixed_pairs = True  # For the blob scheduler
     camera_ddf_rot_limit = 75.
@@ -546,7 +550,7 @@ if __name__ == "__main__":
     file_end = 'v1.7.1'
 
     # Mark position of the sun at the start of the survey. Usefull for rolling cadence.
-    observatory = Model_observatory(nside=nside)
+    observatory = get_observatory(nside=nside)
     conditions = observatory.return_conditions()
     sun_ra_0 = conditions.sunRA  # radians
 
@@ -559,7 +563,7 @@ if __name__ == "__main__":
     #footprints = make_rolling_footprints(mjd_start=conditions.mjd_start,
     #                                     sun_RA_start=conditions.sun_RA_start, nslice=nslice, scale=scale,
     #                                     nside=nside)
-    fp_hp = footprint_maker(fpid)
+    fp_hp = footprint_maker(fpid, nside=nside)
     # In case we want to flag the wfd pixels later
     wfd_hp = np.where(fp_hp['r'] == 1)[0]
     footprints = Footprint(conditions.mjd_start, sun_RA_start=conditions.sun_RA_start, nside=nside)
@@ -571,4 +575,4 @@ if __name__ == "__main__":
     surveys = [ddfs, blobs, greedy]
     run_sched(surveys, survey_length=survey_length, verbose=verbose,
               fileroot=os.path.join(outDir, fileroot+file_end), extra_info=extra_info,
-              nside=nside)
+              nside=nside, observatory=observatory, **runner_kwargs(args))